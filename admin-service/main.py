@@ -1,18 +1,66 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from contextlib import aclosing, asynccontextmanager
+import html
+import json
 import socket
-import subprocess
 import os
 
-app = FastAPI()
+from monitor import DEFAULT_WINDOWS, LatencyMonitor
+from probe import InvalidTarget, ProbeEngine, ProbeEvent, ProbeQueueFull
+from shared.logs import setup_logging
+from shared.metrics import CONTENT_TYPE, MetricsMiddleware, Registry, http_histogram
+from shared.pages import Page, Template, page_response
+from shared.tracing import Tracer, TracingMiddleware, trace_query
 
-@app.get("/")
-async def root(request: Request):
-    # Get server's actual IP for debugging
-    hostname = socket.gethostname()
-    local_ip = socket.gethostbyname(hostname)
-    
-    return HTMLResponse(f"""
+# JSON logs written by a background thread; request handlers only enqueue (LOG_* env vars)
+setup_logging("admin-service")
+
+# Host identity does not change while the process runs: resolve it once
+HOSTNAME = socket.gethostname()
+LOCAL_IP = socket.gethostbyname(HOSTNAME)
+
+# Shared probe engine: caps concurrent probes and queues the rest (PROBE_* env vars)
+probes = ProbeEngine.from_env()
+# Background latency monitor for MONITOR_TARGETS (disabled when empty)
+monitor = LatencyMonitor.from_env(probes)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    monitor.start()
+    try:
+        yield
+    finally:
+        await monitor.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# Prometheus metrics served on /metrics
+metrics_registry = Registry()
+HTTP_REQUESTS = http_histogram(metrics_registry)
+PROBE_DURATION = metrics_registry.histogram(
+    "probe_duration_seconds", "Duration of /ping probes, queueing included.", ("method",)
+)
+app.add_middleware(MetricsMiddleware, histogram=HTTP_REQUESTS, router=app.router)
+
+# Request spans, continuing the trace started upstream (traceparent forwarded by nginx)
+tracer = Tracer.from_env("admin-service")
+app.add_middleware(TracingMiddleware, tracer=tracer, router=app.router)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(metrics_registry.render(), headers={"Content-Type": CONTENT_TYPE})
+
+@app.get("/traces")
+async def slow_traces(min_ms: float = 0.0, limit: int = 20):
+    """Recent requests that took at least min_ms milliseconds, with their trace IDs."""
+    return trace_query(tracer.collector, min_ms, limit)
+
+@app.get("/traces/{trace_id}")
+async def trace_spans(trace_id: str):
+    return {"trace_id": trace_id, "spans": tracer.collector.trace(trace_id)}
+
+ROOT_TEMPLATE = Template("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -43,18 +91,14 @@ async def root(request: Request):
     </body>
     </html>
     """)
+ROOT_PAGE = Page(ROOT_TEMPLATE.render(local_ip=LOCAL_IP, hostname=HOSTNAME), precompress=True)
 
-@app.get("/admin")
-async def admin(request: Request):
-    # Get the original client IP from X-Forwarded-For header
-    xff = request.headers.get("x-forwarded-for", "")
-    client_ip = xff.split(",")[0].strip() if xff else ""
-    
-    # Get server's actual IP
-    hostname = socket.gethostname()
-    local_ip = socket.gethostbyname(hostname)
-    
-    return HTMLResponse(f"""
+@app.get("/")
+async def root(request: Request):
+    # Fully static once the host identity is known: pre-rendered and pre-compressed at startup
+    return page_response(request, ROOT_PAGE)
+
+ADMIN_TEMPLATE = Template("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -78,37 +122,36 @@ async def admin(request: Request):
         <div class="debug">
             <strong>Debug Information:</strong><br>
             Admin Service IP: {local_ip}<br>
-            Client IP (from X-Forwarded-For): {client_ip or 'None'}<br>
-            All Request Headers: {dict(request.headers)}<br>
+            Client IP (from X-Forwarded-For): {client_ip}<br>
+            All Request Headers: {headers}<br>
             Rest is in progress, please come back later for more implementation on this route<br>
         </div>
     </body>
     </html>
-    """)
+    """).bind(local_ip=LOCAL_IP)
 
-@app.get("/ping")
-async def ping(request: Request, ip: str = "127.0.0.1"):
-    """
-    Usage: /ping?ip=8.8.8.8
-    """
+@app.get("/admin")
+async def admin(request: Request):
+    # Get the original client IP from X-Forwarded-For header
+    xff = request.headers.get("x-forwarded-for", "")
+    client_ip = xff.split(",")[0].strip() if xff else ""
     
-    try:
-        # This allows command injection via semicolons, pipes, etc.
-        print(ip)
-        command = f"ping -c 4 {ip}"
-        
-        # Execute the command unsafely
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=10)
-        
-        output = result.stdout
-        error = result.stderr
-        return_code = result.returncode
-        
-        # Get some system info for debugging
-        hostname = socket.gethostname()
-        local_ip = socket.gethostbyname(hostname)
-        
-        return HTMLResponse(f"""
+    # Only the request-dependent fields are spliced in; the rest of the page is pre-encoded
+    body = ADMIN_TEMPLATE.render(
+        client_ip=client_ip or 'None',
+        headers=dict(request.headers),
+    )
+    return page_response(request, Page(body, cache_control="no-store"))
+
+RTT_SUMMARY_TEMPLATE = """
+            <div class="info">
+                <p><strong>Round-trip summary ({method}):</strong></p>
+                <p>{sent} sent, {received} received, {loss}% loss</p>
+                <p>{rtt}</p>
+            </div>
+"""
+
+PING_TEMPLATE = Template("""
         <!DOCTYPE html>
         <html>
         <head>
@@ -133,43 +176,192 @@ async def ping(request: Request, ip: str = "127.0.0.1"):
                 <p>Command executed: <code>{command}</code></p>
                 <p>Return code: {return_code}</p>
             </div>
-            
+            {rtt_summary}
             <div class="form">
                 <h3>Ping Another IP:</h3>
                 <form method="get">
-                    <input type="text" name="ip" placeholder="Enter IP address" value="{ip}">
+                    <input type="text" name="ip" placeholder="Enter IP address" value="{target}">
                     <button type="submit">Ping</button>
                 </form>
                 <p><small>Example: 8.8.8.8 or google.com</small></p>
             </div>
             
-            {f'<h3>Command Output:</h3><div class="output">{output}</div>' if output else ''}
-            {f'<h3>Error Output:</h3><div class="error">{error}</div>' if error else ''}
+            {output_section}
+            {error_section}
             
             <p><a href="/">← Back to Admin Service</a></p>
         </body>
         </html>
-        """)
+        """).bind(local_ip=LOCAL_IP, hostname=HOSTNAME)
+
+@app.get("/ping")
+async def ping(request: Request, ip: str = "127.0.0.1", method: str | None = None, format: str = "html"):
+    """
+    Usage: /ping?ip=8.8.8.8 (add &format=json for structured results, &method=tcp for a TCP-connect probe)
+    """
+    
+    try:
+        # Probes run as asyncio subprocesses (argv list, no shell) or native TCP connects
+        label = method or probes.default_method()
+        with PROBE_DURATION.time(label if label in ("icmp", "tcp") else "invalid"), \
+                tracer.span("probe", method=label, target=ip):
+            result = await probes.run(ip, method)
+        summary = result.to_dict()
+        
+        if format == "json":
+            return JSONResponse(summary)
         
-    except subprocess.TimeoutExpired:
-        return HTMLResponse("""
+        if result.timed_out and not result.samples:
+            return HTMLResponse(f"""
         <!DOCTYPE html>
         <html>
         <head><title>Ping Service - Timeout</title></head>
         <body>
-            <p>The ping command timed out after 10 seconds.</p>
+            <p>{html.escape(result.error)}</p>
             <p><a href="/ping">← Try again</a></p>
         </body>
         </html>
         """)
+        
+        output = html.escape(result.output)
+        error = html.escape(result.error)
+        rtt = summary["rtt_ms"]
+        rtt_summary = RTT_SUMMARY_TEMPLATE.format(
+            method=result.method,
+            sent=result.sent,
+            received=result.received,
+            loss=result.loss,
+            rtt=f"rtt min/avg/max/mdev = {rtt['min']}/{rtt['avg']}/{rtt['max']}/{rtt['mdev']} ms" if rtt else "No replies received",
+        )
+        
+        return page_response(request, Page(PING_TEMPLATE.render(
+            command=html.escape(result.command),
+            return_code=result.return_code,
+            rtt_summary=rtt_summary,
+            target=html.escape(result.target),
+            output_section=f'<h3>Command Output:</h3><div class="output">{output}</div>' if output else '',
+            error_section=f'<h3>Error Output:</h3><div class="error">{error}</div>' if error else '',
+        ), cache_control="no-store"))
+        
+    except InvalidTarget as e:
+        if format == "json":
+            return JSONResponse({"error": str(e)}, status_code=400)
+        return HTMLResponse(f"""
+        <!DOCTYPE html>
+        <html>
+        <head><title>Ping Service - Invalid target</title></head>
+        <body>
+            <p>{html.escape(str(e))}</p>
+            <p><a href="/ping">← Try again</a></p>
+        </body>
+        </html>
+        """, status_code=400)
+    except ProbeQueueFull as e:
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": "1"})
     except Exception as e:
         return HTMLResponse(f"""
         <!DOCTYPE html>
         <html>
         <head><title>Ping Service - Error</title></head>
         <body>
-            <p>An error occurred: {str(e)}</p>
+            <p>An error occurred: {html.escape(str(e))}</p>
             <p><a href="/ping">← Try again</a></p>
         </body>
         </html>
         """)
+
+LIVE_PAGE_HEAD = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Ping Service - Live</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; }}
+                .info {{ background: #e7f3ff; padding: 15px; border: 1px solid #b8daff; border-radius: 5px; margin: 10px 0; }}
+                .output {{ background: #f8f9fa; padding: 15px; border: 1px solid #dee2e6; border-radius: 5px; font-family: monospace; white-space: pre-wrap; }}
+            </style>
+        </head>
+        <body>
+            <h1>\U0001f4e1 Network Ping Service (live)</h1>
+            <h3>Probing {target}:</h3>
+            <div class="output">"""
+
+def sse_event(event: ProbeEvent) -> str:
+    if event.kind == "summary":
+        data = event.result.to_dict()
+    elif event.kind == "sample":
+        data = {"rtt_ms": event.rtt_ms}
+    else:
+        data = {"line": event.line}
+    return f"event: {event.kind}\ndata: {json.dumps(data)}\n\n"
+
+def html_event(event: ProbeEvent) -> str:
+    if event.kind == "line":
+        return html.escape(event.line) + "\n"
+    if event.kind == "summary":
+        summary = event.result.to_dict()
+        rtt = summary["rtt_ms"]
+        return "</div>" + RTT_SUMMARY_TEMPLATE.format(
+            method=event.result.method,
+            sent=event.result.sent,
+            received=event.result.received,
+            loss=event.result.loss,
+            rtt=f"rtt min/avg/max/mdev = {rtt['min']}/{rtt['avg']}/{rtt['max']}/{rtt['mdev']} ms" if rtt else "No replies received",
+        ) + '<p><a href="/ping">← Back to Ping Service</a></p></body></html>'
+    return ""
+
+@app.get("/ping/stream")
+async def ping_stream(ip: str = "127.0.0.1", method: str | None = None, format: str = "sse"):
+    """
+    Usage: /ping/stream?ip=8.8.8.8 (Server-Sent Events) or &format=html (chunked page)
+    
+    Each reply line and RTT sample is sent as soon as it arrives, followed by a summary.
+    If the client disconnects, the stream is cancelled and the probe is stopped.
+    """
+    events = probes.stream(ip, method)
+    try:
+        # Pull the first event now so invalid targets and a full queue still get a proper status code
+        first = await events.__anext__()
+    except InvalidTarget as e:
+        await events.aclose()
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except ProbeQueueFull as e:
+        await events.aclose()
+        return JSONResponse({"error": str(e)}, status_code=429, headers={"Retry-After": "1"})
+    
+    render = html_event if format == "html" else sse_event
+    
+    async def body():
+        async with aclosing(events):
+            if format == "html":
+                yield LIVE_PAGE_HEAD.format(target=html.escape(ip))
+            yield render(first)
+            async for event in events:
+                yield render(event)
+    
+    if format == "html":
+        return StreamingResponse(body(), media_type="text/html; charset=utf-8")
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/ping/stats")
+async def ping_stats(target: str | None = None, window: str | None = None):
+    """
+    Usage: /ping/stats?target=8.8.8.8&window=60,300,3600
+    
+    RTT percentiles (p50/p95/p99), jitter and loss for the monitored targets
+    over the selected windows, in seconds.
+    """
+    if target is not None and target not in monitor.series:
+        return JSONResponse({"error": f"'{target}' is not a monitored target"}, status_code=404)
+    try:
+        windows = [float(w) for w in window.split(",")] if window else DEFAULT_WINDOWS
+    except ValueError:
+        return JSONResponse({"error": "window must be a comma-separated list of seconds"}, status_code=400)
+    return {
+        "interval_s": monitor.interval,
+        "targets": monitor.stats(target, windows),
+    }
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+
+from probe import InvalidTarget, ProbeEngine, ProbeQueueFull, validate_target
+
+logger = logging.getLogger(__name__)
+
+# Windows reported by /ping/stats when none are requested (seconds)
+DEFAULT_WINDOWS = (60, 300, 3600)
+
+
+class RingSeries:
+    """
+    Fixed-capacity ring buffer of timestamped values backed by NumPy arrays.
+
+    Memory is allocated once; when full, the oldest values are overwritten.
+    """
+
+    def __init__(self, capacity: int, dtype=np.float64):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros(capacity, dtype=dtype)
+        self.head = 0
+        self.size = 0
+
+    def extend(self, ts: float, values) -> None:
+        values = np.asarray(values, dtype=self.values.dtype)[-self.capacity:]
+        if not values.size:
+            return
+        idx = (self.head + np.arange(values.size)) % self.capacity
+        self.ts[idx] = ts
+        self.values[idx] = values
+        self.head = (self.head + values.size) % self.capacity
+        self.size = min(self.size + values.size, self.capacity)
+
+    def window(self, since: float) -> tuple[np.ndarray, np.ndarray]:
+        """(timestamps, values) newer than `since`, oldest first."""
+        if self.size < self.capacity:
+            ts, values = self.ts[:self.size], self.values[:self.size]
+        else:
+            ts = np.concatenate((self.ts[self.head:], self.ts[:self.head]))
+            values = np.concatenate((self.values[self.head:], self.values[:self.head]))
+        mask = ts >= since
+        return ts[mask], values[mask]
+
+
+class TargetSeries:
+    """RTT samples and per-round sent/received counts for one target."""
+
+    def __init__(self, capacity: int, rounds: int):
+        self.rtt = RingSeries(capacity, np.float32)
+        self.sent = RingSeries(rounds, np.int32)
+        self.received = RingSeries(rounds, np.int32)
+        self.last_probe: float | None = None
+        self.last_error = ""
+
+    def record(self, ts: float, samples: list[float], sent: int) -> None:
+        self.rtt.extend(ts, samples)
+        self.sent.extend(ts, [sent])
+        self.received.extend(ts, [len(samples)])
+        self.last_probe = ts
+
+    def stats(self, window: float, now: float) -> dict:
+        since = now - window
+        _, rtt = self.rtt.window(since)
+        _, sent = self.sent.window(since)
+        _, received = self.received.window(since)
+        total_sent = int(sent.sum())
+        result = {
+            "window_s": window,
+            "rounds": int(sent.size),
+            "samples": int(rtt.size),
+            "loss_pct": round(100.0 * (1 - received.sum() / total_sent), 2) if total_sent else None,
+        }
+        if rtt.size:
+            p50, p95, p99 = np.percentile(rtt, (50, 95, 99))
+            result.update({
+                "min_ms": round(float(rtt.min()), 3),
+                "max_ms": round(float(rtt.max()), 3),
+                "mean_ms": round(float(rtt.mean()), 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                # Mean absolute difference between consecutive samples (RFC 3550 style)
+                "jitter_ms": round(float(np.abs(np.diff(rtt)).mean()), 3) if rtt.size > 1 else 0.0,
+            })
+        return result
+
+
+class LatencyMonitor:
+    """
+    Probes a fixed list of targets every `interval` seconds in the background
+    and keeps the results in per-target ring buffers.
+    """
+
+    def __init__(self, engine: ProbeEngine, targets: list[str], interval: float = 10.0,
+                 capacity: int = 8640, count: int = 3, method: str | None = None):
+        self.engine = engine
+        self.targets = [validate_target(target) for target in targets]
+        self.interval = interval
+        self.count = count
+        self.method = method
+        # Size the per-round ring to cover the same time span as the sample ring
+        rounds = max(capacity // max(count, 1), 1)
+        self.series = {target: TargetSeries(capacity, rounds) for target in self.targets}
+        self._task: asyncio.Task | None = None
+
+    @classmethod
+    def from_env(cls, engine: ProbeEngine) -> "LatencyMonitor":
+        targets = [t for t in os.getenv("MONITOR_TARGETS", "").split(",") if t.strip()]
+        return cls(
+            engine,
+            targets,
+            interval=float(os.getenv("MONITOR_INTERVAL", "10")),
+            capacity=int(os.getenv("MONITOR_CAPACITY", "8640")),
+            count=int(os.getenv("MONITOR_COUNT", "3")),
+            method=os.getenv("MONITOR_METHOD") or None,
+        )
+
+    async def probe(self, target: str) -> None:
+        series = self.series[target]
+        try:
+            result = await self.engine.run(target, self.method, self.count)
+        except (InvalidTarget, ProbeQueueFull) as e:
+            # Skipped rounds are not counted as loss
+            series.last_error = str(e)
+            return
+        except Exception as e:
+            # An unexpected failure (e.g. EMFILE when spawning ping) must not end the monitor
+            logger.exception("Probe of %s failed", target, extra={"sample_key": target})
+            series.last_error = f"{type(e).__name__}: {e}"
+            return
+        series.record(time.time(), result.samples, result.sent)
+        series.last_error = result.error
+
+    async def _loop(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.gather(*(self.probe(target) for target in self.targets))
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def start(self) -> None:
+        if self.targets:
+            logger.info("Latency monitor probing %s every %ss", ", ".join(self.targets), self.interval)
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self, target: str | None = None, windows=DEFAULT_WINDOWS) -> dict:
+        now = time.time()
+        targets = [target] if target else self.targets
+        return {
+            name: {
+                "last_probe": self.series[name].last_probe,
+                "last_error": self.series[name].last_error,
+                "windows": [self.series[name].stats(window, now) for window in windows],
+            }
+            for name in targets
+        }
@@ -0,0 +1,240 @@
+import asyncio
+import ipaddress
+import os
+import re
+import shutil
+import statistics
+import time
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+# RFC 1123 hostname: dot-separated labels of letters, digits and inner hyphens
+HOSTNAME_RE = re.compile(r"^(?=.{1,253}$)([a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)(\.[a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*\.?$")
+PING_TIME_RE = re.compile(r"time[=<]([\d.]+)\s*ms")
+
+PING_BINARY = shutil.which("ping")
+
+
+class InvalidTarget(ValueError):
+    pass
+
+
+class ProbeQueueFull(Exception):
+    pass
+
+
+def validate_target(target: str) -> str:
+    """Return the target if it is an IP address or a hostname, raise InvalidTarget otherwise."""
+    target = target.strip()
+    try:
+        return str(ipaddress.ip_address(target))
+    except ValueError:
+        pass
+    if not HOSTNAME_RE.match(target):
+        raise InvalidTarget(f"Invalid target '{target}': expected an IP address or a hostname")
+    return target
+
+
+@dataclass
+class ProbeResult:
+    target: str
+    method: str
+    command: str
+    sent: int = 0
+    samples: list[float] = field(default_factory=list)
+    output: str = ""
+    error: str = ""
+    return_code: int | None = None
+    timed_out: bool = False
+
+    @property
+    def received(self) -> int:
+        return len(self.samples)
+
+    @property
+    def loss(self) -> float:
+        return round(100.0 * (self.sent - self.received) / self.sent, 1) if self.sent else 100.0
+
+    def to_dict(self) -> dict:
+        samples = self.samples
+        return {
+            "target": self.target,
+            "method": self.method,
+            "command": self.command,
+            "sent": self.sent,
+            "received": self.received,
+            "loss": self.loss,
+            "rtt_ms": {
+                "min": min(samples),
+                "avg": round(statistics.fmean(samples), 3),
+                "max": max(samples),
+                "mdev": round(statistics.pstdev(samples), 3),
+            } if samples else None,
+            "samples": samples,
+            "return_code": self.return_code,
+            "timed_out": self.timed_out,
+            "error": self.error,
+        }
+
+
+@dataclass
+class ProbeEvent:
+    """One step of a running probe: an output line, an RTT sample or the final summary."""
+    kind: str
+    line: str = ""
+    rtt_ms: float | None = None
+    result: ProbeResult | None = None
+
+
+class ProbeEngine:
+    """
+    Runs probes without blocking the event loop.
+
+    At most `concurrency` probes run at once; up to `max_queue` more wait for
+    a slot, beyond that ProbeQueueFull is raised. ICMP probes run the system
+    ping through an argv list (no shell); TCP probes time a connect() to
+    `tcp_port` and are used when ping is not installed.
+    """
+
+    def __init__(self, concurrency: int = 4, max_queue: int = 16, count: int = 4,
+                 timeout: float = 10.0, interval: float = 1.0, tcp_port: int = 80):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.count = count
+        self.timeout = timeout
+        self.interval = interval
+        self.tcp_port = tcp_port
+        self._slots = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+
+    @classmethod
+    def from_env(cls) -> "ProbeEngine":
+        return cls(
+            concurrency=int(os.getenv("PROBE_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("PROBE_QUEUE", "16")),
+            count=int(os.getenv("PROBE_COUNT", "4")),
+            timeout=float(os.getenv("PROBE_TIMEOUT", "10")),
+            tcp_port=int(os.getenv("PROBE_TCP_PORT", "80")),
+        )
+
+    def default_method(self) -> str:
+        return "icmp" if PING_BINARY else "tcp"
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._slots.locked() and self.waiting >= self.max_queue:
+            raise ProbeQueueFull(f"Too many probes in flight ({self.active} running, {self.waiting} queued)")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    async def stream(self, target: str, method: str | None = None,
+                     count: int | None = None) -> AsyncIterator[ProbeEvent]:
+        """
+        Probe `target` and yield events as they happen, ending with a "summary"
+        event. Closing the generator early stops the underlying probe.
+        """
+        target = validate_target(target)
+        method = method or self.default_method()
+        if method not in ("icmp", "tcp"):
+            raise InvalidTarget(f"Unknown probe method '{method}'")
+        if method == "icmp" and not PING_BINARY:
+            raise InvalidTarget("ICMP probes are unavailable: ping is not installed")
+
+        async with self.slot():
+            count = count or self.count
+            probe = self._icmp(target, count) if method == "icmp" else self._tcp(target, count)
+            async with aclosing(probe):
+                async for event in probe:
+                    yield event
+
+    async def run(self, target: str, method: str | None = None, count: int | None = None) -> ProbeResult:
+        result = None
+        async for event in self.stream(target, method, count):
+            if event.kind == "summary":
+                result = event.result
+        return result
+
+    async def _icmp(self, target: str, count: int) -> AsyncIterator[ProbeEvent]:
+        argv = [PING_BINARY, "-c", str(count), "-n", target]
+        result = ProbeResult(target, "icmp", " ".join(["ping"] + argv[1:]), sent=count)
+        process = await asyncio.create_subprocess_exec(
+            *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stderr_task = asyncio.create_task(process.stderr.read())
+        deadline = time.monotonic() + self.timeout
+        lines = []
+        try:
+            while True:
+                try:
+                    raw = await asyncio.wait_for(process.stdout.readline(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    result.timed_out = True
+                    result.error = f"The ping command timed out after {self.timeout:g} seconds."
+                    break
+                if not raw:
+                    break
+                line = raw.decode(errors="replace").rstrip("\n")
+                lines.append(line)
+                yield ProbeEvent("line", line=line)
+                match = PING_TIME_RE.search(line)
+                if match and "icmp_seq" in line:
+                    rtt = float(match.group(1))
+                    result.samples.append(rtt)
+                    yield ProbeEvent("sample", rtt_ms=rtt)
+        finally:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+            result.return_code = await process.wait()
+            stderr = await stderr_task
+        result.output = "\n".join(lines)
+        if stderr and not result.error:
+            result.error = stderr.decode(errors="replace").strip()
+        yield ProbeEvent("summary", result=result)
+
+    async def _tcp(self, target: str, count: int) -> AsyncIterator[ProbeEvent]:
+        result = ProbeResult(target, "tcp", f"tcp-connect {target}:{self.tcp_port} x{count}")
+        lines = []
+        deadline = time.monotonic() + self.timeout
+        for seq in range(1, count + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                result.timed_out = True
+                result.error = f"The probe timed out after {self.timeout:g} seconds."
+                break
+            result.sent += 1
+            started = time.perf_counter()
+            try:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(target, self.tcp_port), min(remaining, self.interval * 2)
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                line = f"connect to {target}:{self.tcp_port}: seq={seq} failed ({e.__class__.__name__})"
+                lines.append(line)
+                yield ProbeEvent("line", line=line)
+            else:
+                rtt = round((time.perf_counter() - started) * 1000, 3)
+                writer.close()
+                line = f"connect to {target}:{self.tcp_port}: seq={seq} time={rtt} ms"
+                lines.append(line)
+                result.samples.append(rtt)
+                yield ProbeEvent("line", line=line)
+                yield ProbeEvent("sample", rtt_ms=rtt)
+            if seq < count:
+                await asyncio.sleep(self.interval)
+        result.output = "\n".join(lines)
+        result.return_code = 0 if result.samples else 1
+        yield ProbeEvent("summary", result=result)
@@ -0,0 +1 @@
+"""End-to-end benchmark harness for the three services, without Docker or network (see bench/__main__.py)."""
@@ -0,0 +1,229 @@
+"""
+End-to-end benchmark of the three services, without Docker or network.
+
+    python -m bench                                   # default mix, 16 users, 30 s
+    python -m bench --users 64 --duration 60 --json results/$(git rev-parse --short HEAD).json
+    python -m bench --mix fetch=1 --latency 200 --body-size 1048576
+    python -m bench --mix fetch_slow=1,fetch=9 --slow-rate 256
+    python -m bench --mix fetch=1 --workers 4        # vulnerable-app under supervisor.py
+    python -m bench.compare results/before.json results/after.json
+
+The services run as local uvicorn subprocesses (bench.launch), against a
+stand-in upstream (bench.upstream) on the loopback interface; only the
+services the mix needs are started. Closed-loop virtual users pick
+operations from the weighted mix (bench.workload.OPERATIONS).
+
+Results: per operation and overall, requests, throughput, mean, p50, p95,
+p99 and max latency and the outcome counts (status codes, or the client
+exception name), plus the peak RSS of every service, and of its worker
+processes, while the load ran. --json writes them with the commit and
+settings, for bench.compare.
+
+Every client comes from 127.0.0.1, and every fetch goes to the same
+upstream host, so vulnerable-app's per-client and per-host admission
+limits are lifted by default; pass e.g. --env vulnerable-app:ADMISSION_CLIENT_RATE=5
+to measure with them. Service logs and span files are kept in --workdir.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from bench.processes import ROOT, MemorySampler, Process, free_port
+from bench.workload import DEFAULT_MIX, Profile, Targets, parse_mix, run_load, services_for
+
+SERVICE_ENV = {
+    "vulnerable-app": {
+        "ADMISSION_CLIENT_RATE": "0",
+        "ADMISSION_HOST_RATE": "0",
+        "ADMISSION_MAX_PER_HOST": "64",
+    },
+    "admin-service": {
+        "PROBE_COUNT": "1",
+    },
+    "internal-service": {},
+}
+
+# Service-side counters worth keeping next to the latencies
+SERVICE_STATS = {
+    "vulnerable-app": ["/admission/stats", "/cache/stats", "/pool/stats", "/workers"],
+    "admin-service": ["/ping/stats"],
+    "internal-service": ["/documents/stats"],
+}
+
+
+def git_revision() -> dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD") or None,
+                "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+def parse_env(values: list[str], services: list[str]) -> dict[str, dict[str, str]]:
+    """"KEY=VALUE" for every service, "service:KEY=VALUE" for one."""
+    overrides = {service: {} for service in services}
+    for value in values:
+        name, sep, setting = value.partition("=")
+        target, _, key = name.rpartition(":")
+        if not sep or not key:
+            raise ValueError(f"--env expects [service:]KEY=VALUE, got {value!r}")
+        for service in ([target] if target else services):
+            if service in overrides:
+                overrides[service][key] = setting
+    return overrides
+
+
+def service_stats(process: Process, paths: list[str]) -> dict:
+    stats = {}
+    for path in paths:
+        headers = {"X-Real-IP": "192.169.100.10"}
+        try:
+            request = urllib.request.Request(process.base_url + path, headers=headers)
+            with urllib.request.urlopen(request, timeout=5) as response:
+                stats[path] = json.load(response)
+        except (OSError, ValueError) as e:
+            stats[path] = {"error": str(e)}
+    return stats
+
+
+def print_summary(summary: dict, memory: dict) -> None:
+    print(f"{'operation':<16} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'max ms':>9}  outcomes")
+    rows = list(summary["operations"].items())
+    if summary["total"] is not None:
+        rows.append(("total", summary["total"]))
+    for name, op in rows:
+        outcomes = " ".join(f"{outcome}:{count}" for outcome, count in op["outcomes"].items())
+        print(f"{name:<16} {op['requests']:>9} {op['errors']:>7} {op['throughput_rps']:>9} {op['p50_ms']:>9} "
+              f"{op['p95_ms']:>9} {op['p99_ms']:>9} {op['max_ms']:>9}  {outcomes}")
+    print()
+    for service, peaks in memory.items():
+        print(f"{service:<16} peak RSS {peaks['peak_rss_mb']} MiB, with workers {peaks['peak_tree_rss_mb']} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma-separated operation=weight (default: %(default)s)")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="seconds of load before measuring")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=Profile.latency_ms, help="upstream latency (ms)")
+    parser.add_argument("--body-size", type=int, default=Profile.body_size, help="upstream body size (bytes)")
+    parser.add_argument("--type", default=Profile.content_type, choices=["html", "json", "text", "binary"],
+                        help="upstream content type")
+    parser.add_argument("--redirects", type=int, default=Profile.redirects, help="hops for fetch_redirect")
+    parser.add_argument("--slow-size", type=int, default=Profile.slow_size, help="body size for fetch_slow")
+    parser.add_argument("--slow-rate", type=int, default=Profile.slow_rate, help="bytes/s for fetch_slow")
+    parser.add_argument("--upload-size", type=int, default=Profile.upload_size, help="XML upload size (bytes)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="vulnerable-app workers under supervisor.py (default: one uvicorn process)")
+    parser.add_argument("--env", action="append", default=[], metavar="[SERVICE:]KEY=VALUE",
+                        help="environment override for the services (repeatable)")
+    parser.add_argument("--workdir", help="directory for service logs, spans and spool (default: a new temp dir)")
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        services = services_for(mix)
+        overrides = parse_env(args.env, services)
+    except ValueError as e:
+        parser.error(str(e))
+    profile = Profile(args.latency, args.body_size, args.type, args.redirects,
+                      args.slow_size, args.slow_rate, upload_size=args.upload_size)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-")
+    os.makedirs(workdir, exist_ok=True)
+
+    upstream_port = free_port()
+    upstream = Process("upstream", ["bench.upstream", "--port", str(upstream_port)], upstream_port, {},
+                       os.path.join(workdir, "upstream.log"))
+    processes = {}
+    for service in services:
+        port = free_port()
+        command = ["bench.launch", service, "--port", str(port)]
+        if service == "vulnerable-app":
+            command += ["--allow", "127.0.0.1"]
+            if args.workers:
+                command += ["--workers", str(args.workers)]
+        env = {
+            **SERVICE_ENV[service],
+            "TRACE_FILE": os.path.join(workdir, f"{service}.jsonl"),
+            "JOB_SPOOL_DIR": workdir,
+            "PROBE_TCP_PORT": str(upstream_port),
+            **overrides[service],
+        }
+        processes[service] = Process(service, command, port, env, os.path.join(workdir, f"{service}.log"))
+
+    targets = Targets(
+        upstream=upstream.base_url,
+        vulnerable_app=processes["vulnerable-app"].base_url if "vulnerable-app" in processes else None,
+        admin_service=processes["admin-service"].base_url if "admin-service" in processes else None,
+        internal_service=processes["internal-service"].base_url if "internal-service" in processes else None,
+    )
+    started_at = time.time()
+    try:
+        for process in (upstream, *processes.values()):
+            process.start()
+        for process in (upstream, *processes.values()):
+            process.wait_ready()
+        print(f"{', '.join(services)} ready, {args.users} users for {args.warmup:g}+{args.duration:g} s "
+              f"(logs in {workdir})", file=sys.stderr)
+        with MemorySampler(list(processes.values())):
+            results = asyncio.run(run_load(targets, profile, mix, args.users, args.duration,
+                                           args.warmup, args.timeout, args.seed))
+        memory = {service: process.memory() for service, process in processes.items()}
+        stats = {service: service_stats(process, SERVICE_STATS[service]) for service, process in processes.items()}
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 2
+    finally:
+        for process in (*processes.values(), upstream):
+            process.stop()
+
+    summary = results.summary(args.duration)
+    print_summary(summary, memory)
+    if args.json:
+        report = {
+            "meta": {
+                **git_revision(),
+                "started_at": round(started_at, 3),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+            },
+            "settings": {
+                "mix": mix,
+                "users": args.users,
+                "workers": args.workers,
+                "duration": args.duration,
+                "warmup": args.warmup,
+                "timeout": args.timeout,
+                "seed": args.seed,
+                "profile": vars(profile),
+                "env": {service: {**SERVICE_ENV[service], **overrides[service]} for service in services},
+            },
+            **summary,
+            "memory": memory,
+            "service_stats": stats,
+        }
+        directory = os.path.dirname(args.json)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
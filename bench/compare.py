@@ -0,0 +1,80 @@
+"""
+Compare two benchmark result files written by `python -m bench --json`.
+
+    python -m bench.compare results/before.json results/after.json
+    python -m bench.compare before.json after.json --fail-over 10   # exit 1 if a p95 grew more than 10 %
+
+Changes are relative to the first file. Results measured with different
+settings are compared anyway, with a warning.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def _change(before, after) -> str:
+    if before is None or after is None:
+        return "n/a"
+    if not before:
+        return "new" if after else "0%"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before: dict, after: dict) -> tuple[list[str], dict[str, float]]:
+    """Report lines, and the relative p95 change per operation present in both files."""
+    lines = []
+    if before.get("settings") != after.get("settings"):
+        lines += ["warning: the two runs used different settings", ""]
+    lines.append(f"{'operation':<16}" + "".join(f" {metric:>24}" for metric in METRICS))
+    p95_changes = {}
+    operations = {**before["operations"], **after["operations"]}
+    for name in [*operations, "total"]:
+        old = before["operations"].get(name) if name != "total" else before.get("total")
+        new = after["operations"].get(name) if name != "total" else after.get("total")
+        if old is None or new is None:
+            lines.append(f"{name:<16} only in {'the second' if old is None else 'the first'} run")
+            continue
+        cells = [f"{old[metric]:>8} -> {new[metric]:<8} {_change(old[metric], new[metric]):>6}" for metric in METRICS]
+        lines.append(f"{name:<16} " + " ".join(f"{cell:>24}" for cell in cells))
+        if old["p95_ms"]:
+            p95_changes[name] = (new["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+    lines.append("")
+    for service in sorted({**before.get("memory", {}), **after.get("memory", {})}):
+        old = before.get("memory", {}).get(service, {})
+        new = after.get("memory", {}).get(service, {})
+        for metric in ("peak_rss_mb", "peak_tree_rss_mb"):
+            lines.append(f"{service:<16} {metric:<17} {old.get(metric)} -> {new.get(metric)} MiB "
+                         f"{_change(old.get(metric), new.get(metric))}")
+    return lines, p95_changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--fail-over", type=float, metavar="PCT",
+                        help="exit with code 1 when the p95 of an operation grew by more than PCT percent")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    for label, report in (("before", before), ("after", after)):
+        meta = report.get("meta", {})
+        print(f"{label}: {meta.get('commit') or '?'}{' (dirty)' if meta.get('dirty') else ''}")
+    lines, p95_changes = compare(before, after)
+    print("\n".join(lines))
+
+    if args.fail_over is not None:
+        regressions = {name: change for name, change in p95_changes.items() if change > args.fail_over}
+        for name, change in regressions.items():
+            print(f"regression: {name} p95 {change:+.1f}%", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Run one service under uvicorn, the way its Dockerfile does, on a local port.
+
+    python -m bench.launch vulnerable-app --port 18000 --allow 127.0.0.1
+    python -m bench.launch vulnerable-app --port 18000 --allow 127.0.0.1 --workers 4
+
+The service directory and the repository root are put on sys.path, as
+they are in the images. With --allow, vulnerable-app's URL policy lets the
+given hosts through, so that /fetch can reach the stand-in upstream on
+the loopback interface; every other verdict is unchanged. With --workers,
+vulnerable-app runs under its supervisor.py, each worker applying --allow.
+"""
+import argparse
+import importlib
+import os
+import sys
+
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APPS = {
+    "vulnerable-app": "main:app",
+    "admin-service": "main:app",
+    "internal-service": "asgi:app",
+}
+
+
+class ExemptPolicy:
+    """A URL policy that lets `hosts` through and defers to `policy` for everything else."""
+
+    def __init__(self, policy, hosts):
+        self.policy = policy
+        self.hosts = frozenset(host.lower() for host in hosts)
+
+    def check_host(self, hostname: str) -> str | None:
+        if hostname.lower().rstrip(".") in self.hosts:
+            return None
+        return self.policy.check_host(hostname)
+
+    def __getattr__(self, name):
+        return getattr(self.policy, name)
+
+
+def _add_paths(service: str) -> None:
+    for path in (ROOT, os.path.join(ROOT, service)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def load(service: str, allow: list[str]):
+    _add_paths(service)
+    module_name, attribute = APPS[service].split(":")
+    app = getattr(importlib.import_module(module_name), attribute)
+    if allow:
+        store = sys.modules["main"].url_policy
+        # Reloaded policies (URL_POLICY_FILE, or published by the supervisor) are exempted too
+        compile_policy = store._load
+        store._load = lambda: ExemptPolicy(compile_policy(), allow)
+        store.current = ExemptPolicy(store.current, allow)
+    return app
+
+
+def exempt_app():
+    """Application factory for supervisor.py workers: vulnerable-app with the BENCH_ALLOW hosts exempted."""
+    return load("vulnerable-app", [host for host in os.getenv("BENCH_ALLOW", "").split(",") if host])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service", choices=sorted(APPS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--allow", action="append", default=[], metavar="HOST",
+                        help="host or IP exempted from vulnerable-app's URL policy (repeatable)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="run vulnerable-app under supervisor.py with this many workers")
+    args = parser.parse_args()
+    if (args.allow or args.workers) and args.service != "vulnerable-app":
+        parser.error("--allow and --workers only apply to vulnerable-app")
+
+    if args.workers:
+        _add_paths(args.service)
+        import supervisor
+        os.environ["BENCH_ALLOW"] = ",".join(args.allow)
+        sys.exit(supervisor.serve("bench.launch:exempt_app", args.host, args.port, args.workers, factory=True))
+
+    app = load(args.service, args.allow)
+    # log_config=None: the service has already routed uvicorn's loggers through shared.logs
+    uvicorn.run(app, host=args.host, port=args.port, log_config=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Local subprocesses for the benchmark: the three services and the stand-in
+upstream, with their memory sampled while the load runs.
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _status_kb(pid: int, field: str) -> int | None:
+    """A `kB` field of /proc/<pid>/status (Linux only), None when unavailable."""
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def descendants(pid: int) -> list[int]:
+    """pid and every process below it, from /proc (job and KDF workers included)."""
+    children: dict[int, list[int]] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return [pid]
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="ascii") as f:
+                # The command name may contain spaces: the fields after it are fixed
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        found.append(current)
+        pending.extend(children.get(current, ()))
+    return found
+
+
+class Process:
+    """
+    One `python -m <module> ...` subprocess, with stdout and stderr written
+    to `log_path`. Ready once `port` accepts connections.
+    """
+
+    def __init__(self, name: str, args: list[str], port: int, env: dict[str, str], log_path: str):
+        self.name = name
+        self.args = args
+        self.port = port
+        self.env = env
+        self.log_path = log_path
+        self.popen: subprocess.Popen | None = None
+        self.peak_tree_kb = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        env = {**os.environ, **self.env, "PYTHONUNBUFFERED": "1"}
+        with open(self.log_path, "ab") as log:
+            self.popen = subprocess.Popen([sys.executable, "-m", *self.args], cwd=ROOT, env=env,
+                                          stdout=log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.popen.poll() is not None:
+                raise RuntimeError(f"{self.name} exited with code {self.popen.returncode}, see {self.log_path}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"{self.name} did not listen on port {self.port} within {timeout:.0f}s, see {self.log_path}")
+
+    def sample(self) -> None:
+        if self.popen is None or self.popen.poll() is not None:
+            return
+        total = sum(_status_kb(pid, "VmRSS") or 0 for pid in descendants(self.popen.pid))
+        self.peak_tree_kb = max(self.peak_tree_kb, total)
+
+    def memory(self) -> dict:
+        """Peak RSS of the service process (kernel high-water mark) and of its whole process tree (sampled), in MiB."""
+        peak = _status_kb(self.popen.pid, "VmHWM") if self.popen is not None else None
+        return {
+            "peak_rss_mb": round(peak / 1024, 1) if peak is not None else None,
+            "peak_tree_rss_mb": round(self.peak_tree_kb / 1024, 1) if self.peak_tree_kb else None,
+        }
+
+    def stop(self, timeout: float = 10.0) -> None:
+        if self.popen is None or self.popen.poll() is not None:
+            return
+        self.popen.terminate()
+        try:
+            self.popen.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.popen.kill()
+            self.popen.wait()
+
+
+class MemorySampler:
+    """Samples the RSS of every process tree every `interval` seconds on a background thread."""
+
+    def __init__(self, processes: list[Process], interval: float = 0.2):
+        self.processes = processes
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            for process in self.processes:
+                process.sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,166 @@
+"""
+Local stand-in for the outside web, so /fetch can be benchmarked offline.
+
+    python -m bench.upstream --port 18080
+
+Every response is shaped by its path and query string:
+
+    /body?size=65536&latency=50&type=html   `size` bytes after `latency` ms (html, json, text or binary)
+    /redirect/3?size=1024                    3 redirects, then /body with the same query
+    /slow?size=4096&rate=512                 slow-loris: the body trickles out at `rate` bytes/s
+    /stall                                   half a header block, then nothing until the client leaves
+    ...&cache=60                             Cache-Control: max-age=60 instead of no-store
+
+Connections are kept alive, and every response but /stall carries a
+Content-Length, like a well-behaved origin server.
+"""
+import argparse
+import asyncio
+from functools import lru_cache
+from urllib.parse import parse_qs, urlsplit
+
+CONTENT_TYPES = {
+    "html": "text/html; charset=utf-8",
+    "json": "application/json",
+    "text": "text/plain; charset=utf-8",
+    "binary": "application/octet-stream",
+}
+CHUNK = 64 * 1024
+MAX_SIZE = 256 * 1024 * 1024
+
+_FILLER = b"Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 64
+
+
+def _fill(size: int) -> bytes:
+    return (_FILLER * (size // len(_FILLER) + 1))[:max(size, 0)]
+
+
+@lru_cache(maxsize=64)
+def payload(size: int, kind: str) -> bytes:
+    """`size` bytes of a plausible document of the given kind (exact unless too small for its markup)."""
+    if kind == "html":
+        head = b"<!DOCTYPE html><html><head><title>bench</title></head><body><p>"
+        tail = b"</p></body></html>"
+    elif kind == "json":
+        head, tail = b'{"items": ["', b'"]}'
+    elif kind == "binary":
+        # PNG signature, so the service recognises the format from the first bytes
+        return (b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * (size // 256 + 1))[:size]
+    else:
+        head = tail = b""
+    return head + _fill(size - len(head) - len(tail)) + tail
+
+
+def _param(params: dict, name: str, default: float) -> float:
+    try:
+        return float(params[name][0])
+    except (KeyError, ValueError):
+        return default
+
+
+async def _read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str]] | None:
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length:
+        await reader.readexactly(length)
+    return method, target, headers
+
+
+def _head(status: str, headers: dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status}", *(f"{name}: {value}" for name, value in headers.items()), "", ""]
+    return "\r\n".join(lines).encode("latin-1")
+
+
+async def respond(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, target: str) -> None:
+    url = urlsplit(target)
+    params = parse_qs(url.query)
+    await asyncio.sleep(_param(params, "latency", 0) / 1000)
+
+    if url.path == "/stall":
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\n")
+        await writer.drain()
+        # Never finish the headers: only the client giving up ends this
+        await reader.read()
+        raise ConnectionResetError
+
+    if url.path.startswith("/redirect/"):
+        try:
+            remaining = int(url.path.rsplit("/", 1)[1])
+        except ValueError:
+            remaining = 0
+        location = f"/redirect/{remaining - 1}" if remaining > 1 else "/body"
+        writer.write(_head("302 Found", {
+            "Location": f"{location}?{url.query}" if url.query else location,
+            "Content-Length": "0",
+        }))
+        await writer.drain()
+        return
+
+    if url.path not in ("/body", "/slow"):
+        writer.write(_head("404 Not Found", {"Content-Length": "0"}))
+        await writer.drain()
+        return
+
+    kind = params.get("type", ["html"])[0]
+    body = payload(min(int(_param(params, "size", 1024)), MAX_SIZE), kind if kind in CONTENT_TYPES else "html")
+    cache = int(_param(params, "cache", 0))
+    writer.write(_head("200 OK", {
+        "Content-Type": CONTENT_TYPES.get(kind, CONTENT_TYPES["html"]),
+        "Content-Length": str(len(body)),
+        "Cache-Control": f"max-age={cache}" if cache > 0 else "no-store",
+    }))
+
+    if url.path == "/slow":
+        # A tenth of the rate every 100 ms
+        step = max(int(_param(params, "rate", 512) / 10), 1)
+        for offset in range(0, len(body), step):
+            writer.write(body[offset:offset + step])
+            await writer.drain()
+            await asyncio.sleep(0.1)
+        return
+
+    view = memoryview(body)
+    for offset in range(0, len(body), CHUNK):
+        writer.write(view[offset:offset + CHUNK])
+        await writer.drain()
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while (request := await _read_request(reader)) is not None:
+            _, target, headers = request
+            await respond(reader, writer, target)
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int) -> None:
+    server = await asyncio.start_server(handle, host, port, backlog=1024)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Traffic mix for the benchmark: what each operation sends, the virtual
+users that run them and the per-operation latency summary.
+"""
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import httpx
+
+# internal-service only answers its own subnet; nginx passes the client address in X-Real-IP
+INTERNAL_CLIENT_IP = "192.169.100.10"
+CREDENTIALS = [("admin", "admin"), ("user", "password"), ("guest", "guest123")]
+
+DEFAULT_MIX = "fetch=30,fetch_cached=10,fetch_redirect=5,fetch_stream=5,fetch_slow=1,home=15,ping=10,login=4,upload=10,dashboard=10"
+
+
+@dataclass(frozen=True)
+class Profile:
+    """Shape of the stand-in upstream's responses to /fetch (see bench.upstream)."""
+    latency_ms: float = 20.0
+    body_size: int = 16 * 1024
+    content_type: str = "html"
+    redirects: int = 2
+    slow_size: int = 8 * 1024
+    slow_rate: int = 2048
+    cached_urls: int = 20
+    upload_size: int = 16 * 1024
+
+
+@dataclass
+class Targets:
+    """Base URLs of the running services; a service absent from the mix may be None."""
+    upstream: str
+    vulnerable_app: str | None = None
+    admin_service: str | None = None
+    internal_service: str | None = None
+
+
+@dataclass
+class User:
+    """One virtual user: its random stream, its HTTP clients and a sequence number for unique requests."""
+    index: int
+    rng: random.Random
+    public: httpx.AsyncClient
+    internal: httpx.AsyncClient | None = None
+    sequence: int = 0
+
+    def next(self) -> int:
+        self.sequence += 1
+        return self.sequence
+
+
+def _upstream(targets: Targets, profile: Profile, path: str, **extra) -> str:
+    query = {"size": profile.body_size, "latency": profile.latency_ms, "type": profile.content_type, **extra}
+    return f"{targets.upstream}{path}?" + "&".join(f"{key}={value}" for key, value in query.items())
+
+
+def _xml_document(user: User, size: int) -> bytes:
+    # Unique per upload, so the document cache does not answer every request
+    items = "".join(f"<item id='{i}'>value {i}</item>" for i in range(max(size // 32, 1)))
+    return f"<?xml version='1.0'?><root user='{user.index}' n='{user.next()}'>{items}</root>".encode()
+
+
+async def fetch(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    url = _upstream(targets, profile, "/body", n=user.next())
+    return await user.public.post(f"{targets.vulnerable_app}/fetch", data={"url": url})
+
+
+async def fetch_cached(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    url = _upstream(targets, profile, "/body", cache=300, n=user.rng.randrange(profile.cached_urls))
+    return await user.public.post(f"{targets.vulnerable_app}/fetch", data={"url": url})
+
+
+async def fetch_redirect(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    url = _upstream(targets, profile, f"/redirect/{profile.redirects}", n=user.next())
+    return await user.public.post(f"{targets.vulnerable_app}/fetch", data={"url": url})
+
+
+async def fetch_stream(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    url = _upstream(targets, profile, "/body", n=user.next())
+    return await user.public.post(f"{targets.vulnerable_app}/fetch", data={"url": url, "stream": "true"})
+
+
+async def fetch_slow(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    url = _upstream(targets, profile, "/slow", size=profile.slow_size, rate=profile.slow_rate, n=user.next())
+    return await user.public.post(f"{targets.vulnerable_app}/fetch", data={"url": url})
+
+
+async def fetch_stall(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    return await user.public.post(f"{targets.vulnerable_app}/fetch",
+                                  data={"url": f"{targets.upstream}/stall?n={user.next()}"})
+
+
+async def home(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    return await user.public.get(f"{targets.vulnerable_app}/")
+
+
+async def ping(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    # TCP probe of the stand-in upstream (PROBE_TCP_PORT), no raw sockets needed
+    return await user.public.get(f"{targets.admin_service}/ping",
+                                 params={"ip": "127.0.0.1", "method": "tcp", "format": "json"})
+
+
+async def login(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    username, password = user.rng.choice(CREDENTIALS)
+    return await user.internal.post(f"{targets.internal_service}/",
+                                    data={"username": username, "password": password})
+
+
+async def upload(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    files = {"xmlfile": ("bench.xml", _xml_document(user, profile.upload_size), "application/xml")}
+    return await user.internal.post(f"{targets.internal_service}/upload", files=files,
+                                    headers={"Accept": "application/json"})
+
+
+async def dashboard(user: User, targets: Targets, profile: Profile) -> httpx.Response:
+    return await user.internal.get(f"{targets.internal_service}/")
+
+
+Operation = Callable[[User, Targets, Profile], Awaitable[httpx.Response]]
+
+OPERATIONS: dict[str, tuple[str, Operation]] = {
+    "fetch": ("vulnerable-app", fetch),
+    "fetch_cached": ("vulnerable-app", fetch_cached),
+    "fetch_redirect": ("vulnerable-app", fetch_redirect),
+    "fetch_stream": ("vulnerable-app", fetch_stream),
+    "fetch_slow": ("vulnerable-app", fetch_slow),
+    "fetch_stall": ("vulnerable-app", fetch_stall),
+    "home": ("vulnerable-app", home),
+    "ping": ("admin-service", ping),
+    "login": ("internal-service", login),
+    "upload": ("internal-service", upload),
+    "dashboard": ("internal-service", dashboard),
+}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """"fetch=30,ping=10" -> {"fetch": 30.0, "ping": 10.0}; zero weights are dropped."""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"unknown operation {name!r}, expected one of {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    mix = {name: weight for name, weight in mix.items() if weight > 0}
+    if not mix:
+        raise ValueError("the mix has no operation with a positive weight")
+    return mix
+
+
+def services_for(mix: dict[str, float]) -> list[str]:
+    return sorted({OPERATIONS[name][0] for name in mix})
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+@dataclass
+class Results:
+    """Latencies and outcomes per operation, for requests started inside the measured window."""
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    outcomes: dict[str, Counter] = field(default_factory=lambda: defaultdict(Counter))
+
+    def add(self, name: str, seconds: float, outcome: str) -> None:
+        self.latencies[name].append(seconds)
+        self.outcomes[name][outcome] += 1
+
+    @staticmethod
+    def _summary(latencies: list[float], outcomes: Counter, elapsed: float) -> dict:
+        ordered = sorted(latencies)
+        errors = sum(count for outcome, count in outcomes.items() if not outcome.isdigit() or outcome >= "500")
+        return {
+            "requests": len(ordered),
+            "errors": errors,
+            "outcomes": dict(sorted(outcomes.items())),
+            "throughput_rps": round(len(ordered) / elapsed, 2),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+            "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2),
+        }
+
+    def summary(self, elapsed: float) -> dict:
+        operations = {name: self._summary(self.latencies[name], self.outcomes[name], elapsed)
+                      for name in sorted(self.latencies)}
+        every = [seconds for latencies in self.latencies.values() for seconds in latencies]
+        outcomes = sum(self.outcomes.values(), Counter())
+        return {
+            "operations": operations,
+            "total": self._summary(every, outcomes, elapsed) if every else None,
+        }
+
+
+async def _virtual_user(user: User, targets: Targets, profile: Profile, mix: dict[str, float],
+                        start: float, end: float, results: Results) -> None:
+    names, weights = list(mix), list(mix.values())
+    if user.internal is not None:
+        # Logged in before the clock starts, so upload and dashboard have a session
+        try:
+            await login(user, targets, profile)
+        except httpx.HTTPError:
+            pass
+    while (started := time.perf_counter()) < end:
+        name = user.rng.choices(names, weights)[0]
+        try:
+            response = await OPERATIONS[name][1](user, targets, profile)
+            outcome = str(response.status_code)
+        except httpx.HTTPError as e:
+            outcome = type(e).__name__
+        if started >= start:
+            results.add(name, time.perf_counter() - started, outcome)
+
+
+async def run_load(targets: Targets, profile: Profile, mix: dict[str, float], users: int,
+                   duration: float, warmup: float = 0.0, timeout: float = 30.0, seed: int = 0) -> Results:
+    """
+    `users` closed-loop virtual users, each picking its next operation from
+    `mix` as soon as the previous one completes. Requests started during
+    the first `warmup` seconds are not recorded.
+    """
+    results = Results()
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    needs_session = any(OPERATIONS[name][0] == "internal-service" for name in mix)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as public:
+        # One internal-service client per user: each has its own session cookie
+        internals = [
+            httpx.AsyncClient(timeout=timeout, headers={"X-Real-IP": INTERNAL_CLIENT_IP})
+            if needs_session else None
+            for _ in range(users)
+        ]
+        try:
+            start = time.perf_counter() + warmup
+            end = start + duration
+            await asyncio.gather(*(
+                _virtual_user(User(index, random.Random(seed * 100003 + index), public, internals[index]),
+                              targets, profile, mix, start, end, results)
+                for index in range(users)
+            ))
+        finally:
+            for client in internals:
+                if client is not None:
+                    await client.aclose()
+    return results
@@ -0,0 +1,54 @@
+"""
+Production serving mode: the Flask app behind uvicorn.
+
+    WEB_CONCURRENCY=N uvicorn asgi:app --host 192.169.100.11 --port 5000
+
+Flask handlers run on a bounded thread pool (WSGI_THREADS), so the event
+loop only shuttles bytes; XML parsing is further offloaded to the job
+process pool (JOB_WORKERS, per server process).
+
+With several server processes, a request can land on another process than
+the one that accepted the login or the upload, so sessions, jobs and
+documents must be shared through SQLite: SESSION_BACKEND, JOB_BACKEND and
+DOC_CACHE_BACKEND set to "sqlite" (databases SESSION_DB, JOB_DB and
+DOC_CACHE_DB, documents in DOC_CACHE_DIR, all on the same filesystem).
+Startup fails when WEB_CONCURRENCY is above 1 without them; pass the
+worker count through WEB_CONCURRENCY rather than --workers, so that this
+check sees it. Login throttling stays per process.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+import main
+
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+
+# State another server process must see: where it is kept is chosen by these variables
+SHARED_BACKENDS = ("SESSION_BACKEND", "JOB_BACKEND", "DOC_CACHE_BACKEND")
+
+if int(os.getenv("WEB_CONCURRENCY") or 1) > 1:
+    unshared = [name for name in SHARED_BACKENDS if os.getenv(name, "memory") != "sqlite"]
+    if unshared:
+        # Another worker would answer without the session, the job or the document
+        raise RuntimeError(f"WEB_CONCURRENCY above 1 needs {', '.join(name + '=sqlite' for name in unshared)}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Fork the job workers before the first request instead of during it
+    await asyncio.to_thread(main.warm_up)
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(main.shutdown)
+
+
+app = Starlette(
+    routes=[Mount("/", app=WSGIMiddleware(main.app, workers=WSGI_THREADS))],
+    lifespan=lifespan,
+)
@@ -0,0 +1,93 @@
+"""
+Login throughput and latency at several scrypt cost settings.
+
+    python bench_login.py                          # log2 n = 12, 14, 15
+    python bench_login.py --costs 14 --clients 32  # one setting, more concurrent clients
+    python bench_login.py --json out.json
+
+Each client thread logs in repeatedly through CredentialVerifier, exactly
+as the login route does, against a store holding pre-hashed users.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+from credentials import CredentialVerifier, LoginThrottle, MemoryCredentialStore, PasswordHasher
+
+
+def run_setting(log_n, clients, logins, workers, users):
+    hasher = PasswordHasher(log_n=log_n)
+    store = MemoryCredentialStore({f"user{i}": hasher.hash(f"password{i}") for i in range(users)})
+    verifier = CredentialVerifier(
+        store, hasher, LoginThrottle(max_failures=10 ** 9),
+        workers=workers, max_pending=clients,
+    )
+    verifier.start()
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+    per_client = max(logins // clients, 1)
+
+    def client(index):
+        local = []
+        for attempt in range(per_client):
+            user = (index + attempt) % users
+            started = time.perf_counter()
+            ok = verifier.authenticate(f"user{user}", f"password{user}")
+            local.append(time.perf_counter() - started)
+            if not ok:
+                failures.append(user)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    verifier.shutdown()
+
+    latencies.sort()
+    return {
+        "log_n": log_n,
+        "workers": verifier.workers,
+        "clients": clients,
+        "logins": len(latencies),
+        "failures": len(failures),
+        "logins_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--costs", default="12,14,15", help="comma-separated log2(n) values")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=200, help="logins per cost setting")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--json", metavar="PATH", help="write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'log_n':>6} {'workers':>8} {'clients':>8} {'logins/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for log_n in (int(cost) for cost in args.costs.split(",")):
+        result = run_setting(log_n, args.clients, args.logins, args.workers, args.users)
+        results.append(result)
+        print(f"{result['log_n']:>6} {result['workers']:>8} {result['clients']:>8} "
+              f"{result['logins_per_s']:>10} {result['p50_ms']:>9} {result['p99_ms']:>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(result["failures"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LoginThrottled(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many failed attempts, try again in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class VerifierBusy(Exception):
+    pass
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """
+    scrypt password hashes, encoded as scrypt$<log2 n>$<r>$<p>$<salt>$<hash>.
+
+    Entries written as plain$<password> (the old plaintext users) still
+    verify, and needs_rehash() reports them; CredentialVerifier.from_env
+    hashes them at startup, since they verify much faster than a hash.
+    """
+
+    def __init__(self, log_n=14, r=8, p=1, dklen=32):
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+        self.dklen = dklen
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            log_n=int(os.getenv("KDF_LOG_N", "14")),
+            r=int(os.getenv("KDF_R", "8")),
+            p=int(os.getenv("KDF_P", "1")),
+        )
+
+    def _derive(self, password, salt, log_n, r, p, dklen):
+        n = 1 << log_n
+        # scrypt needs 128 * r * (n + p) bytes; OpenSSL refuses above 32 MiB unless told
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p, dklen=dklen,
+            maxmem=128 * r * (n + p) + 1024 * 1024,
+        )
+
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        derived = self._derive(password, salt, self.log_n, self.r, self.p, self.dklen)
+        return f"scrypt${self.log_n}${self.r}${self.p}${_b64(salt)}${_b64(derived)}"
+
+    def verify(self, password, encoded):
+        scheme, _, rest = encoded.partition("$")
+        if scheme == "plain":
+            return hmac.compare_digest(password.encode(), rest.encode())
+        if scheme != "scrypt":
+            return False
+        log_n, r, p, salt, expected = rest.split("$")
+        expected = _unb64(expected)
+        derived = self._derive(password, _unb64(salt), int(log_n), int(r), int(p), len(expected))
+        return hmac.compare_digest(derived, expected)
+
+    def needs_rehash(self, encoded):
+        return not encoded.startswith(f"scrypt${self.log_n}${self.r}${self.p}$")
+
+
+class MemoryCredentialStore:
+    def __init__(self, entries=None):
+        self._entries = dict(entries or {})
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        with self._lock:
+            return self._entries.get(username)
+
+    def set(self, username, encoded):
+        with self._lock:
+            self._entries[username] = encoded
+
+    def seed(self, entries):
+        """Add entries for users that do not exist yet."""
+        with self._lock:
+            for username, encoded in entries.items():
+                self._entries.setdefault(username, encoded)
+
+
+class SqliteCredentialStore:
+    """Credentials in SQLite, looked up through the username primary key. One connection per thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS credentials "
+            "(username TEXT PRIMARY KEY, hash TEXT NOT NULL) WITHOUT ROWID"
+        )
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
+
+    def get(self, username):
+        row = self._connect().execute("SELECT hash FROM credentials WHERE username = ?", (username,)).fetchone()
+        return row[0] if row else None
+
+    def set(self, username, encoded):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO credentials (username, hash) VALUES (?, ?)", (username, encoded)
+        )
+
+    def seed(self, entries):
+        self._connect().executemany(
+            "INSERT OR IGNORE INTO credentials (username, hash) VALUES (?, ?)", entries.items()
+        )
+
+
+class LoginThrottle:
+    """
+    Allows at most `max_failures` failed logins per username within `window`
+    seconds. Usernames are kept in order of their last failure: expired ones
+    are dropped as new failures come in, and at most `max_entries` are kept,
+    so spraying random usernames cannot grow the table without bound.
+    """
+
+    def __init__(self, max_failures=5, window=60.0, max_entries=100000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_entries = max_entries
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, username):
+        now = time.monotonic()
+        with self._lock:
+            failures = self._failures.get(username)
+            if not failures:
+                return
+            while failures and failures[0] <= now - self.window:
+                failures.popleft()
+            if not failures:
+                del self._failures[username]
+            elif len(failures) >= self.max_failures:
+                raise LoginThrottled(int(failures[0] + self.window - now) + 1)
+
+    def failed(self, username):
+        now = time.monotonic()
+        with self._lock:
+            self._failures.setdefault(username, deque()).append(now)
+            self._failures.move_to_end(username)
+            # Least recent failures first: drop the expired ones, then any over the cap
+            while len(self._failures) > 1:
+                oldest = next(iter(self._failures.values()))
+                if oldest[-1] > now - self.window and len(self._failures) <= self.max_entries:
+                    break
+                self._failures.popitem(last=False)
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(username, None)
+
+
+class CredentialVerifier:
+    """
+    Checks logins against `store` on a dedicated thread pool.
+
+    hashlib.scrypt releases the GIL, so `workers` bounds the CPU spent on
+    key derivation while the web threads keep serving other requests. At
+    most `max_pending` verifications wait for a worker; beyond that,
+    VerifierBusy is raised instead of queueing more work.
+    """
+
+    def __init__(self, store, hasher, throttle, workers=None, max_pending=32, timeout=10.0):
+        self.store = store
+        self.hasher = hasher
+        self.throttle = throttle
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="kdf")
+        self._lock = threading.Lock()
+        self._dummy_hash = None
+
+    @classmethod
+    def from_env(cls, users):
+        if os.getenv("CREDENTIAL_BACKEND", "memory") == "sqlite":
+            store = SqliteCredentialStore(os.getenv("CREDENTIAL_DB", "credentials.db"))
+        else:
+            store = MemoryCredentialStore()
+        hasher = PasswordHasher.from_env()
+        # Legacy plaintext users are hashed now rather than on first login: until then, the speed of
+        # a failed login would tell them apart from hashed accounts
+        store.seed({
+            username: hasher.hash(password) for username, password in users.items() if store.get(username) is None
+        })
+        for username in users:
+            encoded = store.get(username)
+            if encoded.startswith("plain$"):
+                store.set(username, hasher.hash(encoded.partition("$")[2]))
+        return cls(
+            store,
+            hasher,
+            LoginThrottle(
+                int(os.getenv("LOGIN_MAX_FAILURES", "5")),
+                float(os.getenv("LOGIN_FAILURE_WINDOW", "60")),
+                int(os.getenv("LOGIN_THROTTLE_MAX_ENTRIES", "100000")),
+            ),
+            workers=int(os.getenv("KDF_WORKERS", "0")) or None,
+            max_pending=int(os.getenv("KDF_MAX_PENDING", "32")),
+        )
+
+    def start(self):
+        # Unknown users are checked against this hash, so they take as long as real ones
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hasher.hash(secrets.token_urlsafe(16))
+
+    def _verify(self, username, password):
+        encoded = self.store.get(username)
+        if encoded is None:
+            self.hasher.verify(password, self._dummy_hash)
+            return False
+        if not self.hasher.verify(password, encoded):
+            return False
+        if self.hasher.needs_rehash(encoded):
+            self.store.set(username, self.hasher.hash(password))
+        return True
+
+    def authenticate(self, username, password):
+        """True if the credentials match; raises LoginThrottled or VerifierBusy without checking them."""
+        self.throttle.check(username)
+        self.start()
+        with self._lock:
+            if self.pending >= self.workers + self.max_pending:
+                raise VerifierBusy("Too many logins in progress, try again shortly")
+            self.pending += 1
+        try:
+            future = self._executor.submit(self._verify, username, password)
+        except BaseException:
+            self._release()
+            raise
+        # The slot is held until the hash is done, not until we stop waiting for it
+        future.add_done_callback(self._release)
+        try:
+            ok = future.result(self.timeout)
+        except TimeoutError:
+            # Still queued: drop it; already running: it keeps its slot until it ends
+            future.cancel()
+            raise VerifierBusy("Login verification timed out, try again shortly") from None
+        if ok:
+            self.throttle.succeeded(username)
+        else:
+            self.throttle.failed(username)
+        return ok
+
+    def _release(self, future=None):
+        with self._lock:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
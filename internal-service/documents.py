@@ -0,0 +1,406 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from lxml import etree
+
+from xmlproc import parse_file
+
+# Rough per-node overhead of a parsed lxml tree, used to size cached trees
+NODE_OVERHEAD = 200
+
+
+# Axes that may scan the whole document from each context node
+SCANNING_AXES = {"descendant", "descendant-or-self", "following", "following-sibling",
+                 "preceding", "preceding-sibling"}
+# Axes that select at most a handful of nodes per context node
+NARROW_AXES = {"attribute", "self", "parent", "namespace"}
+NODE_TESTS = {"node", "text", "comment", "processing-instruction"}
+OPERATOR_NAMES = {"and", "or", "div", "mod"}
+XPATH_TOKEN = re.compile(r"""\s*(?:"[^"]*"|'[^']*'|\d+(?:\.\d*)?|\.\d+|(//|::|\.\.|!=|<=|>=|[/\[\]()@,|.*=<>+\-$])"""
+                         r"""|([A-Za-z_][\w.\-]*(?::[A-Za-z_][\w.\-]*|:\*)?))""")
+
+
+class QueryTooExpensive(ValueError):
+    pass
+
+
+@lru_cache(maxsize=int(os.getenv("XPATH_CACHE_SIZE", "256")))
+def compile_xpath(expr):
+    """etree.XPath(expr), compiled once per distinct expression (raises XPathSyntaxError)."""
+    return etree.XPath(expr)
+
+
+@lru_cache(maxsize=int(os.getenv("XPATH_CACHE_SIZE", "256")))
+def xpath_cost(expr):
+    """
+    Worst-case work of a compiled-valid XPath expression, as a power of the
+    number of elements: 1 for a single pass over the document (//item/@id),
+    2 when a scanning step runs once per node (//a//b, //*[. = //b]), and so
+    on. Steps on the child axis are counted as able to return every element,
+    except the first one of an absolute path.
+    """
+    tokens = [(match.group(1) or match.group(2), match.group(2) is not None)
+              for match in XPATH_TOKEN.finditer(expr) if match.group(0).strip()]
+    cost = ctx = 0
+    # (context exponent of the enclosing path, kind of bracket) for each open ( or [
+    frames = []
+    base = 0
+    descend = from_root = after_operand = False
+    axis = None
+    i = 0
+    while i < len(tokens):
+        token, is_name = tokens[i]
+        following = tokens[i + 1][0] if i + 1 < len(tokens) else None
+        i += 1
+        if token is None:
+            # Literal or number
+            after_operand = True
+        elif after_operand and (token == "*" or token in OPERATOR_NAMES):
+            ctx, after_operand = base, False
+        elif token in (",", "|", "=", "!=", "<", ">", "<=", ">=", "+", "-"):
+            ctx, after_operand = base, False
+        elif token == "$":
+            i += 1
+            after_operand = True
+        elif token == "//":
+            descend, after_operand = True, False
+        elif token == "/":
+            from_root, after_operand = not after_operand, False
+        elif token == "@":
+            axis = "attribute"
+        elif is_name and following == "::":
+            axis = token
+            i += 1
+        elif token in ("(", "[") or (is_name and following == "(" and token not in NODE_TESTS):
+            if token not in ("(", "["):
+                i += 1
+            frames.append((ctx, base, "[" if token == "[" else "("))
+            base, after_operand = ctx, False
+        elif token in (")", "]"):
+            inner = ctx
+            ctx, base, kind = frames.pop()
+            if kind == "(":
+                ctx = max(ctx, inner)
+            after_operand = True
+        else:
+            # A step: name test, *, node test, . or ..
+            if token in NODE_TESTS and following == "(":
+                i += 2
+            axis = axis or {".": "self", "..": "parent"}.get(token, "child")
+            if descend:
+                ctx += 1
+            if axis in SCANNING_AXES:
+                ctx += 1
+            elif axis not in NARROW_AXES and not (from_root and axis == "child" and not descend):
+                ctx = max(ctx, 1)
+            cost = max(cost, ctx)
+            axis, descend, from_root, after_operand = None, False, False, True
+    return cost
+
+
+class _Document:
+    __slots__ = ("path", "summary", "owners", "tree", "tree_bytes")
+
+    def __init__(self, path, summary):
+        self.path = path
+        self.summary = summary
+        self.owners = set()
+        self.tree = None
+        self.tree_bytes = 0
+
+
+class SqliteDocumentIndex:
+    """
+    Summaries and owners of the cached documents in a SQLite database in WAL
+    mode, so that several server processes share one set of documents
+    (their files live in the same directory). Each thread keeps its own
+    connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connect().executescript(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(digest TEXT PRIMARY KEY, summary TEXT NOT NULL, used REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS documents_used ON documents (used);"
+            "CREATE TABLE IF NOT EXISTS document_owners "
+            "(digest TEXT NOT NULL, owner TEXT NOT NULL, PRIMARY KEY (digest, owner)) WITHOUT ROWID;"
+        )
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def summary(self, digest, owner):
+        """The document's summary, or None; a hit adds `owner` and counts as a use."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT summary FROM documents WHERE digest = ?", (digest,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE documents SET used = ? WHERE digest = ?", (time.time(), digest))
+                db.execute("INSERT OR IGNORE INTO document_owners (digest, owner) VALUES (?, ?)", (digest, owner))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def touch(self, digest, owner):
+        """True, and the document counts as used, if `owner` uploaded it."""
+        return self._connect().execute(
+            "UPDATE documents SET used = ? WHERE digest = ? AND EXISTS "
+            "(SELECT 1 FROM document_owners WHERE digest = ? AND owner = ?)",
+            (time.time(), digest, digest, owner),
+        ).rowcount > 0
+
+    def add(self, digest, summary, owner, max_documents):
+        """Record the document for `owner`; returns the digests evicted to stay within `max_documents`."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT INTO documents (digest, summary, used) VALUES (?, ?, ?) "
+                "ON CONFLICT (digest) DO UPDATE SET used = excluded.used",
+                (digest, summary, time.time()),
+            )
+            db.execute("INSERT OR IGNORE INTO document_owners (digest, owner) VALUES (?, ?)", (digest, owner))
+            evicted = [row[0] for row in db.execute(
+                "SELECT digest FROM documents ORDER BY used DESC LIMIT -1 OFFSET ?", (max_documents,)
+            )]
+            for old in evicted:
+                db.execute("DELETE FROM documents WHERE digest = ?", (old,))
+                db.execute("DELETE FROM document_owners WHERE digest = ?", (old,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def count(self):
+        return self._connect().execute("SELECT count(*) FROM documents").fetchone()[0]
+
+
+class DocumentCache:
+    """
+    Uploaded documents keyed by SHA-256 of their content.
+
+    Each entry keeps the upload summary and the spooled file, so an identical
+    upload skips parsing entirely. Only documents that were summarized
+    successfully are added, and only the users who uploaded one may query
+    it. The full tree is only built on the first query, under the same
+    `limits` as the summary. Trees are bounded by `max_bytes` (estimated),
+    entries by `max_documents`; both are evicted least recently used first.
+
+    With a shared `index` (SqliteDocumentIndex), summaries, owners and
+    document eviction are common to every server process; each process
+    still builds and caches its own trees.
+    """
+
+    def __init__(self, directory, limits, max_bytes=64 * 1024 * 1024, max_documents=256, index=None):
+        self.directory = directory
+        self.limits = limits
+        self.max_bytes = max_bytes
+        self.max_documents = max_documents
+        self.index = index
+        self.tree_bytes = 0
+        self.counters = {
+            "summary_hits": 0,
+            "summary_misses": 0,
+            "tree_hits": 0,
+            "tree_misses": 0,
+            "tree_evictions": 0,
+            "document_evictions": 0,
+        }
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, directory, limits):
+        index = None
+        if os.getenv("DOC_CACHE_BACKEND", "memory") == "sqlite":
+            index = SqliteDocumentIndex(os.getenv("DOC_CACHE_DB", "documents.db"))
+        return cls(
+            os.getenv("DOC_CACHE_DIR") or directory,
+            limits,
+            max_bytes=int(os.getenv("DOC_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            max_documents=int(os.getenv("DOC_CACHE_MAX_DOCUMENTS", "256")),
+            index=index,
+        )
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, f"{digest}.xml")
+
+    def summary(self, digest, owner):
+        """Cached upload summary for this content, or None; a hit lets `owner` query the document too."""
+        if self.index is not None:
+            summary = self.index.summary(digest, owner)
+            with self._lock:
+                self.counters["summary_misses" if summary is None else "summary_hits"] += 1
+            return summary
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.counters["summary_misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            entry.owners.add(owner)
+            self.counters["summary_hits"] += 1
+            return entry.summary
+
+    def add(self, digest, summary, owner):
+        if self.index is not None:
+            evicted = self.index.add(digest, summary, owner, self.max_documents)
+            with self._lock:
+                for old in evicted:
+                    self._forget(old)
+                self.counters["document_evictions"] += len(evicted)
+            for old in evicted:
+                _unlink(self.path_for(old))
+            return
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                entry = self._entries[digest] = _Document(self.path_for(digest), summary)
+            entry.owners.add(owner)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_documents:
+                _, evicted = self._entries.popitem(last=False)
+                self.tree_bytes -= evicted.tree_bytes
+                self.counters["document_evictions"] += 1
+                _unlink(evicted.path)
+
+    def tree(self, digest, owner):
+        """
+        Parsed tree for `digest`, built on first use; None for unknown
+        documents, for documents `owner` never uploaded, and for documents
+        evicted (file removed) while being parsed. Raises XmlLimitExceeded or
+        etree.ParseError if the file cannot be parsed.
+        """
+        if self.index is not None and not self.index.touch(digest, owner):
+            return None
+        with self._lock:
+            entry = self._entries.get(digest)
+            if self.index is None:
+                if entry is None or owner not in entry.owners:
+                    return None
+            elif entry is None:
+                # Known to the shared index: only its tree is kept here
+                entry = self._entries[digest] = _Document(self.path_for(digest), None)
+                while len(self._entries) > self.max_documents:
+                    self._forget(next(iter(self._entries)))
+            self._entries.move_to_end(digest)
+            if entry.tree is not None:
+                self.counters["tree_hits"] += 1
+                return entry.tree
+            self.counters["tree_misses"] += 1
+
+        # Parse outside the lock; concurrent first queries may both parse, the last one is kept
+        try:
+            tree = parse_file(entry.path, self.limits)
+            size = os.path.getsize(entry.path) + NODE_OVERHEAD * sum(1 for _ in tree.iter())
+        except OSError:
+            # Evicted by a concurrent add(), which removed the file
+            return None
+
+        with self._lock:
+            if self._entries.get(digest) is entry and entry.tree is None:
+                entry.tree, entry.tree_bytes = tree, size
+                self.tree_bytes += size
+                self._shrink(keep=entry)
+        return tree
+
+    def _forget(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry is not None:
+            self.tree_bytes -= entry.tree_bytes
+
+    def _shrink(self, keep):
+        for entry in list(self._entries.values()):
+            if self.tree_bytes <= self.max_bytes:
+                break
+            if entry.tree is None or entry is keep:
+                continue
+            entry.tree = None
+            self.tree_bytes -= entry.tree_bytes
+            entry.tree_bytes = 0
+            self.counters["tree_evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["tree_hits"] + self.counters["tree_misses"]
+            uploads = self.counters["summary_hits"] + self.counters["summary_misses"]
+            return {
+                "documents": len(self._entries) if self.index is None else self.index.count(),
+                "max_documents": self.max_documents,
+                "trees": sum(1 for entry in self._entries.values() if entry.tree is not None),
+                "tree_bytes": self.tree_bytes,
+                "max_bytes": self.max_bytes,
+                **self.counters,
+                "summary_hit_ratio": round(self.counters["summary_hits"] / uploads, 3) if uploads else None,
+                "tree_hit_ratio": round(self.counters["tree_hits"] / lookups, 3) if lookups else None,
+            }
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def xpath_stats():
+    info = compile_xpath.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": round(info.hits / lookups, 3) if lookups else None,
+    }
+
+
+def run_query(tree, expr, max_results=100, max_chars=2000, max_cost=10 ** 7):
+    """
+    Evaluate a compiled XPath against `tree` and return JSON-friendly results.
+    Raises QueryTooExpensive, before running it, if the expression could
+    visit more than `max_cost` nodes on this tree (see xpath_cost).
+    """
+    xpath = compile_xpath(expr)
+    cost = xpath_cost(expr)
+    # A single pass over the document is always allowed: the upload limits bound it
+    if cost > 1:
+        elements = sum(1 for _ in tree.iter())
+        if elements ** cost > max_cost:
+            raise QueryTooExpensive(
+                f"Query too expensive for this document ({elements} elements): "
+                f"avoid descendant (//), following or preceding steps inside other paths or predicates"
+            )
+    value = xpath(tree)
+    if isinstance(value, bool):
+        return {"type": "boolean", "value": value}
+    if isinstance(value, float):
+        return {"type": "number", "value": value}
+    if isinstance(value, str):
+        return {"type": "string", "value": str(value)[:max_chars]}
+    results = []
+    for item in value[:max_results]:
+        if isinstance(item, etree._Element):
+            item = etree.tostring(item, encoding="unicode", with_tail=False)
+        else:
+            item = str(item)
+        results.append(item[:max_chars])
+    return {"type": "nodeset", "count": len(value), "truncated": len(value) > max_results, "results": results}
@@ -0,0 +1,255 @@
+import multiprocessing
+import os
+import resource
+import secrets
+import signal
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobRejected(Exception):
+    """Raised by job code for unacceptable input: the job ends "rejected", with this message as its error."""
+
+
+class CpuTimeExceeded(BaseException):
+    # BaseException, like KeyboardInterrupt: job code catching Exception must not swallow it
+    pass
+
+
+def _on_sigxcpu(signum, frame):
+    raise CpuTimeExceeded("Job exceeded its CPU time limit")
+
+
+def _init_worker():
+    signal.signal(signal.SIGXCPU, _on_sigxcpu)
+
+
+def _run_limited(cpu_seconds, fn, args):
+    """
+    Run fn(*args) in a pool worker with a CPU budget of `cpu_seconds`.
+
+    Workers are reused, so the soft RLIMIT_CPU is set relative to the CPU
+    time already consumed and lifted again afterwards. Going over it sends
+    SIGXCPU, which _init_worker turns into CpuTimeExceeded.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+        return fn(*args)
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+
+
+@dataclass
+class Job:
+    id: str
+    owner: str
+    status: str = "queued"
+    submitted: float = field(default_factory=time.time)
+    finished: float | None = None
+    result: str | None = None
+    error: str | None = None
+    future: Future | None = field(default=None, repr=False)
+
+    def to_dict(self):
+        status = self.status
+        if status == "queued" and self.future is not None and self.future.running():
+            status = "running"
+        return {
+            "id": self.id,
+            "status": status,
+            "submitted": self.submitted,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class SqliteJobStore:
+    """
+    Job states in a SQLite database in WAL mode, so that any server process
+    can answer for a job another one runs. Each thread keeps its own
+    connection.
+    """
+
+    # Expired rows are swept once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path, ttl=600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL, "
+            "submitted REAL NOT NULL, finished REAL, result TEXT, error TEXT)"
+        )
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            "SELECT id, owner, status, submitted, finished, result, error FROM jobs "
+            "WHERE id = ? AND coalesce(finished, submitted) >= ?",
+            (job_id, time.time() - self.ttl),
+        ).fetchone()
+        return Job(*row) if row else None
+
+    def put(self, job):
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO jobs (id, owner, status, submitted, finished, result, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.owner, job.status, job.submitted, job.finished, job.result, job.error),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            db.execute("DELETE FROM jobs WHERE coalesce(finished, submitted) < ?", (time.time() - self.ttl,))
+
+
+class JobManager:
+    """
+    Runs CPU-bound jobs in a process pool so request threads stay free.
+
+    At most `workers + max_queue` jobs are pending at once; beyond that
+    submit() raises JobQueueFull. Finished jobs are kept for `result_ttl`
+    seconds so their owner can collect the result. With a shared `store`
+    (SqliteJobStore), jobs submitted by other server processes can be
+    looked up too; the pool and its limits stay per process.
+    """
+
+    def __init__(self, workers=None, max_queue=16, cpu_seconds=30, result_ttl=600, store=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.cpu_seconds = cpu_seconds
+        self.result_ttl = result_ttl
+        self.store = store
+        self.jobs = {}
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        result_ttl = float(os.getenv("JOB_RESULT_TTL", "600"))
+        store = None
+        if os.getenv("JOB_BACKEND", "memory") == "sqlite":
+            store = SqliteJobStore(os.getenv("JOB_DB", "jobs.db"), result_ttl)
+        return cls(
+            workers=int(os.getenv("JOB_WORKERS", "0")) or None,
+            max_queue=int(os.getenv("JOB_QUEUE", "16")),
+            cpu_seconds=float(os.getenv("JOB_CPU_SECONDS", "30")),
+            result_ttl=result_ttl,
+            store=store,
+        )
+
+    def start(self):
+        """Start the pool and fork every worker now, rather than on the first uploads."""
+        with self._lock:
+            executor = self._ensure_executor()
+        for future in [executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            # forkserver: workers never inherit the web server's threads or open sockets
+            self._executor = ProcessPoolExecutor(
+                self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_worker,
+            )
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _purge(self, now):
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished is not None and now - job.finished > self.result_ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def submit(self, owner, fn, *args, on_done=None):
+        """Queue fn(*args) and return its Job; on_done(job) runs in the parent once it has finished."""
+        with self._lock:
+            self._purge(time.time())
+            if self.pending >= self.workers + self.max_queue:
+                raise JobQueueFull(f"Too many jobs pending ({self.pending}), try again later")
+            job = Job(secrets.token_urlsafe(12), owner)
+            try:
+                future = self._ensure_executor().submit(_run_limited, self.cpu_seconds, fn, args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the OOM killer): start a fresh pool
+                self._executor = None
+                future = self._ensure_executor().submit(_run_limited, self.cpu_seconds, fn, args)
+            job.future = future
+            self.jobs[job.id] = job
+            self.pending += 1
+        if self.store is not None:
+            self.store.put(job)
+        future.add_done_callback(lambda f: self._finish(job, f, on_done))
+        return job
+
+    def _finish(self, job, future, on_done):
+        if future.cancelled():
+            status, result, error = "failed", None, "Job cancelled"
+        elif isinstance(future.exception(), JobRejected):
+            status, result, error = "rejected", None, str(future.exception())
+        elif future.exception() is not None:
+            status, result, error = "failed", None, str(future.exception()) or "Job failed"
+        else:
+            status, result, error = "done", future.result(), None
+        with self._lock:
+            job.status, job.result, job.error = status, result, error
+            job.finished = time.time()
+            job.future = None
+            self.pending -= 1
+        try:
+            if on_done is not None:
+                on_done(job)
+        finally:
+            # Published last: another process seeing "done" must also find what on_done stored
+            if self.store is not None:
+                self.store.put(job)
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge(time.time())
+            job = self.jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.get(job_id)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self.pending,
+                "retained": len(self.jobs),
+            }
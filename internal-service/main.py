@@ -1,16 +1,55 @@
 #!/usr/bin/env python3
-from flask import Flask, request, render_template_string, session, redirect, url_for
-import pickle
-import base64
+from flask import Flask, Response, request, render_template_string, redirect, url_for, abort, jsonify
 from lxml import etree
+import contextlib
+import hashlib
 import os
 import ipaddress
+import tempfile
+
+from credentials import CredentialVerifier, LoginThrottled, VerifierBusy
+from documents import DocumentCache, QueryTooExpensive, run_query, xpath_stats
+from jobs import JobManager, JobQueueFull
+from sessions import SessionManager, SessionRecord
+from xmlproc import XmlLimitExceeded, XmlLimits, process_file
+from shared.logs import setup_logging
+from shared.metrics import CONTENT_TYPE, Registry, http_histogram, instrument_flask
+from shared.tracing import Tracer, trace_flask, trace_query
 
 # TODO ensure it's only accessible from the admin docker and nothing else
 
+# JSON logs written by a background thread; request handlers only enqueue (LOG_* env vars)
+setup_logging("internal-service")
+
 app = Flask(__name__)
 app.secret_key = 'ctf_secret_key_pleaseleavemealone'  # Weak secret for CTF
 
+# Prometheus metrics served on /metrics
+metrics_registry = Registry()
+instrument_flask(app, http_histogram(metrics_registry))
+XML_JOB_DURATION = metrics_registry.histogram(
+    "xml_job_seconds", "Time from upload to finished XML job, queueing included.", ("status",)
+)
+# Request spans, continuing the caller's trace when a traceparent header is present
+tracer = Tracer.from_env("internal-service")
+trace_flask(app, tracer)
+
+# Server-side sessions: the cookie only carries a signed session ID (SESSION_* env vars)
+sessions = SessionManager.from_env(app.secret_key)
+# Size, depth and element-count limits for uploaded XML (XML_* env vars)
+XML_LIMITS = XmlLimits.from_env()
+# Lines of XML result shown per dashboard page
+XML_RESULT_PAGE_LINES = int(os.getenv("XML_RESULT_PAGE_LINES", "200"))
+# XML parsing runs in a process pool (JOB_* env vars); uploads are spooled to JOB_SPOOL_DIR
+jobs = JobManager.from_env()
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR") or tempfile.gettempdir()
+# Uploaded documents by content hash, with their summaries and parsed trees (DOC_CACHE_* env vars)
+documents = DocumentCache.from_env(os.path.join(JOB_SPOOL_DIR, "xml-documents"), XML_LIMITS)
+# Maximum number of nodes returned by /documents/<digest>/query
+QUERY_MAX_RESULTS = int(os.getenv("QUERY_MAX_RESULTS", "100"))
+# Queries run on request threads: nodes an expression may visit at worst (see documents.xpath_cost)
+QUERY_MAX_COST = int(os.getenv("QUERY_MAX_COST", str(10 ** 7)))
+
 
 # Network restriction
 ALLOWED_SUBNET = ipaddress.IPv4Network('192.169.100.0/24')
@@ -29,6 +68,10 @@ def check_ip_access():
 def before_request():
     check_ip_access()
 
+@app.after_request
+def after_request(response):
+    return sessions.update_cookie(response)
+
 
 
 
@@ -103,6 +146,13 @@ DASHBOARD_TEMPLATE = '''
             <div class="result">
                 <h3>XML Processing Result:</h3>
                 <pre>{{ xml_result }}</pre>
+                {% if pages > 1 %}
+                    <p>
+                        {% if page > 1 %}<a href="/?page={{ page - 1 }}">← Previous</a>{% endif %}
+                        Page {{ page }} of {{ pages }}
+                        {% if page < pages %}<a href="/?page={{ page + 1 }}">Next →</a>{% endif %}
+                    </p>
+                {% endif %}
             </div>
         {% endif %}
         
@@ -112,18 +162,14 @@ DASHBOARD_TEMPLATE = '''
 </html>
 '''
 
-class User:
-    def __init__(self, username, is_admin=False):
-        self.username = username
-        self.is_admin = is_admin
-        self.session_data = {}
-
-# user database
+# user database (seeds the credential store, hashed with scrypt at startup)
 users = {
     'admin': 'admin',
     'user': 'password',
     'guest': 'guest123'
 }
+# Password checks run on a bounded KDF thread pool (CREDENTIAL_*, KDF_*, LOGIN_* env vars)
+credentials = CredentialVerifier.from_env(users)
 
 def is_safe(user_input):
     blacklist = [ "subprocess", "__", "system"]
@@ -131,46 +177,66 @@ def is_safe(user_input):
 
 @app.route('/')
 def index():
-    if 'user_data' in session:
-        try:
-            user_data = pickle.loads(base64.b64decode(session['user_data']))
-
-            if user_data in blacklist:
-                print("attack discovered, exiting")
-                return 
-
-            return render_template_string(DASHBOARD_TEMPLATE, 
-                                        username=user_data.username,
-                                        xml_result=session.get('xml_result', ''))
-        except:
-            session.clear()
+    user = sessions.current()
+    if user is not None:
+        if user.xml_job:
+            collect_job_result(user)
+        lines = user.xml_result.splitlines(keepends=True)
+        pages = max((len(lines) + XML_RESULT_PAGE_LINES - 1) // XML_RESULT_PAGE_LINES, 1)
+        page = min(max(request.args.get('page', 1, type=int), 1), pages)
+        start = (page - 1) * XML_RESULT_PAGE_LINES
+        return render_template_string(DASHBOARD_TEMPLATE, 
+                                    username=user.username,
+                                    xml_result="".join(lines[start:start + XML_RESULT_PAGE_LINES]),
+                                    page=page,
+                                    pages=pages)
     
     return render_template_string(LOGIN_TEMPLATE)
 
+def collect_job_result(user):
+    """Move the result of the user's last upload job into the session once it has finished."""
+    job = jobs.get(user.xml_job)
+    if job is None:
+        user.xml_result = "XML processing result expired, please upload the file again."
+    elif job.status == "done":
+        user.xml_result = job.result
+    elif job.status == "rejected":
+        user.xml_result = job.error
+    elif job.status == "failed":
+        user.xml_result = f"Error processing XML: {job.error}"
+    else:
+        user.xml_result = f"Processing XML (job {job.id}, {job.to_dict()['status']}), refresh this page for the result."
+        return
+    user.xml_job = ""
+    sessions.save(user)
+
 @app.route('/', methods=['POST'])
 def login():
-    username = request.form.get('username')
-    password = request.form.get('password')
+    username = request.form.get('username', '')
+    password = request.form.get('password', '')
     
-    if username in users and users[username] == password:
-        user = User(username, is_admin=(username == 'admin'))
-        
-        pickled_user = base64.b64encode(pickle.dumps(user)).decode()
-        session['user_data'] = pickled_user
+    try:
+        with tracer.span("verify password"):
+            authenticated = credentials.authenticate(username, password)
+    except LoginThrottled as e:
+        return render_template_string(LOGIN_TEMPLATE, error=str(e)), 429, {"Retry-After": str(e.retry_after)}
+    except VerifierBusy as e:
+        return render_template_string(LOGIN_TEMPLATE, error=str(e)), 503, {"Retry-After": "1"}
+    
+    if authenticated:
+        sessions.start(SessionRecord(username, is_admin=(username == 'admin')))
         
         return redirect(url_for('index'))
     else:
         return render_template_string(LOGIN_TEMPLATE, error="Invalid credentials")
 
+def wants_json():
+    return request.accept_mimetypes.best_match(["text/html", "application/json"]) == "application/json"
+
 @app.route('/upload', methods=['POST'])
 def upload_xml():
-    if 'user_data' not in session:
-        return redirect(url_for('index'))
-    
-    try:
-        user_data = pickle.loads(base64.b64decode(session['user_data']))
-    except:
-        session.clear()
+    user = sessions.current()
+    if user is None:
         return redirect(url_for('index'))
     
     if 'xmlfile' not in request.files:
@@ -181,37 +247,141 @@ def upload_xml():
         return redirect(url_for('index'))
     
     if file and file.filename.endswith('.xml'):
+        # Spool the upload to disk so the worker process can stream it from there, hashing it on the way
+        fd, spooled = tempfile.mkstemp(suffix=".xml", dir=JOB_SPOOL_DIR)
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as spool:
+            size = 0
+            while chunk := file.stream.read(64 * 1024):
+                size += len(chunk)
+                if size > XML_LIMITS.max_bytes:
+                    break
+                digest.update(chunk)
+                spool.write(chunk)
+        if size > XML_LIMITS.max_bytes:
+            os.unlink(spooled)
+            user.xml_job = ""
+            user.xml_result = f"XML rejected: Document is larger than {XML_LIMITS.max_bytes} bytes"
+            sessions.save(user)
+            return redirect(url_for('index'))
+        digest = digest.hexdigest()
+        
+        # Same content as an earlier upload: reuse its summary without parsing again
+        summary = documents.summary(digest, user.username)
+        if summary is not None:
+            os.unlink(spooled)
+            user.xml_job = ""
+            user.xml_result = summary
+            sessions.save(user)
+            if wants_json():
+                return jsonify(document=digest, status="done", result=summary)
+            return redirect(url_for('index'))
+        
+        # The job reads its own spooled copy: concurrent uploads of the same content never share a file
+        request_span = tracer.current()
+        
+        def on_done(job):
+            XML_JOB_DURATION.observe(job.finished - job.submitted, job.status)
+            # The job outlives the request: its span is recorded under the upload request afterwards
+            tracer.record("xml job", job.submitted, job.finished, request_span,
+                          status="ok" if job.status == "done" else "error",
+                          attributes={"job_id": job.id, "document": digest, "error": job.error})
+            if job.status == "done":
+                # Kept under its digest for queries; an identical upload may have put the same bytes there
+                os.replace(spooled, documents.path_for(digest))
+                documents.add(digest, job.result, job.owner)
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(spooled)
+        
         try:
-            xml_content = file.read().decode('utf-8')
-            
-            parser = etree.XMLParser(resolve_entities=True)
-            
-            root = etree.fromstring(xml_content, parser=parser)
-            
-            result = f"XML Root: {root.tag}\n"
-            result += f"Attributes: {root.attrib}\n"
-            result += f"Text content: {root.text}\n"
-            
-            # Recursively process child elements
-            for child in root:
-                result += f"Child: {child.tag} = {child.text}\n"
-                if child.attrib:
-                    result += f"  Attributes: {child.attrib}\n"
-            
-            session['xml_result'] = result
-            
-        except etree.ParseError as e:
-            session['xml_result'] = f"XML Parse Error: {str(e)}"
-        except Exception as e:
-            session['xml_result'] = f"Error processing XML: {str(e)}"
+            job = jobs.submit(user.username, process_file, spooled, XML_LIMITS, on_done=on_done)
+        except JobQueueFull as e:
+            os.unlink(spooled)
+            return jsonify(error=str(e)), 429, {"Retry-After": "1"}
+        
+        user.xml_job = job.id
+        user.xml_result = ""
+        sessions.save(user)
+        
+        if wants_json():
+            status_url = url_for('job_status', job_id=job.id)
+            return jsonify(job_id=job.id, document=digest, status=job.status, url=status_url), 202, {"Location": status_url}
     
     return redirect(url_for('index'))
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    user = sessions.current()
+    if user is None:
+        return jsonify(error="Not logged in"), 401
+    
+    job = jobs.get(job_id)
+    if job is None or job.owner != user.username:
+        return jsonify(error="Unknown or expired job"), 404
+    return jsonify(job.to_dict())
+
+@app.route('/documents/<digest>/query')
+def query_document(digest):
+    """
+    Usage: /documents/<sha256>/query?xpath=//item/@id
+    
+    Runs an XPath expression against a previously uploaded document.
+    """
+    user = sessions.current()
+    if user is None:
+        return jsonify(error="Not logged in"), 401
+    
+    expr = request.args.get('xpath', '')
+    if not expr:
+        return jsonify(error="xpath parameter is required"), 400
+    try:
+        tree = documents.tree(digest, user.username)
+        if tree is None:
+            # Also for documents uploaded by other users, as /jobs/<id> does
+            return jsonify(error="Unknown or evicted document, upload it again"), 404
+        return jsonify(document=digest, xpath=expr, **run_query(tree, expr, QUERY_MAX_RESULTS, max_cost=QUERY_MAX_COST))
+    except etree.XPathError as e:
+        return jsonify(error=f"Invalid XPath: {str(e)}"), 400
+    except QueryTooExpensive as e:
+        return jsonify(error=str(e)), 422
+    except XmlLimitExceeded as e:
+        return jsonify(error=f"XML rejected: {str(e)}"), 422
+    except etree.ParseError as e:
+        return jsonify(error=f"XML Parse Error: {str(e)}"), 422
+
+@app.route('/documents/stats')
+def document_stats():
+    return jsonify(documents=documents.stats(), xpath=xpath_stats())
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_registry.render(), content_type=CONTENT_TYPE)
+
+@app.route('/traces')
+def slow_traces():
+    """Recent requests that took at least ?min_ms= milliseconds, with their trace IDs."""
+    return jsonify(trace_query(tracer.collector, request.args.get('min_ms', 0.0, type=float),
+                               request.args.get('limit', 20, type=int)))
+
+@app.route('/traces/<trace_id>')
+def trace_spans(trace_id):
+    return jsonify(trace_id=trace_id, spans=tracer.collector.trace(trace_id))
+
 @app.route('/logout')
 def logout():
-    session.clear()
+    sessions.clear()
     return redirect(url_for('index'))
 
+def warm_up():
+    """Startup hook for the ASGI server (see asgi.py)."""
+    jobs.start()
+    credentials.start()
+
+def shutdown():
+    jobs.shutdown()
+    credentials.shutdown()
+
 if __name__ == '__main__':
     # Create flag file for CTF
     print("Starting server on http://localhost:5000")
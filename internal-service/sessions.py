@@ -0,0 +1,211 @@
+import os
+import secrets
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request
+from itsdangerous import BadSignature, Signer
+
+SESSION_COOKIE = "sid"
+
+# version, is_admin, created, len(username), len(xml_job), len(xml_result)
+RECORD_HEADER = struct.Struct("<BBdHBI")
+RECORD_VERSION = 2
+
+_MISSING = object()
+
+
+class SessionRecord:
+    """Server-side session state, encoded with a fixed binary layout (no pickle)."""
+
+    __slots__ = ("username", "is_admin", "created", "xml_job", "xml_result")
+
+    def __init__(self, username, is_admin=False, created=None, xml_job="", xml_result=""):
+        self.username = username
+        self.is_admin = is_admin
+        self.created = time.time() if created is None else created
+        self.xml_job = xml_job
+        self.xml_result = xml_result
+
+    def encode(self):
+        username = self.username.encode("utf-8")
+        xml_job = self.xml_job.encode("ascii")
+        xml_result = self.xml_result.encode("utf-8")
+        header = RECORD_HEADER.pack(
+            RECORD_VERSION, self.is_admin, self.created, len(username), len(xml_job), len(xml_result)
+        )
+        return header + username + xml_job + xml_result
+
+    @classmethod
+    def decode(cls, data):
+        version, is_admin, created, username_len, job_len, result_len = RECORD_HEADER.unpack_from(data)
+        if version != RECORD_VERSION or len(data) != RECORD_HEADER.size + username_len + job_len + result_len:
+            raise ValueError("Malformed session record")
+        offset = RECORD_HEADER.size
+        username = data[offset:offset + username_len].decode("utf-8")
+        offset += username_len
+        xml_job = data[offset:offset + job_len].decode("ascii")
+        xml_result = data[offset + job_len:].decode("utf-8")
+        return cls(username, bool(is_admin), created, xml_job, xml_result)
+
+
+class MemoryStore:
+    """In-process LRU of encoded sessions with a TTL (one copy per worker)."""
+
+    def __init__(self, ttl=3600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.time():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return data
+
+    def set(self, session_id, data):
+        with self._lock:
+            self._entries[session_id] = (time.time() + self.ttl, data)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+class SqliteStore:
+    """
+    Sessions in a SQLite database in WAL mode, so several worker processes
+    can share them. Each thread keeps its own connection.
+    """
+
+    # Expired rows are swept once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, session_id):
+        row = self._connect().execute(
+            "SELECT data FROM sessions WHERE id = ? AND expires >= ?", (session_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, session_id, data):
+        db = self._connect()
+        db.execute(
+            "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+            (session_id, data, time.time() + self.ttl),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            db.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+    def delete(self, session_id):
+        self._connect().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class SessionManager:
+    """
+    Keeps only a signed, fixed-size random session ID in the cookie and the
+    state in `store`. The record is loaded at most once per request and
+    cached on flask.g.
+    """
+
+    def __init__(self, secret_key, store, ttl=3600):
+        self.signer = Signer(secret_key, salt="internal-service.session")
+        self.store = store
+        self.ttl = ttl
+
+    @classmethod
+    def from_env(cls, secret_key):
+        ttl = int(os.getenv("SESSION_TTL", "3600"))
+        if os.getenv("SESSION_BACKEND", "memory") == "sqlite":
+            store = SqliteStore(os.getenv("SESSION_DB", "sessions.db"), ttl)
+        else:
+            store = MemoryStore(ttl, int(os.getenv("SESSION_MAX_ENTRIES", "10000")))
+        return cls(secret_key, store, ttl)
+
+    def _session_id(self):
+        cookie = request.cookies.get(SESSION_COOKIE)
+        if not cookie:
+            return None
+        try:
+            return self.signer.unsign(cookie).decode()
+        except BadSignature:
+            return None
+
+    def current(self):
+        """The session record for this request, or None when not logged in."""
+        record = g.get("session_record", _MISSING)
+        if record is not _MISSING:
+            return record
+        record = None
+        session_id = self._session_id()
+        data = self.store.get(session_id) if session_id else None
+        if data is not None:
+            try:
+                record = SessionRecord.decode(data)
+            except (ValueError, struct.error, UnicodeDecodeError):
+                self.store.delete(session_id)
+        g.session_id = session_id if record is not None else None
+        g.session_record = record
+        return record
+
+    def start(self, record):
+        """Store `record` under a fresh session ID (never reuse the one sent by the client)."""
+        session_id = secrets.token_urlsafe(16)
+        self.store.set(session_id, record.encode())
+        g.session_id = session_id
+        g.session_record = record
+        g.session_cookie = self.signer.sign(session_id).decode()
+
+    def save(self, record):
+        if g.get("session_id"):
+            self.store.set(g.session_id, record.encode())
+
+    def clear(self):
+        self.current()
+        if g.session_id:
+            self.store.delete(g.session_id)
+        g.session_id = None
+        g.session_record = None
+        g.session_cookie = ""
+
+    def update_cookie(self, response):
+        """after_request hook: send the cookie set by start() or clear() in this request."""
+        cookie = g.get("session_cookie")
+        if cookie:
+            response.set_cookie(SESSION_COOKIE, cookie, max_age=self.ttl, httponly=True, samesite="Lax")
+        elif cookie == "":
+            response.delete_cookie(SESSION_COOKIE)
+        return response
@@ -0,0 +1,148 @@
+import os
+from dataclasses import dataclass
+
+from lxml import etree
+
+from jobs import JobRejected
+
+
+class XmlLimitExceeded(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class XmlLimits:
+    max_bytes: int = 10 * 1024 * 1024
+    max_depth: int = 64
+    max_elements: int = 100000
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.getenv("XML_MAX_BYTES", cls.max_bytes)),
+            max_depth=int(os.getenv("XML_MAX_DEPTH", cls.max_depth)),
+            max_elements=int(os.getenv("XML_MAX_ELEMENTS", cls.max_elements)),
+        )
+
+
+class LimitedReader:
+    """File-like wrapper that fails once more than `max_bytes` have been read."""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            raise XmlLimitExceeded(f"Document is larger than {self.max_bytes} bytes")
+        return data
+
+
+def _limited_events(reader, limits):
+    """
+    etree.iterparse over `reader` (a LimitedReader) with entities, DTDs and
+    the network disabled, raising XmlLimitExceeded as soon as a limit is
+    crossed. Yields (event, element, depth).
+    """
+    events = etree.iterparse(
+        reader,
+        events=("start", "end"),
+        resolve_entities=False,
+        load_dtd=False,
+        no_network=True,
+        huge_tree=False,
+    )
+    depth = 0
+    elements = 0
+    for event, elem in events:
+        if event == "start":
+            depth += 1
+            elements += 1
+            if depth > limits.max_depth:
+                raise XmlLimitExceeded(f"Document is nested deeper than {limits.max_depth} levels")
+            if elements > limits.max_elements:
+                raise XmlLimitExceeded(f"Document has more than {limits.max_elements} elements")
+            yield event, elem, depth
+        else:
+            yield event, elem, depth
+            depth -= 1
+
+
+def summarize(stream, limits):
+    """
+    Parse `stream` incrementally and return the summary lines: the root
+    element, then one entry per direct child.
+
+    Entities are not resolved, no DTD is loaded and the network is never
+    used. Every element is cleared as soon as it has been summarized, so
+    memory stays flat whatever the document size.
+    """
+    reader = LimitedReader(stream, limits.max_bytes)
+    lines = []
+    root = None
+    root_text_done = False
+    max_depth = 0
+    elements = 0
+    for event, elem, depth in _limited_events(reader, limits):
+        if event == "start":
+            elements += 1
+            max_depth = max(max_depth, depth)
+            if depth == 1:
+                root = elem
+                lines.append(f"XML Root: {elem.tag}")
+                lines.append(f"Attributes: {dict(elem.attrib)}")
+            elif depth == 2 and not root_text_done:
+                # The root's leading text is complete once its first child starts
+                lines.append(f"Text content: {root.text}")
+                root_text_done = True
+            continue
+
+        if depth == 1:
+            if not root_text_done:
+                lines.insert(2, f"Text content: {root.text}")
+            continue
+        if depth == 2:
+            lines.append(f"Child: {elem.tag} = {elem.text}")
+            if elem.attrib:
+                lines.append(f"  Attributes: {dict(elem.attrib)}")
+        # Drop everything already summarized (the element and its earlier siblings)
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+    lines.append(f"Elements processed: {elements} (max depth {max_depth}, {reader.bytes_read} bytes)")
+    return lines
+
+
+def parse_file(path, limits):
+    """
+    Full tree of the XML file at `path`, under the same parser settings and
+    limits as summarize (raises XmlLimitExceeded or etree.ParseError).
+    """
+    with open(path, "rb") as f:
+        events = _limited_events(LimitedReader(f, limits.max_bytes), limits)
+        root = None
+        for _, elem, _ in events:
+            if root is None:
+                root = elem
+    return etree.ElementTree(root)
+
+
+def process_file(path, limits):
+    """
+    Summarize the XML file at `path` and return the result text shown on the
+    dashboard. A document that cannot be summarized raises JobRejected with
+    the text to show instead, so that it is never cached.
+    """
+    try:
+        with open(path, "rb") as f:
+            return "\n".join(summarize(f, limits)) + "\n"
+    except XmlLimitExceeded as e:
+        raise JobRejected(f"XML rejected: {str(e)}") from None
+    except etree.ParseError as e:
+        raise JobRejected(f"XML Parse Error: {str(e)}") from None
+    except Exception as e:
+        raise JobRejected(f"Error processing XML: {str(e)}") from None
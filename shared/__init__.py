@@ -0,0 +1 @@
+"""Code shared by vulnerable-app, admin-service and internal-service."""
@@ -0,0 +1,173 @@
+"""
+Non-blocking JSON logging shared by the services.
+
+Request code only puts records on a bounded in-memory queue; a listener
+thread formats them and writes one JSON object per line. Messages are
+%-style templates whose arguments are formatted by the listener, never on
+the request path. When the queue is full, records are dropped and counted
+rather than waiting on the output.
+
+Records logged with `extra={"sample_key": ...}` are sampled: within each
+window, a given key is logged once and a message template at most
+`per_window` times. The number of suppressed records is reported on the
+next record of that template.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from shared.tracing import Tracer
+
+# Record attributes that are not `extra` fields (color_message: uvicorn's ANSI copy of msg)
+_STANDARD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {
+    "message", "asctime", "taskName", "color_message", "sample_key",
+}
+
+_listener: QueueListener | None = None
+
+
+def _cap(value: str, limit: int) -> str:
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...[+{len(value) - limit} chars]"
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, service, process ID
+    (worker processes share the output), message, the trace ID when the
+    record was logged inside a span, and any `extra` fields. The message
+    and traceback are capped at `max_message` characters, every other
+    string field at `max_field`.
+    """
+
+    def __init__(self, service: str, max_message: int = 2048, max_field: int = 512):
+        super().__init__()
+        self.service = service
+        self.max_message = max_message
+        self.max_field = max_field
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "service": self.service,
+            "pid": record.process,
+            "msg": _cap(record.getMessage(), self.max_message),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS:
+                if not isinstance(value, (int, float, bool, type(None))):
+                    value = _cap(str(value), self.max_field)
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = _cap(self.formatException(record.exc_info), self.max_message)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """Deduplicates and rate-limits records carrying a `sample_key` attribute (see module docstring)."""
+
+    def __init__(self, window: float = 10.0, per_window: int = 20):
+        super().__init__()
+        self.window = window
+        self.per_window = per_window
+        # Per message template: [window start, keys logged in this window, suppressed count]
+        self._groups: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample_key", None)
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            group = self._groups.get(record.msg)
+            if group is None or now - group[0] >= self.window:
+                suppressed = group[2] if group else 0
+                group = self._groups[record.msg] = [now, set(), 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            elif key in group[1] or len(group[1]) >= self.per_window:
+                group[2] += 1
+                return False
+            group[1].add(key)
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # No formatting here (QueueHandler's default would): only capture what
+        # belongs to the calling context
+        span = Tracer.current()
+        if span is not None and not hasattr(record, "trace_id"):
+            record.trace_id = span.trace_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+
+def setup_logging(service: str, capture: tuple[str, ...] = ("uvicorn", "uvicorn.access")) -> QueueListener:
+    """
+    Route the root logger, and the non-propagating loggers in `capture`,
+    through the queue. Configured from LOG_LEVEL, LOG_QUEUE_SIZE,
+    LOG_MAX_MESSAGE_CHARS, LOG_MAX_FIELD_CHARS, LOG_SAMPLE_WINDOW and
+    LOG_SAMPLE_PER_WINDOW. Only the first call in a process has an effect.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter(
+        service,
+        max_message=int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2048")),
+        max_field=int(os.getenv("LOG_MAX_FIELD_CHARS", "512")),
+    ))
+    handler = _NonBlockingQueueHandler(queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000"))))
+    handler.addFilter(SampleFilter(
+        window=float(os.getenv("LOG_SAMPLE_WINDOW", "10")),
+        per_window=int(os.getenv("LOG_SAMPLE_PER_WINDOW", "20")),
+    ))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name in capture:
+        captured = logging.getLogger(name)
+        captured.handlers = [handler]
+        captured.propagate = False
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)
+    return _listener
+
+
+def _stop_listener() -> None:
+    try:
+        _listener.stop()
+    except queue.Full:
+        # No room for the stop sentinel: the listener thread is a daemon, leave it
+        pass
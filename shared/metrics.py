@@ -0,0 +1,214 @@
+"""
+Minimal Prometheus-style metrics: counters and histograms rendered in the
+text exposition format, plus request instrumentation for ASGI and Flask.
+
+Recording is a bisect and a few additions under an uncontended lock, cheap
+enough to stay on in production. Label values are passed positionally, in
+the order given by `labelnames`.
+
+When a service runs as several worker processes, each one can publish
+`Registry.export()` and render the sum of every worker's series with
+`Registry.render(peers)`.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def export(self) -> list:
+        with self._lock:
+            return [[list(labelvalues), value] for labelvalues, value in self._values.items()]
+
+    def render(self, peers: list[list] = ()) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for series in peers:
+            for labelvalues, value in series:
+                labelvalues = tuple(labelvalues)
+                values[labelvalues] = values.get(labelvalues, 0.0) + value
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (+Inf last), sum]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def export(self) -> list:
+        with self._lock:
+            return [[list(labelvalues), list(counts), total] for labelvalues, (counts, total) in self._series.items()]
+
+    def render(self, peers: list[list] = ()) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for exported in peers:
+            for labelvalues, counts, total in exported:
+                labelvalues = tuple(labelvalues)
+                if len(counts) != len(self.buckets) + 1:
+                    continue  # other bucket bounds (another version of the service): not addable
+                mine = series.get(labelvalues)
+                if mine is None:
+                    series[labelvalues] = (list(counts), total)
+                else:
+                    series[labelvalues] = ([a + b for a, b in zip(mine[0], counts)], mine[1] + total)
+        for labelvalues, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labelvalues)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def export(self) -> dict[str, list]:
+        """Every series, as JSON-serializable data for `render(peers)` in another process."""
+        return {metric.name: metric.export() for metric in self._metrics}
+
+    def render(self, peers: list[dict[str, list]] = ()) -> str:
+        """Text exposition of this registry, with the series exported by `peers` added in."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render([peer.get(metric.name, []) for peer in peers]))
+        return "\n".join(lines) + "\n"
+
+
+def http_histogram(registry: Registry) -> Histogram:
+    return registry.histogram(
+        "http_request_duration_seconds",
+        "Inbound request duration until the last response byte, by route template.",
+        ("route", "method", "status"),
+    )
+
+
+class RouteNames:
+    """
+    Path template of the endpoint an ASGI request was routed to (never the
+    raw path, to keep cardinality bounded), looked up in `router.routes`.
+    """
+
+    def __init__(self, router):
+        self.router = router
+        self._paths: dict | None = None
+
+    def __call__(self, scope) -> str:
+        if self._paths is None:
+            self._paths = {
+                route.endpoint: route.path for route in self.router.routes if hasattr(route, "endpoint")
+            }
+        return self._paths.get(scope.get("endpoint"), "<unmatched>")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request into `histogram`, labelled by route template."""
+
+    def __init__(self, app, histogram: Histogram, router):
+        self.app = app
+        self.histogram = histogram
+        self.routes = RouteNames(router)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.histogram.observe(time.perf_counter() - started, self.routes(scope), scope["method"], str(status))
+
+
+def instrument_flask(app, histogram: Histogram) -> None:
+    """Time every Flask request into `histogram`, labelled by URL rule."""
+    from flask import g, request
+
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    def record(response):
+        started = g.get("metrics_started")
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            histogram.observe(time.perf_counter() - started, route, request.method, str(response.status_code))
+        return response
+
+    # First before_request hook, so requests rejected by later hooks are timed too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+    app.after_request(record)
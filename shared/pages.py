@@ -0,0 +1,139 @@
+import gzip
+import hashlib
+from string import Formatter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Dynamic bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+
+class Template:
+    """
+    A page split once into static byte segments around its {slot} fields.
+
+    Uses str.format syntax ({{ and }} are literal braces), so existing
+    f-string pages can be turned into templates unchanged. render() only
+    joins bytes: the static parts are never formatted again. Values are
+    inserted as-is; escaping them is the caller's job.
+    """
+
+    def __init__(self, text: str):
+        self.segments: list[bytes] = []
+        self.fields: list[str] = []
+        pending = []
+        for literal, field, _, _ in Formatter().parse(text):
+            pending.append(literal)
+            if field is not None:
+                self.segments.append("".join(pending).encode())
+                self.fields.append(field)
+                pending = []
+        self.segments.append("".join(pending).encode())
+
+    def bind(self, **values: str) -> "Template":
+        """Return a template with some fields filled in for good (e.g. host identity)."""
+        bound = Template.__new__(Template)
+        bound.segments, bound.fields = [self.segments[0]], []
+        for field, segment in zip(self.fields, self.segments[1:]):
+            if field in values:
+                bound.segments[-1] += str(values[field]).encode() + segment
+            else:
+                bound.fields.append(field)
+                bound.segments.append(segment)
+        return bound
+
+    def render(self, **values: str) -> bytes:
+        parts = [self.segments[0]]
+        for field, segment in zip(self.fields, self.segments[1:]):
+            parts.append(str(values[field]).encode())
+            parts.append(segment)
+        return b"".join(parts)
+
+
+def _accepted_encodings(accept_encoding: str) -> set[str]:
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip())
+    return accepted
+
+
+class Page:
+    """
+    A rendered body with a strong ETag and its compressed variants.
+
+    Static pages are built once at startup with precompress=True, so gzip
+    (and brotli when installed) are computed ahead of time at maximum level.
+    Dynamic pages compress lazily at a fast level, only when asked for.
+    """
+
+    def __init__(self, body: bytes, content_type: str = "text/html; charset=utf-8",
+                 precompress: bool = False, cache_control: str = "no-cache"):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self._variants: dict[str, bytes] = {"identity": body}
+        self._precompressed = precompress
+        if precompress:
+            self._variants["gzip"] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self._variants["br"] = brotli.compress(body, quality=11)
+
+    def variant(self, accept_encoding: str) -> tuple[str, bytes]:
+        """Pick the best encoding the client accepts (br, then gzip, then identity)."""
+        if len(self.body) < MIN_COMPRESS_SIZE:
+            return "identity", self.body
+        accepted = _accepted_encodings(accept_encoding)
+        for coding in ("br", "gzip"):
+            if coding not in accepted and "*" not in accepted:
+                continue
+            if coding not in self._variants:
+                if self._precompressed or (coding == "br" and brotli is None):
+                    continue
+                self._variants[coding] = (
+                    brotli.compress(self.body, quality=4) if coding == "br"
+                    else gzip.compress(self.body, 5, mtime=0)
+                )
+            return coding, self._variants[coding]
+        return "identity", self.body
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """True when If-None-Match names this page (weak comparison, as RFC 9110 requires)."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == self.etag for tag in if_none_match.split(","))
+
+    def respond(self, if_none_match: str | None, accept_encoding: str) -> tuple[int, dict[str, str], bytes]:
+        """(status, headers, body) for a GET with the given request headers."""
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding", "Cache-Control": self.cache_control}
+        if self.matches(if_none_match):
+            return 304, headers, b""
+        coding, body = self.variant(accept_encoding or "")
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        headers["Content-Type"] = self.content_type
+        return 200, headers, body
+
+
+def page_response(request, page: Page, status_code: int = 200):
+    """Starlette/FastAPI response for `page`, honouring If-None-Match and Accept-Encoding."""
+    from starlette.responses import Response
+
+    status, headers, body = page.respond(
+        request.headers.get("if-none-match"), request.headers.get("accept-encoding", "")
+    )
+    return Response(body, status_code=status_code if status == 200 else status, headers=headers)
@@ -0,0 +1,345 @@
+"""
+Lightweight request tracing across the services, without an external backend.
+
+Trace context travels in the W3C `traceparent` header
+(00-<32 hex trace id>-<16 hex parent span id>-<flags>). Each service keeps
+its finished spans in an in-process ring buffer, served on /traces, and can
+also append them as JSON lines to TRACE_FILE, rotated at TRACE_FILE_MAX_BYTES
+with TRACE_FILE_BACKUPS old files kept (TRACE_FILE.1 is the newest). The nginx access log in
+`nginx.conf` writes the same fields, so `shared.waterfall` can merge every
+hop of a request into one waterfall.
+
+The current span lives in a context variable: asyncio tasks and threads
+started from a request inherit it, and `Tracer.inject` puts it on outbound
+requests.
+"""
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from shared.metrics import RouteNames
+
+TRACEPARENT = "traceparent"
+TRACE_ID_HEADER = "x-trace-id"
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+def parse_traceparent(value: str | None) -> tuple[str, str] | None:
+    """(trace_id, parent span_id) from a traceparent header, or None when absent or malformed."""
+    match = _TRACEPARENT_RE.match(value.strip().lower()) if value else None
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent_id", "name", "kind",
+                 "start", "duration", "status", "attributes", "_started")
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: str | None,
+                 kind: str = "internal", attributes: dict | None = None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        # Wall clock to line spans up across services, monotonic clock for the duration
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration: float | None = None
+        self.status = "ok"
+        self.attributes = attributes or {}
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def fail(self, error) -> None:
+        self.status = "error"
+        self.attributes["error"] = str(error) or type(error).__name__
+
+    def finish(self) -> None:
+        """Record the span; later calls are ignored."""
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+            self.tracer.collector.add(self)
+
+    def record_child(self, name: str, started: float, status: str = "ok") -> "Span":
+        """Record a finished child span that began at perf_counter() value `started` and ends now."""
+        child = Span(self.tracer, name, self.trace_id, self.span_id)
+        child.start = self.start + (started - self._started)
+        child._started = started
+        child.status = status
+        child.finish()
+        return child
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": self.tracer.service,
+            "name": self.name,
+            "kind": self.kind,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class Collector:
+    """
+    The last `capacity` finished spans, optionally also appended to `path`.
+
+    File writes happen on a background thread, so finishing a span never
+    waits on the disk. At most `max_queue` spans wait for it: past that they
+    are dropped from the file (not from the buffer) and counted in `dropped`.
+    The file is rotated once it reaches `max_bytes` (0 for no limit), keeping
+    `backups` old files.
+    """
+
+    def __init__(self, capacity: int = 10000, path: str | None = None, max_queue: int = 10000,
+                 max_bytes: int = 64 * 1024 * 1024, backups: int = 3):
+        self.capacity = capacity
+        self.path = path
+        self.max_queue = max_queue
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._spans: deque[Span] = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._queue: queue.Queue | None = None
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+            if self.path and self._queue is None:
+                self._queue = queue.Queue(self.max_queue)
+                threading.Thread(target=self._write, name="trace-writer", daemon=True).start()
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+
+    def _rotate(self) -> None:
+        if self.backups <= 0:
+            os.truncate(self.path, 0)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _write(self) -> None:
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while True:
+                lines = [json.dumps(self._queue.get().to_dict(), default=str) + "\n"]
+                # Drain what is already queued before paying for a flush
+                while not self._queue.empty():
+                    lines.append(json.dumps(self._queue.get().to_dict(), default=str) + "\n")
+                f.writelines(lines)
+                f.flush()
+                if self.max_bytes and f.tell() >= self.max_bytes:
+                    f.close()
+                    self._rotate()
+                    f = open(self.path, "a", encoding="utf-8")
+        finally:
+            f.close()
+
+    def trace(self, trace_id: str) -> list[dict]:
+        with self._lock:
+            spans = [span for span in self._spans if span.trace_id == trace_id]
+        return sorted((span.to_dict() for span in spans), key=lambda span: span["start"])
+
+    def slowest(self, min_ms: float = 0.0, limit: int = 20) -> list[dict]:
+        """Most recent server spans lasting at least `min_ms`, newest first."""
+        found = []
+        with self._lock:
+            for span in reversed(self._spans):
+                if span.kind == "server" and span.duration * 1000 >= min_ms:
+                    found.append(span)
+                    if len(found) >= limit:
+                        break
+        return [span.to_dict() for span in found]
+
+
+class Tracer:
+    """
+    Creates spans for `service`.
+
+    With `accept_parent` false the service is an edge: incoming traceparent
+    headers are ignored and every request starts a new trace.
+    """
+
+    def __init__(self, service: str, collector: Collector, accept_parent: bool = True):
+        self.service = service
+        self.collector = collector
+        self.accept_parent = accept_parent
+
+    @classmethod
+    def from_env(cls, service: str, **kwargs) -> "Tracer":
+        return cls(
+            service,
+            Collector(
+                int(os.getenv("TRACE_BUFFER_SPANS", "10000")),
+                os.getenv("TRACE_FILE") or None,
+                max_queue=int(os.getenv("TRACE_QUEUE_SPANS", "10000")),
+                max_bytes=int(os.getenv("TRACE_FILE_MAX_BYTES", str(64 * 1024 * 1024))),
+                backups=int(os.getenv("TRACE_FILE_BACKUPS", "3")),
+            ),
+            **kwargs,
+        )
+
+    @staticmethod
+    def current() -> Span | None:
+        return _current.get()
+
+    def start_span(self, name: str, kind: str = "internal", parent: "Span | tuple[str, str] | None" = None,
+                   attributes: dict | None = None) -> Span:
+        """New span under `parent` (a Span or a (trace_id, span_id) pair), the current span by default."""
+        if parent is None:
+            parent = _current.get()
+        if isinstance(parent, Span):
+            parent = (parent.trace_id, parent.span_id)
+        trace_id, parent_id = parent if parent else (secrets.token_hex(16), None)
+        return Span(self, name, trace_id, parent_id, kind, attributes)
+
+    def start_server_span(self, name: str, headers) -> Span:
+        """Span for an inbound request, continuing the caller's trace when allowed."""
+        parent = parse_traceparent(headers.get(TRACEPARENT)) if self.accept_parent else None
+        return Span(self, name, *(parent or (secrets.token_hex(16), None)), kind="server")
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Run the block as a child of the current span."""
+        span = self.start_span(name, attributes=attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.finish()
+
+    def record(self, name: str, start: float, end: float, parent: "Span | None",
+               status: str = "ok", attributes: dict | None = None) -> Span:
+        """Record a span timed elsewhere, from wall clock `start` to `end` (e.g. work done in another process)."""
+        span = self.start_span(name, parent=parent or (secrets.token_hex(16), None), attributes=attributes)
+        span.start, span.duration, span.status = start, max(end - start, 0.0), status
+        self.collector.add(span)
+        return span
+
+    @staticmethod
+    def inject(headers, span: Span | None = None) -> None:
+        span = span or _current.get()
+        if span is not None:
+            headers[TRACEPARENT] = span.traceparent
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a server span for every HTTP request.
+
+    The span is named after the route template once the request is routed
+    and lasts until the last response byte; the trace ID is returned in an
+    X-Trace-Id header.
+    """
+
+    def __init__(self, app, tracer: Tracer, router):
+        self.app = app
+        self.tracer = tracer
+        self.routes = RouteNames(router)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+        span = self.tracer.start_server_span(scope["method"], headers)
+        span.set("path", scope["path"])
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                span.set("status_code", message["status"])
+                if message["status"] >= 500:
+                    span.status = "error"
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (TRACE_ID_HEADER.encode(), span.trace_id.encode())]}
+            await send(message)
+
+        token = _current.set(span)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            span.fail(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.name = f"{scope['method']} {self.routes(scope)}"
+            span.finish()
+
+
+def trace_flask(app, tracer: Tracer) -> None:
+    """Open a server span for every Flask request, closed on teardown."""
+    from flask import g, request
+
+    def start_span():
+        span = tracer.start_server_span(request.method, request.headers)
+        span.set("path", request.path)
+        g.trace_span = span
+        g.trace_token = _current.set(span)
+
+    def tag_response(response):
+        span = g.get("trace_span")
+        if span is not None:
+            span.set("status_code", response.status_code)
+            if response.status_code >= 500:
+                span.status = "error"
+            response.headers["X-Trace-Id"] = span.trace_id
+        return response
+
+    def finish_span(error):
+        span = g.pop("trace_span", None)
+        if span is None:
+            return
+        if error is not None:
+            span.fail(error)
+        try:
+            _current.reset(g.pop("trace_token"))
+        except ValueError:
+            # Teardown ran in another context (streamed response): just clear it
+            _current.set(None)
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        span.name = f"{request.method} {rule}"
+        span.finish()
+
+    # First before_request hook, so requests rejected by later hooks are traced too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_span)
+    app.after_request(tag_response)
+    app.teardown_request(finish_span)
+
+
+def trace_query(collector: Collector, min_ms: float = 0.0, limit: int = 20) -> dict:
+    """Body of GET /traces: the recent slow requests seen by this service."""
+    return {"min_ms": min_ms, "dropped": collector.dropped,
+            "traces": collector.slowest(min_ms, min(max(limit, 1), 500))}
@@ -0,0 +1,121 @@
+"""
+Rebuild the waterfall of one trace from every service that saw it.
+
+    python -m shared.waterfall <trace id> traces/*.jsonl traces/nginx.log
+    python -m shared.waterfall <trace id> http://localhost:8000 traces/nginx.log
+    python -m shared.waterfall --slow 500 http://localhost:8000
+
+Sources are TRACE_FILE span logs, the nginx "trace" access log, or base URLs
+of running services (their /traces endpoints are queried). With --slow, the
+recent requests slower than the given number of milliseconds are listed
+instead, so their trace IDs can be fed back in.
+"""
+import argparse
+import json
+import sys
+import urllib.request
+
+BAR_WIDTH = 40
+
+
+def _normalize(record: dict) -> dict:
+    # nginx only knows when the request ended and how long it took
+    if "start" not in record and "msec" in record:
+        duration = float(record.get("request_time") or 0)
+        record["start"] = float(record["msec"]) - duration
+        record["duration_ms"] = round(duration * 1000, 3)
+        record.setdefault("attributes", {}).update(
+            {key: record[key] for key in ("status_code", "upstream_response_time", "upstream") if record.get(key)}
+        )
+    record["parent_id"] = record.get("parent_id") or None
+    record.setdefault("attributes", {})
+    record.setdefault("status", "ok")
+    return record
+
+
+def _read_file(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("{"):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def _get_json(url: str):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def load_trace(trace_id: str, sources: list[str]) -> list[dict]:
+    spans = {}
+    for source in sources:
+        if source.startswith(("http://", "https://")):
+            records = _get_json(f"{source.rstrip('/')}/traces/{trace_id}")["spans"]
+        else:
+            records = (record for record in _read_file(source) if record.get("trace_id") == trace_id)
+        for record in records:
+            record = _normalize(record)
+            spans[(record.get("service"), record["span_id"])] = record
+    return sorted(spans.values(), key=lambda span: span["start"])
+
+
+def render(spans: list[dict]) -> str:
+    if not spans:
+        return "no spans found"
+    origin = min(span["start"] for span in spans)
+    end = max(span["start"] + (span["duration_ms"] or 0) / 1000 for span in spans)
+    total_ms = max((end - origin) * 1000, 0.001)
+
+    ids = {span["span_id"] for span in spans}
+    children = {}
+    for span in spans:
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        children.setdefault(parent, []).append(span)
+
+    lines = [f"trace {spans[0]['trace_id']}  {total_ms:.1f} ms  {len(spans)} spans", ""]
+
+    def walk(parent, depth):
+        for span in children.get(parent, []):
+            offset = (span["start"] - origin) * 1000
+            duration = span["duration_ms"] or 0
+            left = int(offset / total_ms * BAR_WIDTH)
+            width = max(int(duration / total_ms * BAR_WIDTH), 1)
+            bar = " " * left + "█" * min(width, BAR_WIDTH - left)
+            label = f"{'  ' * depth}{span.get('service', '?')}: {span['name']}"
+            if span["status"] != "ok":
+                label += f" [{span['attributes'].get('error', span['status'])}]"
+            lines.append(f"{offset:9.1f} {duration:9.1f}  |{bar:<{BAR_WIDTH}}|  {label}")
+            walk(span["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_id", nargs="?", help="32 hex digit trace ID (X-Trace-Id response header)")
+    parser.add_argument("sources", nargs="*", help="span log files, nginx trace logs or service base URLs")
+    parser.add_argument("--slow", type=float, metavar="MS", help="list recent requests slower than MS instead")
+    parser.add_argument("--json", action="store_true", help="print the merged spans as JSON")
+    args = parser.parse_args()
+
+    if args.slow is not None:
+        # The trace ID is optional here, so a first positional argument is a source
+        sources = ([args.trace_id] if args.trace_id else []) + args.sources
+        for source in sources:
+            for span in _get_json(f"{source.rstrip('/')}/traces?min_ms={args.slow}")["traces"]:
+                print(f"{span['trace_id']}  {span['duration_ms']:9.1f} ms  {span['service']}: {span['name']}")
+        return 0
+    if not args.trace_id or not args.sources:
+        parser.error("a trace ID and at least one source are required")
+
+    spans = load_trace(args.trace_id, args.sources)
+    print(json.dumps(spans, indent=2) if args.json else render(spans))
+    return 0 if spans else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
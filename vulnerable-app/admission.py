@@ -0,0 +1,274 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+
+
+class Rejected(Exception):
+    """Requête refusée sans être exécutée; status_code et retry_after vont dans la réponse."""
+
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(math.ceil(retry_after), 1)
+
+
+@dataclass(frozen=True)
+class AdmissionLimits:
+    """
+    Contrôle d'admission des fetchs sortants.
+
+    Débits en requêtes par seconde (seau à jetons de capacité *_burst) par IP
+    cliente et par hôte de destination; max_in_flight fetchs simultanés au
+    total, dont max_per_host par hôte, et au plus max_queue en attente
+    pendant queue_timeout. budget est la latence visée pour une requête,
+    attente comprise: le timeout amont vaut timeout_factor fois le p95 récent
+    de l'hôte, entre min_timeout et ce qui reste du budget. min_timeout vaut
+    par défaut le budget, soit l'ancien timeout fixe (FETCH_TIMEOUT): un fetch
+    légitimement lent n'est pas coupé plus tôt qu'avant, et le timeout
+    adaptatif ne raccourcit l'attente que si ADMISSION_MIN_TIMEOUT est abaissé.
+    """
+    client_rate: float = 5.0
+    client_burst: int = 20
+    host_rate: float = 20.0
+    host_burst: int = 40
+    max_in_flight: int = 64
+    max_per_host: int = 8
+    max_queue: int = 32
+    queue_timeout: float = 0.5
+    budget: float = 10.0
+    min_timeout: float = 10.0
+    timeout_factor: float = 4.0
+    latency_samples: int = 50
+    max_entries: int = 10000
+
+    @classmethod
+    def from_env(cls) -> "AdmissionLimits":
+        budget = float(os.getenv("ADMISSION_BUDGET", os.getenv("FETCH_TIMEOUT", cls.budget)))
+        return cls(
+            client_rate=float(os.getenv("ADMISSION_CLIENT_RATE", cls.client_rate)),
+            client_burst=int(os.getenv("ADMISSION_CLIENT_BURST", cls.client_burst)),
+            host_rate=float(os.getenv("ADMISSION_HOST_RATE", cls.host_rate)),
+            host_burst=int(os.getenv("ADMISSION_HOST_BURST", cls.host_burst)),
+            max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", cls.max_in_flight)),
+            max_per_host=int(os.getenv("ADMISSION_MAX_PER_HOST", cls.max_per_host)),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", cls.max_queue)),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", cls.queue_timeout)),
+            budget=budget,
+            min_timeout=float(os.getenv("ADMISSION_MIN_TIMEOUT", budget)),
+            timeout_factor=float(os.getenv("ADMISSION_TIMEOUT_FACTOR", cls.timeout_factor)),
+            latency_samples=int(os.getenv("ADMISSION_LATENCY_SAMPLES", cls.latency_samples)),
+            max_entries=int(os.getenv("ADMISSION_MAX_ENTRIES", cls.max_entries)),
+        )
+
+    def per_worker(self, workers: int) -> "AdmissionLimits":
+        """
+        Part d'un worker quand workers process se partagent ces limites: seul
+        le budget global (max_in_flight, max_queue) est divisé. Un client en
+        keep-alive reste sur le même worker, qui doit donc lui appliquer ses
+        limites entières; il en va de même des limites par hôte.
+        """
+        if workers <= 1:
+            return self
+        return replace(
+            self,
+            max_in_flight=max(math.ceil(self.max_in_flight / workers), 1),
+            max_queue=max(math.ceil(self.max_queue / workers), 1),
+        )
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class TokenBuckets:
+    """Seaux à jetons par clé, les moins récemment utilisés oubliés au-delà de max_entries."""
+
+    def __init__(self, rate: float, burst: int, max_entries: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[str, _Bucket] = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """0 si un jeton a été pris, sinon le délai en secondes avant le prochain jeton."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # Un seau oublié était forcément plein: on le recrée plein
+            bucket = self._buckets[key] = _Bucket(float(self.burst), now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    Décide si un fetch sortant part maintenant, attend brièvement ou est
+    refusé tout de suite (429 pour un client trop rapide, 503 sinon).
+
+    Un hôte lent ne peut occuper que max_per_host places: au-delà, ses
+    requêtes sont refusées au lieu d'attendre, et les autres hôtes gardent
+    les places restantes. Son timeout suit sa latence récente, si bien qu'un
+    hôte habituellement rapide qui se met à traîner est coupé tôt.
+
+    En mode multi-worker, max_in_flight et max_queue valent pour l'ensemble
+    des workers: chacun en applique sa part (WORKER_COUNT, posé par
+    supervisor.py). Les débits et max_per_host s'appliquent par worker: un
+    client qui ouvre plusieurs connexions, réparties par le noyau, peut donc
+    obtenir davantage. Seules les latences sont mises en commun
+    (latency_updates et merge_peer_latencies, appelés par state.StateSync).
+    """
+
+    def __init__(self, limits: AdmissionLimits):
+        self.limits = limits
+        self.clients = TokenBuckets(limits.client_rate, limits.client_burst, limits.max_entries)
+        self.hosts = TokenBuckets(limits.host_rate, limits.host_burst, limits.max_entries)
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limits.max_in_flight)
+        self._per_host: dict[str, int] = {}
+        self._latencies: OrderedDict[str, deque] = OrderedDict()
+        # Mesures des autres workers, par hôte puis par worker
+        self._peer_latencies: OrderedDict[str, dict[int, list[float]]] = OrderedDict()
+        # Hôtes mesurés depuis le dernier latency_updates (None tant qu'il n'a pas été appelé)
+        self._updated: set[str] | None = None
+        self.counters = dict.fromkeys(("admitted", "queued", "client_rate", "host_rate", "host_busy",
+                                       "queue_full", "queue_timeout", "timeouts"), 0)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(AdmissionLimits.from_env().per_worker(int(os.getenv("WORKER_COUNT", "1"))))
+
+    def _reject(self, status_code: int, reason: str, detail: str, retry_after: float):
+        self.counters[reason] += 1
+        raise Rejected(status_code, reason, detail, retry_after)
+
+    def check_rate(self, client: str | None, host: str) -> None:
+        """
+        Consomme un jeton du client puis de l'hôte; lève Rejected si l'un des
+        seaux est vide. client None: déjà compté (un lot /fetch/batch ne coûte
+        qu'un jeton client), seul l'hôte l'est.
+        """
+        if client is not None:
+            self.check_client(client)
+        wait = self.hosts.take(host)
+        if wait:
+            self._reject(503, "host_rate", f"Too many requests to {host}, try again later", wait)
+
+    def check_client(self, client: str) -> None:
+        """Consomme un jeton du client; lève Rejected (429) si son seau est vide."""
+        wait = self.clients.take(client)
+        if wait:
+            self._reject(429, "client_rate", "Too many requests, slow down", wait)
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        """
+        Place de fetch vers host, gardée jusqu'à la sortie du bloc; fournit le
+        timeout amont à appliquer.
+        """
+        limits = self.limits
+        started = time.monotonic()
+        if self._per_host.get(host, 0) >= limits.max_per_host:
+            self._reject(503, "host_busy", f"Too many requests in progress to {host}", 1)
+        if self.in_flight >= limits.max_in_flight or self.waiting:
+            # Saturé: file courte et bornée plutôt que d'empiler des coroutines
+            if self.waiting >= limits.max_queue:
+                self._reject(503, "queue_full", "Server busy, try again shortly", 1)
+            self.counters["queued"] += 1
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), limits.queue_timeout)
+            except asyncio.TimeoutError:
+                self._reject(503, "queue_timeout", "Server busy, try again shortly", 1)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.counters["admitted"] += 1
+        self.in_flight += 1
+        self._per_host[host] = self._per_host.get(host, 0) + 1
+        try:
+            yield self.timeout_for(host, limits.budget - (time.monotonic() - started))
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+            remaining = self._per_host[host] - 1
+            if remaining:
+                self._per_host[host] = remaining
+            else:
+                del self._per_host[host]
+
+    def timeout_for(self, host: str, remaining: float) -> float:
+        remaining = max(remaining, self.limits.min_timeout)
+        samples = self._latencies.get(host)
+        peers = self._peer_latencies.get(host)
+        if peers:
+            samples = [*(samples or ()), *(sample for series in peers.values() for sample in series)]
+        if not samples or len(samples) < 5:
+            return remaining
+        p95 = sorted(samples)[int(len(samples) * 0.95) - 1]
+        return min(remaining, max(self.limits.min_timeout, p95 * self.limits.timeout_factor))
+
+    def observe(self, host: str, seconds: float, timed_out: bool = False) -> None:
+        """
+        Latence d'un fetch terminé. Un timeout compte pour sa durée: un hôte
+        devenu lent voit son p95, donc son timeout, remonter vers le budget.
+        """
+        if timed_out:
+            self.counters["timeouts"] += 1
+        samples = self._latencies.get(host)
+        if samples is None:
+            samples = self._latencies[host] = deque(maxlen=self.limits.latency_samples)
+            if len(self._latencies) > self.limits.max_entries:
+                self._latencies.popitem(last=False)
+        else:
+            self._latencies.move_to_end(host)
+        samples.append(seconds)
+        if self._updated is not None:
+            self._updated.add(host)
+
+    def latency_updates(self) -> dict[str, list[float]]:
+        """Mesures récentes des hôtes mesurés depuis l'appel précédent (le premier ne fait qu'amorcer le suivi)."""
+        updated, self._updated = self._updated, set()
+        return {host: list(self._latencies[host]) for host in updated or () if host in self._latencies}
+
+    def merge_peer_latencies(self, peers: list[tuple[str, int, list[float]]]) -> None:
+        """Remplace les mesures publiées par d'autres workers, (hôte, worker, mesures)."""
+        for host, worker, samples in peers:
+            series = self._peer_latencies.get(host)
+            if series is None:
+                series = self._peer_latencies[host] = {}
+                if len(self._peer_latencies) > self.limits.max_entries:
+                    self._peer_latencies.popitem(last=False)
+            else:
+                self._peer_latencies.move_to_end(host)
+            series[worker] = samples[-self.limits.latency_samples:]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_in_flight": self.limits.max_in_flight,
+            "max_queue": self.limits.max_queue,
+            "busy_hosts": dict(sorted(self._per_host.items(), key=lambda item: -item[1])[:20]),
+            **self.counters,
+        }
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+
+from admission import Rejected
+from fetching import FetchPreview
+from resolver import BlockedDestinationError
+
+
+@dataclass(frozen=True)
+class BatchLimits:
+    """
+    Bornes d'un lot /fetch/batch.
+
+    concurrency et per_host s'appliquent à chaque lot: un hôte lent n'occupe
+    jamais plus de per_host places sur les concurrency disponibles. Une URL
+    refusée par le contrôle d'admission est réessayée après son Retry-After
+    tant que l'échéance du lot le permet.
+    """
+    concurrency: int = 20
+    per_host: int = 4
+    max_urls: int = 500
+    deadline: float = 60.0
+    item_timeout: float = 10.0
+    body_chars: int = 500
+
+    @classmethod
+    def from_env(cls) -> "BatchLimits":
+        return cls(
+            concurrency=int(os.getenv("BATCH_CONCURRENCY", cls.concurrency)),
+            per_host=int(os.getenv("BATCH_PER_HOST", cls.per_host)),
+            max_urls=int(os.getenv("BATCH_MAX_URLS", cls.max_urls)),
+            deadline=float(os.getenv("BATCH_DEADLINE", cls.deadline)),
+            item_timeout=float(os.getenv("BATCH_ITEM_TIMEOUT", cls.item_timeout)),
+            body_chars=int(os.getenv("BATCH_BODY_CHARS", cls.body_chars)),
+        )
+
+
+Check = Callable[[str], tuple[bool, str]]
+Fetch = Callable[[str], Awaitable[tuple[FetchPreview, str]]]
+
+
+class _Batch:
+    def __init__(self, limits: BatchLimits, check: Check, fetch: Fetch, deadline: float, item_timeout: float):
+        self.limits = limits
+        self.check = check
+        self.fetch = fetch
+        self.ends = time.monotonic() + deadline
+        self.item_timeout = item_timeout
+        self.slots = asyncio.Semaphore(limits.concurrency)
+        self.hosts: dict[str, asyncio.Semaphore] = {}
+
+    async def run_item(self, index: int, url: str) -> dict:
+        started = time.perf_counter()
+
+        def result(status: str, **fields) -> dict:
+            elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+            return {"index": index, "url": url, "status": status, "elapsed_ms": elapsed_ms, **fields}
+
+        try:
+            is_safe, error_msg = self.check(url)
+            if not is_safe:
+                return result("blocked", error=error_msg)
+            host = (httpx.URL(url).host or "").lower()
+            gate = self.hosts.setdefault(host, asyncio.Semaphore(self.limits.per_host))
+            while True:
+                try:
+                    # La place par hôte d'abord: une URL en attente de son hôte ne bloque pas une place globale
+                    async with gate, self.slots:
+                        preview, cache_status = await asyncio.wait_for(self.fetch(url), self.item_timeout)
+                    break
+                except Rejected as e:
+                    if time.monotonic() + e.retry_after >= self.ends:
+                        raise
+                    # Attente hors des places du lot, que les autres URLs peuvent prendre
+                    await asyncio.sleep(e.retry_after)
+            body = preview.text[:self.limits.body_chars]
+            return result(
+                "ok",
+                status_code=preview.status_code,
+                body=body,
+                truncated=preview.truncated or len(body) < len(preview.text),
+                kind=preview.kind,
+                bytes=preview.bytes_read,
+                cache=cache_status,
+            )
+        except asyncio.TimeoutError:
+            return result("timeout", error=f"No response within {self.item_timeout}s")
+        except Rejected as e:
+            return result("rejected", error=str(e), retry_after=e.retry_after)
+        except BlockedDestinationError as e:
+            return result("blocked", error=str(e))
+        except (httpx.RequestError, ValueError) as e:
+            return result("error", error=str(e))
+        except Exception:
+            return result("error", error="Internal error")
+
+
+async def run_batch(urls: list[str], check: Check, fetch: Fetch, limits: BatchLimits,
+                    deadline: float, item_timeout: float) -> AsyncIterator[str]:
+    """
+    Récupère les URLs en parallèle et produit une ligne NDJSON par URL, dans
+    l'ordre de complétion. Les URLs encore en cours à l'échéance sont
+    annulées et signalées avec le statut "deadline_exceeded".
+    """
+    batch = _Batch(limits, check, fetch, deadline, item_timeout)
+    tasks = [asyncio.create_task(batch.run_item(i, url)) for i, url in enumerate(urls)]
+    reported = set()
+    try:
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=deadline):
+                item = await next_done
+                reported.add(item["index"])
+                yield json.dumps(item) + "\n"
+        except asyncio.TimeoutError:
+            for index, task in enumerate(tasks):
+                if index in reported:
+                    continue
+                if task.done():
+                    # Terminée pendant l'expiration de l'échéance, pas encore envoyée
+                    yield json.dumps(task.result()) + "\n"
+                else:
+                    task.cancel()
+                    yield json.dumps({
+                        "index": index,
+                        "url": urls[index],
+                        "status": "deadline_exceeded",
+                        "error": f"Batch deadline of {deadline}s exceeded",
+                    }) + "\n"
+    finally:
+        # Client déconnecté ou échéance: rien ne doit continuer à tourner
+        for task in tasks:
+            task.cancel()
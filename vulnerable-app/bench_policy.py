@@ -0,0 +1,133 @@
+"""
+Micro-benchmark et corpus de verdicts pour la politique d'URL.
+
+    python bench_policy.py                  # corpus puis benchmark
+    python bench_policy.py --check          # corpus seulement, code 1 en cas d'écart
+    python bench_policy.py --json out.json  # résultats exploitables d'une version à l'autre
+"""
+import argparse
+import ipaddress
+import json
+import os
+import random
+import sys
+import time
+
+# main importe le paquet shared/, à la racine du dépôt (comme dans l'image)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import BLOCKED_INTERNAL_DOMAINS, BLOCKED_INTERNAL_HOSTS, is_safe_url
+from policy import UrlPolicy
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "policy_corpus.txt")
+
+
+def load_corpus(path: str) -> tuple[list[str], list[tuple[bool, str]]]:
+    rules, cases = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            verdict, _, value = line.partition(" ")
+            if verdict == "rule":
+                rules.append(value)
+            else:
+                cases.append((verdict == "allow", value))
+    return rules, cases
+
+
+def check_corpus(path: str = CORPUS) -> list[str]:
+    rules, cases = load_corpus(path)
+    policy = UrlPolicy.compile(BLOCKED_INTERNAL_HOSTS, BLOCKED_INTERNAL_DOMAINS + rules)
+    failures = []
+    for expected, url in cases:
+        allowed, reason = is_safe_url(url, policy)
+        if allowed != expected:
+            failures.append(f"{'allow' if expected else 'block'} {url} -> got {'allow' if allowed else 'block'} {reason}")
+    return failures
+
+
+def legacy_check(hostname: str, hosts: list[str], domains: list[str]) -> bool:
+    """Ancienne implémentation: copies en minuscules et parcours linéaire à chaque appel."""
+    if hostname.lower() in [host.lower() for host in hosts]:
+        return False
+    if hostname.lower() in [domain.lower() for domain in domains]:
+        return False
+    return True
+
+
+def synthetic_rules(n_domains: int, n_networks: int, rng: random.Random) -> tuple[list[str], list[str]]:
+    domains = [f"{rng.choice(['', '*.', '.'])}host{i}.blocked{i % 97}.example" for i in range(n_domains)]
+    networks = [
+        str(ipaddress.ip_network((rng.getrandbits(32) & 0xFFFFFF00, 24), strict=False))
+        for _ in range(n_networks)
+    ]
+    return domains, networks
+
+
+def timeit(fn, items, repeat: int) -> float:
+    """Meilleur temps par appel en nanosecondes."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for item in items:
+            fn(item)
+        best = min(best, (time.perf_counter_ns() - start) / len(items))
+    return best
+
+
+def run_benchmark(n_domains: int, n_networks: int, n_lookups: int, repeat: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    domains, networks = synthetic_rules(n_domains, n_networks, rng)
+    hosts = BLOCKED_INTERNAL_HOSTS
+    all_domains = BLOCKED_INTERNAL_DOMAINS + domains
+
+    start = time.perf_counter()
+    policy = UrlPolicy.compile(hosts, all_domains + networks)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    names = [f"www.host{rng.randrange(n_domains * 2)}.blocked{rng.randrange(97)}.example" for _ in range(n_lookups)]
+    ips = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(n_lookups)]
+    urls = [f"https://{name}/path?q=1" for name in names]
+
+    return {
+        "rules": policy.size,
+        "compile_ms": round(compile_ms, 2),
+        "legacy_host_ns": round(timeit(lambda h: legacy_check(h, hosts, all_domains), names, repeat)),
+        "policy_host_ns": round(timeit(policy.check_host, names, repeat)),
+        "policy_ip_ns": round(timeit(policy.check_host, ips, repeat)),
+        "is_safe_url_ns": round(timeit(lambda u: is_safe_url(u, policy), urls, repeat)),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--check", action="store_true", help="vérifier le corpus sans lancer le benchmark")
+    parser.add_argument("--domains", type=int, default=5000)
+    parser.add_argument("--networks", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="PATH", help="écrire les résultats en JSON")
+    args = parser.parse_args()
+
+    failures = check_corpus()
+    for failure in failures:
+        print(f"MISMATCH {failure}")
+    print(f"corpus: {len(load_corpus(CORPUS)[1]) - len(failures)} ok, {len(failures)} mismatches")
+    if args.check:
+        return 1 if failures else 0
+
+    results = run_benchmark(args.domains, args.networks, args.lookups, args.repeat, args.seed)
+    results["corpus_mismatches"] = len(failures)
+    for key, value in results.items():
+        print(f"{key:>20}: {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import httpx
+
+from fetching import FetchPreview
+
+logger = logging.getLogger(__name__)
+
+# Statuts que RFC 9111 autorise à mettre en cache par défaut
+CACHEABLE_STATUS = frozenset({200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501})
+
+# Plafond de la fraîcheur heuristique (10% de l'âge de Last-Modified)
+MAX_HEURISTIC_LIFETIME = 3600.0
+
+Fetcher = Callable[[dict[str, str]], Awaitable[tuple[httpx.Response, FetchPreview]]]
+# Appelé juste avant qu'une requête ne lance elle-même un appel amont; peut lever pour la refuser
+Admit = Callable[[], None]
+
+
+def parse_cache_control(value: str) -> dict[str, str | None]:
+    directives = {}
+    for part in value.split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+    return directives
+
+
+def _http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _seconds(value: str | None) -> float:
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def normalize_key(url: str) -> str:
+    """Schéma et hôte en minuscules, port par défaut et fragment retirés."""
+    parsed = httpx.URL(url)
+    return str(parsed.copy_with(fragment=None))
+
+
+@dataclass
+class Freshness:
+    lifetime: float
+    stale_while_revalidate: float
+    no_cache: bool
+
+
+def freshness(headers: httpx.Headers) -> Freshness | None:
+    """Durée de fraîcheur d'une réponse, ou None si elle ne doit pas être stockée."""
+    cc = parse_cache_control(headers.get("cache-control", ""))
+    if "no-store" in cc or "private" in cc or headers.get("vary", "").strip() == "*":
+        return None
+
+    date = _http_date(headers.get("date")) or time.time()
+    if "s-maxage" in cc:
+        lifetime = _seconds(cc["s-maxage"])
+    elif "max-age" in cc:
+        lifetime = _seconds(cc["max-age"])
+    elif "expires" in headers:
+        expires = _http_date(headers["expires"])
+        lifetime = max(expires - date, 0.0) if expires else 0.0
+    elif "last-modified" in headers:
+        last_modified = _http_date(headers["last-modified"])
+        lifetime = min(max(date - last_modified, 0.0) * 0.1, MAX_HEURISTIC_LIFETIME) if last_modified else 0.0
+    else:
+        lifetime = 0.0
+    lifetime = max(lifetime - _seconds(headers.get("age")), 0.0)
+
+    no_cache = "no-cache" in cc
+    swr = 0.0 if no_cache or "must-revalidate" in cc else _seconds(cc.get("stale-while-revalidate"))
+    validators = "etag" in headers or "last-modified" in headers
+    if lifetime == 0 and swr == 0 and not validators:
+        return None
+    return Freshness(0.0 if no_cache else lifetime, swr, no_cache)
+
+
+class CacheEntry:
+    __slots__ = ("preview", "etag", "last_modified", "fresh_until", "stale_until", "size")
+
+    def __init__(self, preview: FetchPreview, etag: str | None, last_modified: str | None):
+        self.preview = preview
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = (
+            sys.getsizeof(preview.text)
+            + len(self.etag or "") + len(self.last_modified or "")
+            + 256  # objet, clés et bookkeeping
+        )
+        self.fresh_until = self.stale_until = 0.0
+
+    @classmethod
+    def from_response(cls, preview: FetchPreview, headers: httpx.Headers, policy: Freshness) -> "CacheEntry":
+        entry = cls(preview, headers.get("etag"), headers.get("last-modified"))
+        entry.refresh(policy)
+        return entry
+
+    def refresh(self, policy: Freshness) -> None:
+        now = time.monotonic()
+        self.fresh_until = now + policy.lifetime
+        self.stale_until = self.fresh_until + policy.stale_while_revalidate
+
+    def wall_clock(self) -> tuple[float, float]:
+        """(fresh_until, stale_until) en temps réel, pour un autre process."""
+        offset = time.time() - time.monotonic()
+        return self.fresh_until + offset, self.stale_until + offset
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    Cache des aperçus de /fetch, partagé par toutes les requêtes du process.
+
+    Respecte Cache-Control (max-age, s-maxage, no-store, no-cache, private,
+    must-revalidate, stale-while-revalidate), Expires et la fraîcheur
+    heuristique de Last-Modified. Les entrées périmées sont revalidées par
+    requête conditionnelle; les requêtes identiques simultanées partagent
+    un seul appel amont. La mémoire est bornée par max_bytes (LRU).
+
+    Avec shared (state.SharedState, mode multi-worker), chaque entrée stockée
+    ou revalidée y est aussi écrite, et un absent du cache local que
+    personne ne va déjà chercher y est lu (dans un thread, hors de la
+    boucle) avant d'aller chez l'amont.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, shared=None):
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self.size = 0
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._background: set[asyncio.Task] = set()
+        self.counters = dict.fromkeys(
+            ("hits", "misses", "stale_served", "revalidations", "background_refreshes",
+             "not_modified", "coalesced", "stores", "evictions", "errors", "shared_hits"), 0)
+
+    def lookup(self, url: str) -> tuple[CacheEntry | None, str]:
+        """(entrée, état) dans ce process, avec état parmi "fresh", "stale", "expired" et "miss"."""
+        key = normalize_key(url)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, "miss"
+        self._entries.move_to_end(key)
+        return entry, self._state(entry)
+
+    @staticmethod
+    def _state(entry: CacheEntry) -> str:
+        now = time.monotonic()
+        if now < entry.fresh_until:
+            return "fresh"
+        if now < entry.stale_until:
+            return "stale"
+        return "expired"
+
+    async def fetch(self, url: str, fetcher: Fetcher, admit: Admit | None = None) -> tuple[FetchPreview, str]:
+        """
+        Aperçu de url, depuis le cache si possible. admit n'est appelé que si
+        cette requête doit lancer l'appel amont (absente ou à revalider, et
+        personne ne l'a déjà lancé): une entrée servie depuis le cache ou
+        une requête en cours partagée ne passent pas par lui.
+
+        Returns:
+            tuple[FetchPreview, str]: (aperçu, "HIT" | "STALE" | "REVALIDATED" | "MISS")
+        """
+        return await self._serve(url, fetcher, admit, fetch_missing=True)
+
+    async def cached(self, url: str, fetcher: Fetcher, admit: Admit | None = None) -> tuple[FetchPreview, str] | None:
+        """
+        Comme fetch, sauf pour une URL absente du cache et que personne ne
+        va déjà chercher: renvoie None (compté comme miss), l'appelant
+        obtient la réponse lui-même et la passe à store(). Les entrées
+        périmées sont servies, revalidées ou rafraîchies comme dans fetch.
+        """
+        return await self._serve(url, fetcher, admit, fetch_missing=False)
+
+    async def _serve(self, url: str, fetcher: Fetcher, admit: Admit | None,
+                     fetch_missing: bool) -> tuple[FetchPreview, str] | None:
+        key = normalize_key(url)
+        entry, state = self.lookup(url)
+        if state == "miss" and key not in self._inflight:
+            entry = await self._from_shared(key)
+            if entry is not None:
+                state = self._state(entry)
+        if state == "fresh":
+            self.counters["hits"] += 1
+            return entry.preview, "HIT"
+        if state == "stale":
+            # stale-while-revalidate: on sert l'ancienne version et on rafraîchit en arrière-plan
+            self.counters["stale_served"] += 1
+            self._spawn_background(key, entry, fetcher)
+            return entry.preview, "STALE"
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.counters["coalesced"] += 1
+        elif entry is None and not fetch_missing:
+            self.counters["misses"] += 1
+            return None
+        else:
+            if admit is not None:
+                admit()
+            self.counters["revalidations" if entry else "misses"] += 1
+            task = self._start(key, entry, fetcher)
+        return await asyncio.shield(task)
+
+    def _start(self, key: str, entry: CacheEntry | None, fetcher: Fetcher) -> asyncio.Task:
+        task = self._inflight[key] = asyncio.create_task(self._refresh(key, entry, fetcher))
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _spawn_background(self, key: str, entry: CacheEntry, fetcher: Fetcher) -> None:
+        if key in self._inflight:
+            return
+        self.counters["background_refreshes"] += 1
+        self._background.add(self._start(key, entry, fetcher))
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        # Lire l'exception même si tous les appelants ont abandonné (timeout, déconnexion)
+        background = task in self._background
+        self._background.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        self.counters["errors"] += 1
+        if background:
+            logger.warning("Background revalidation failed: %s", task.exception())
+
+    async def _refresh(self, key: str, entry: CacheEntry | None, fetcher: Fetcher) -> tuple[FetchPreview, str]:
+        try:
+            response, preview = await fetcher(entry.conditional_headers() if entry else {})
+            policy = freshness(response.headers)
+            if response.status_code == 304 and entry is not None:
+                self.counters["not_modified"] += 1
+                if policy is not None:
+                    entry.refresh(policy)
+                    self._share(key, entry)
+                return entry.preview, "REVALIDATED"
+            self.store(key, response, preview, policy)
+            return preview, "MISS"
+        finally:
+            self._inflight.pop(key, None)
+
+    def store(self, url: str, response: httpx.Response, preview: FetchPreview,
+              policy: Freshness | None = None) -> None:
+        key = normalize_key(url)
+        if policy is None:
+            policy = freshness(response.headers)
+        if policy is None or response.status_code not in CACHEABLE_STATUS:
+            if self._remove(key) and self.shared is not None:
+                self.shared.delete_entry(key)
+            return
+        entry = CacheEntry.from_response(preview, response.headers, policy)
+        if self._insert(key, entry):
+            self.counters["stores"] += 1
+            self._share(key, entry)
+
+    def restore(self, key: str, preview: FetchPreview, etag: str | None, last_modified: str | None,
+                fresh_until: float, stale_until: float, evict: bool = True) -> bool:
+        """
+        Ajoute une entrée venue d'un autre process (dates en temps réel).
+        Avec evict=False (démarrage à chaud), renvoie False au lieu de faire
+        de la place quand le cache est plein.
+        """
+        entry = CacheEntry(preview, etag, last_modified)
+        offset = time.monotonic() - time.time()
+        entry.fresh_until, entry.stale_until = fresh_until + offset, stale_until + offset
+        if not evict and self.size + entry.size > self.max_bytes:
+            return False
+        return self._insert(key, entry)
+
+    async def _from_shared(self, key: str) -> CacheEntry | None:
+        if self.shared is None:
+            return None
+        try:
+            found = await asyncio.to_thread(self.shared.get_entry, key)
+        except sqlite3.Error as e:
+            logger.warning("Shared cache lookup failed: %s", e)
+            return None
+        if found is None or not self.restore(key, *found):
+            return None
+        self.counters["shared_hits"] += 1
+        return self._entries[key]
+
+    def _share(self, key: str, entry: CacheEntry) -> None:
+        if self.shared is not None:
+            self.shared.put_entry(key, entry.preview, entry.etag, entry.last_modified, *entry.wall_clock())
+
+    def _insert(self, key: str, entry: CacheEntry) -> bool:
+        if entry.size > self.max_bytes:
+            return False
+        self._remove(key)
+        self._entries[key] = entry
+        self.size += entry.size
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size
+            self.counters["evictions"] += 1
+        return True
+
+    def _remove(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= entry.size
+        return True
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["stale_served"] + self.counters["misses"] + self.counters["revalidations"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "inflight": len(self._inflight),
+            "hit_ratio": round((self.counters["hits"] + self.counters["stale_served"]) / lookups, 4) if lookups else 0.0,
+        }
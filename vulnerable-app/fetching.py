@@ -0,0 +1,192 @@
+import os
+import zlib
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+import httpx
+
+from renderers import SNIFF_BYTES, select_renderer
+
+
+@dataclass(frozen=True)
+class FetchBudget:
+    """
+    Limites de lecture d'une réponse amont.
+
+    max_bytes borne les octets lus sur le réseau (html_max_bytes pour le
+    HTML, dont le balisage prend de la place), max_chars borne le texte
+    affiché. La lecture s'arrête dès que l'une des limites est atteinte.
+    """
+    max_bytes: int = 8192
+    max_chars: int = 2000
+    html_max_bytes: int = 65536
+
+    @classmethod
+    def from_env(cls) -> "FetchBudget":
+        return cls(
+            max_bytes=int(os.getenv("FETCH_MAX_BYTES", cls.max_bytes)),
+            max_chars=int(os.getenv("FETCH_PREVIEW_CHARS", cls.max_chars)),
+            html_max_bytes=int(os.getenv("FETCH_HTML_MAX_BYTES", cls.html_max_bytes)),
+        )
+
+
+# Content-Encoding décodables par morceaux de taille bornée (ce que le pool annonce dans Accept-Encoding)
+DECODABLE_ENCODINGS = {"gzip": 16 + zlib.MAX_WBITS, "x-gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+class _BoundedDecoder:
+    """
+    Décompression gzip/deflate par morceaux, sans jamais produire plus que
+    ce qui est demandé: quelques octets compressés peuvent en donner des
+    mégaoctets, que aiter_bytes() aurait décompressés d'un coup.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._decompressor = zlib.decompressobj(DECODABLE_ENCODINGS[encoding])
+        self._started = False
+        self.pending = b""
+
+    def feed(self, data: bytes) -> None:
+        self.pending += data
+
+    def read(self, max_bytes: int) -> bytes:
+        """Au plus max_bytes octets décodés de ce qui a été fourni."""
+        try:
+            chunk = self._decompressor.decompress(self.pending, max_bytes)
+        except zlib.error as e:
+            if self.encoding != "deflate" or self._started:
+                raise httpx.DecodingError(f"Invalid {self.encoding} body: {e}") from None
+            # "deflate" envoyé sans en-tête zlib, comme le tolère httpx
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.read(max_bytes)
+        self._started = True
+        self.pending = self._decompressor.unconsumed_tail
+        return chunk
+
+
+def body_decoder(content_encoding: str | None) -> "_BoundedDecoder | None":
+    """Décodeur borné pour ce Content-Encoding, None si le corps n'est pas compressé."""
+    encodings = [coding.strip().lower() for coding in (content_encoding or "").split(",")]
+    encodings = [coding for coding in encodings if coding and coding != "identity"]
+    if not encodings:
+        return None
+    if len(encodings) > 1 or encodings[0] not in DECODABLE_ENCODINGS:
+        raise httpx.DecodingError(f"Unsupported Content-Encoding: {content_encoding}")
+    return _BoundedDecoder(encodings[0])
+
+
+class BudgetedReader:
+    """
+    Itère sur le rendu texte d'une réponse httpx ouverte en streaming, en ne
+    lisant que le préfixe autorisé par le budget.
+
+    Le rendu (texte, HTML, JSON ou binaire, voir renderers.py) est choisi
+    d'après le Content-Type et les SNIFF_BYTES premiers octets, puis reçoit
+    les morceaux au fil de la lecture. Le corps est lu brut et décompressé
+    ici, jamais au-delà du budget restant (voir _BoundedDecoder). Après
+    l'itération, kind, bytes_read et truncated décrivent ce qui a été lu.
+    """
+
+    def __init__(self, response: httpx.Response, budget: FetchBudget):
+        self.response = response
+        self.budget = budget
+        self.renderer = None
+        self.max_bytes = budget.max_bytes
+        self.bytes_read = 0
+        self.chars = 0
+        self.truncated = False
+        self._head = b""
+
+    @property
+    def kind(self) -> str:
+        return self.renderer.kind if self.renderer is not None else "text"
+
+    def _select(self, head: bytes) -> None:
+        headers = self.response.headers
+        self.renderer = select_renderer(
+            headers.get("content-type"), self.response.charset_encoding, headers.get("content-length"), head,
+        )
+        if self.renderer.kind == "html":
+            self.max_bytes = self.budget.html_max_bytes
+
+    def _render(self, chunk: bytes) -> str:
+        remaining = self.max_bytes - self.bytes_read
+        if len(chunk) > remaining:
+            chunk = chunk[:remaining]
+            self.truncated = True
+        self.bytes_read += len(chunk)
+        return self._clip(self.renderer.feed(chunk))
+
+    def _room(self) -> int:
+        """Octets décodés que le budget peut encore accepter, plus un pour détecter le dépassement."""
+        if self.renderer is None:
+            limit = max(self.budget.max_bytes, self.budget.html_max_bytes, SNIFF_BYTES)
+        else:
+            limit = self.max_bytes
+        return max(limit - self.bytes_read - len(self._head), 0) + 1
+
+    async def _body(self) -> AsyncIterator[bytes]:
+        decoder = body_decoder(self.response.headers.get("content-encoding"))
+        async for raw in self.response.aiter_raw():
+            if decoder is None:
+                yield raw
+                continue
+            decoder.feed(raw)
+            while True:
+                chunk = decoder.read(self._room())
+                if not chunk:
+                    break
+                yield chunk
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async with aclosing(self._body()) as body:
+            async for chunk in body:
+                if self.renderer is None:
+                    # Le rendu se choisit sur les premiers octets: on les accumule d'abord
+                    self._head += chunk
+                    if len(self._head) < SNIFF_BYTES:
+                        continue
+                    chunk, self._head = self._head, b""
+                    self._select(chunk)
+                text = self._render(chunk)
+                if text:
+                    yield text
+                if self.truncated:
+                    # On arrête de lire ici: la fermeture de la réponse abandonne le reste du corps
+                    break
+        if self.renderer is None:
+            # Corps plus court que SNIFF_BYTES
+            head, self._head = self._head, b""
+            self._select(head)
+            text = self._render(head)
+            if text:
+                yield text
+        tail = self._clip(self.renderer.close(self.truncated))
+        if tail:
+            yield tail
+
+    def _clip(self, text: str) -> str:
+        room = self.budget.max_chars - self.chars
+        if len(text) > room:
+            text = text[:room]
+            self.truncated = True
+        self.chars += len(text)
+        return text
+
+
+@dataclass
+class FetchPreview:
+    status_code: int
+    text: str
+    bytes_read: int
+    truncated: bool
+    kind: str = "text"
+
+
+async def read_preview(response: httpx.Response, budget: FetchBudget) -> FetchPreview:
+    """Lit le préfixe d'une réponse en streaming et abandonne le reste du transfert."""
+    reader = BudgetedReader(response, budget)
+    parts = [text async for text in reader]
+    return FetchPreview(response.status_code, "".join(parts), reader.bytes_read, reader.truncated, reader.kind)
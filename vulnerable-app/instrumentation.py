@@ -0,0 +1,95 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+from shared.metrics import Registry, http_histogram
+from shared.tracing import Span, Tracer
+
+registry = Registry()
+
+HTTP_REQUESTS = http_histogram(registry)
+FETCH_STAGE = registry.histogram(
+    "fetch_stage_seconds",
+    "Time spent in each stage of an outbound fetch (validation, dns, connect, tls, ttfb, download, render).",
+    ("stage",),
+)
+FETCH_DURATION = registry.histogram(
+    "fetch_duration_seconds",
+    "Duration of /fetch until the response starts, by outcome (ok, blocked, shed, timeout, error).",
+    ("outcome",),
+)
+
+# Point d'entrée public: chaque requête démarre sa propre trace, propagée en sortie
+tracer = Tracer.from_env("vulnerable-app", accept_parent=False)
+
+# Événements "trace" de httpcore mesurés entre .started et .complete/.failed
+TRACE_STAGES = {
+    "connection.connect_tcp": "connect",
+    "connection.start_tls": "tls",
+    "http11.receive_response_body": "download",
+    "http2.receive_response_body": "download",
+}
+
+
+@contextmanager
+def stage(name: str, span: Span | None = None):
+    """Mesure une étape de fetch: histogramme et span enfant de `span` (le span courant par défaut)."""
+    span = span or tracer.current()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        FETCH_STAGE.observe(time.perf_counter() - started, name)
+        if span is not None:
+            span.record_child(name, started)
+
+
+class StageTracer:
+    """
+    Extension "trace" de httpcore pour une requête sortante.
+
+    Le TTFB va de l'envoi des en-têtes de requête à la réception complète des
+    en-têtes de réponse; les autres étapes viennent de TRACE_STAGES. Chaque
+    étape devient aussi un span enfant de `span`, le span client du saut, qui
+    se termine à la fermeture de la réponse ou au premier échec. Une lecture
+    interrompue par nous (BudgetedReader qui ferme le corps au bout du budget,
+    tâche annulée) n'est pas un échec: l'étape se termine normalement là.
+    """
+
+    __slots__ = ("started", "span")
+
+    def __init__(self, span: Span):
+        self.started: dict[str, float] = {}
+        self.span = span
+
+    async def __call__(self, event_name: str, info: dict) -> None:
+        name, _, phase = event_name.rpartition(".")
+        if phase == "started":
+            if name in TRACE_STAGES or name.endswith(".send_request_headers"):
+                self.started[name] = time.perf_counter()
+            return
+        if phase not in ("complete", "failed"):
+            return
+        if phase == "failed" and isinstance(info.get("exception"), (GeneratorExit, asyncio.CancelledError)):
+            phase = "closed"
+        if phase == "failed":
+            self.span.fail(info.get("exception", name))
+        if name.endswith(".receive_response_headers"):
+            if phase == "complete":
+                # http11: (version, status, reason, headers); http2: (status, headers)
+                value = info["return_value"]
+                self.span.set("status_code", value[1] if name.startswith("http11") else value[0])
+            started = self.started.pop(name.replace("receive_response_headers", "send_request_headers"), None)
+            stage = "ttfb"
+        elif name in TRACE_STAGES:
+            started = self.started.pop(name, None)
+            stage = TRACE_STAGES[name]
+        else:
+            if phase != "complete" or name.endswith(".response_closed"):
+                self.span.finish()
+            return
+        if started is not None:
+            FETCH_STAGE.observe(time.perf_counter() - started, stage)
+            self.span.record_child(stage, started, "error" if phase == "failed" else "ok")
+        if phase != "complete":
+            self.span.finish()
@@ -1,13 +1,49 @@
-import ipaddress
-from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.responses import HTMLResponse
+import html
+from contextlib import AsyncExitStack, asynccontextmanager
+from fastapi import Depends, FastAPI, Request, Form, HTTPException
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from pydantic import BaseModel
 import httpx
 import asyncio
+import ipaddress
 from urllib.parse import urlparse, unquote
 import os
 import logging
+import time
+
+from admission import AdmissionController, Rejected
+from batch import BatchLimits, run_batch
+from cache import ResponseCache
+from fetching import BudgetedReader, FetchBudget, FetchPreview, read_preview
+from instrumentation import FETCH_DURATION, HTTP_REQUESTS, StageTracer, registry, stage, tracer
+from policy import PolicyStore, UrlPolicy
+from pool import ClientPool
+from resolver import BlockedDestinationError, DnsCache
+from state import SharedState, StateSync, summarize, worker_stats
+from shared.logs import setup_logging
+from shared.metrics import CONTENT_TYPE, MetricsMiddleware
+from shared.pages import Page, page_response
+from shared.tracing import TracingMiddleware, trace_query
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un seul pool de connexions pour toute la durée de vie du process
+    app.state.pool = ClientPool.from_env(dns=dns_cache, request_hook=guard_outbound_request)
+    await app.state.pool.start()
+    await url_policy.start()
+    if state_sync is not None:
+        await state_sync.start()
+    try:
+        yield
+    finally:
+        if state_sync is not None:
+            await state_sync.stop()
+        await url_policy.stop()
+        await app.state.pool.aclose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, histogram=HTTP_REQUESTS, router=app.router)
+app.add_middleware(TracingMiddleware, tracer=tracer, router=app.router)
 
 # Configuration sécurisée - Approche blacklist pour les ressources internes
 ALLOWED_PROTOCOLS = ['http', 'https']
@@ -31,17 +67,37 @@ BLOCKED_INTERNAL_DOMAINS = [
     'staging.company.com'
 ]
 
-# Configuration logging
-logging.basicConfig(level=logging.INFO)
+# Logs JSON écrits par un thread dédié: les requêtes ne font que les mettre en file (LOG_* env vars)
+setup_logging("vulnerable-app")
 logger = logging.getLogger(__name__)
 
-def is_safe_url(url: str) -> tuple[bool, str]:
+# Worker de supervisor.py: état partagé avec les autres workers (None en process unique)
+shared_state = SharedState.from_env()
+
+# Politique compilée au démarrage; URL_POLICY_FILE ajoute des règles rechargées à chaud
+# (domaines exacts, *.suffixe, .domaine-et-sous-domaines, IP et plages CIDR),
+# lues par le superviseur et publiées dans l'état partagé en mode multi-worker
+url_policy = PolicyStore(
+    BLOCKED_INTERNAL_HOSTS,
+    BLOCKED_INTERNAL_DOMAINS,
+    path=os.getenv("URL_POLICY_FILE"),
+    interval=float(os.getenv("URL_POLICY_RELOAD_INTERVAL", "5")),
+    state=shared_state,
+)
+
+def log_blocked(url: str, reason: str) -> None:
+    # Échantillonné: une même URL bloquée n'est journalisée qu'une fois par fenêtre
+    # et le total est plafonné (LOG_SAMPLE_*), le nombre d'entrées omises suit
+    logger.warning("Blocked malicious request: %s - %s", url, reason, extra={"sample_key": (url, reason)})
+
+def is_safe_url(url: str, policy: UrlPolicy | None = None) -> tuple[bool, str]:
     """
     Valide si une URL est sécurisée en bloquant les accès internes.
     Approche whitelist pour les protocoles, blacklist pour les ressources internes.
     
     Args:
         url (str): URL à valider
+        policy (UrlPolicy | None): politique à appliquer, la politique courante par défaut
         
     Returns:
         tuple[bool, str]: (is_safe, error_message)
@@ -60,34 +116,70 @@ def is_safe_url(url: str) -> tuple[bool, str]:
         if not hostname:
             return False, "Invalid URL: missing hostname"
         
-        # Bloquer les noms d'hôtes internes Docker/localhost
-        if hostname.lower() in [host.lower() for host in BLOCKED_INTERNAL_HOSTS]:
-            return False, f"Access to internal host '{hostname}' is not allowed"
-        
-        # Bloquer les domaines internes de l'entreprise
-        if hostname.lower() in [domain.lower() for domain in BLOCKED_INTERNAL_DOMAINS]:
-            return False, f"Access to internal domain '{hostname}' is not allowed"
-        
-        # Validation des adresses IP - bloquer les IPs privées
-        try:
-            ip = ipaddress.ip_address(hostname)
-            if ip.is_private or ip.is_loopback or ip.is_link_local:
-                return False, f"Access to private/loopback IP '{hostname}' is not allowed"
-        except ValueError:
-            # Ce n'est pas une IP, c'est un nom d'hôte - validation OK si pas dans les blacklists
-            pass
+        # Hôtes Docker/localhost, domaines internes, IPs privées et plages bloquées
+        error_msg = (policy or url_policy.current).check_host(hostname)
+        if error_msg:
+            return False, error_msg
         
         return True, ""
         
     except Exception as e:
-        logger.error(f"Error validating URL: {e}")
+        logger.error("Error validating URL: %s", e)
         return False, f"Invalid URL format: {str(e)}"
 
+# Cache DNS partagé: les adresses résolues sont validées puis réutilisées pour la connexion
+dns_cache = DnsCache(
+    lambda ip: url_policy.current.check_host(ip),
+    default_ttl=float(os.getenv("DNS_CACHE_TTL", "60")),
+    negative_ttl=float(os.getenv("DNS_NEGATIVE_TTL", "30")),
+    max_entries=int(os.getenv("DNS_CACHE_SIZE", "10000")),
+)
+
+async def guard_outbound_request(request: httpx.Request):
+    """
+    Hook httpx appelé avant chaque requête sortante, y compris chaque saut de
+    redirection: l'URL repasse par la politique et le nom par le DNS validé.
+    Chaque saut a son span client, dont le contexte part dans l'en-tête traceparent.
+    """
+    # Sans query ni identifiants: les spans sont lisibles sur /traces et dans TRACE_FILE
+    span = tracer.start_span(f"{request.method} {request.url.host}", kind="client",
+                             attributes={"url": str(request.url.copy_with(query=None, fragment=None, userinfo=b""))})
+    is_safe, error_msg = is_safe_url(str(request.url))
+    if not is_safe:
+        span.fail(error_msg)
+        span.finish()
+        raise BlockedDestinationError(error_msg)
+    tracer.inject(request.headers, span)
+    # Connexion, TLS, TTFB et téléchargement sont mesurés par httpcore via l'extension "trace"
+    request.extensions["trace"] = StageTracer(span)
+    try:
+        with stage("dns", span):
+            await dns_cache.resolve(request.url.host)
+    except OSError as e:
+        span.fail(e)
+        span.finish()
+        raise httpx.ConnectError(str(e), request=request) from e
+
 INTERNAL_SERVICE_URL = os.getenv("INTERNAL_SERVICE_URL", "http://nginx-proxy:80")
 
-@app.get("/", response_class=HTMLResponse)
-async def home():
-    return f"""
+# Budget de lecture des réponses amont (FETCH_MAX_BYTES / FETCH_PREVIEW_CHARS)
+FETCH_BUDGET = FetchBudget.from_env()
+# Cache des aperçus, borné en mémoire (FETCH_CACHE_MAX_BYTES, 0 pour désactiver)
+response_cache = ResponseCache(int(os.getenv("FETCH_CACHE_MAX_BYTES", str(32 * 1024 * 1024))), shared=shared_state)
+# Limites de /fetch/batch (BATCH_*)
+BATCH_LIMITS = BatchLimits.from_env()
+# Débits par client et par hôte, places de fetch et timeouts adaptatifs (ADMISSION_*)
+admission = AdmissionController.from_env()
+# Compteurs, métriques et latences échangés avec les autres workers (STATE_SYNC_INTERVAL)
+state_sync = StateSync(
+    shared_state, admission, response_cache, registry,
+    interval=float(os.getenv("STATE_SYNC_INTERVAL", "1")),
+) if shared_state is not None else None
+# Page de résultat envoyée en streaming par défaut (surchargeable par le champ "stream")
+STREAM_RESULT_PAGE = os.getenv("FETCH_STREAM_PAGE", "0").lower() in ("1", "true", "yes", "on")
+
+# La page d'accueil ne dépend que de la configuration: rendue et compressée une seule fois
+HOME_PAGE = Page(f"""
     <!DOCTYPE html>
     <html>
     <head>
@@ -111,6 +203,9 @@ async def home():
                 <label for="url">URL to fetch:</label>
                 <input type="url" id="url" name="url" placeholder="https://www.youtube.com" required>
             </div>
+            <div class="form-group">
+                <label><input type="checkbox" name="stream" value="true"> Stream the result as it arrives</label>
+            </div>
             <button type="submit">Fetch Content</button>
         </form>
         
@@ -123,32 +218,67 @@ async def home():
         </div>
     </body>
     </html>
-    """
+    """.encode(), precompress=True)
 
-@app.post("/fetch")
-async def fetch_url(url: str = Form(...)):
+@app.get("/", response_class=HTMLResponse)
+async def home(request: Request):
+    return page_response(request, HOME_PAGE)
+
+# Réseaux admis sur les endpoints d'exploitation (OPS_ALLOWED_NETWORKS, séparés par des virgules)
+OPS_NETWORKS = [ipaddress.ip_network(network.strip())
+                for network in os.getenv("OPS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128").split(",") if network.strip()]
+
+def internal_only(request: Request) -> None:
+    """
+    Réserve un endpoint d'exploitation (traces, compteurs) aux adresses de
+    OPS_NETWORKS: les traces et les compteurs révèlent ce que les autres
+    utilisateurs ont demandé. Ailleurs, l'endpoint n'existe pas (404).
+    """
     try:
-        # Validation sécurisée de l'URL
-        is_safe, error_msg = is_safe_url(url)
-        if not is_safe:
-            logger.warning(f"Blocked malicious request: {url} - {error_msg}")
-            raise HTTPException(status_code=403, detail=error_msg)
-        
-        # Décoder l'URL après validation
-        decoded_url = unquote(url)
-        logger.info(f"Fetching approved URL: {decoded_url}")
-        
-        # Requête HTTP sécurisée
-        async with httpx.AsyncClient(
-            timeout=10.0,  # Timeout plus long pour les sites externes
-            follow_redirects=True,  # Permettre les redirects pour les sites normaux
-            limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-        ) as client:
-            response = await client.get(decoded_url)
-            
-        logger.info(f"Successfully fetched {decoded_url} - Status: {response.status_code}")
-        
-        return HTMLResponse(f"""
+        address = ipaddress.ip_address(client_ip(request))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Not Found") from None
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    if not any(address in network for network in OPS_NETWORKS):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/pool/stats", dependencies=[Depends(internal_only)])
+async def pool_stats(request: Request):
+    return request.app.state.pool.stats()
+
+@app.get("/metrics")
+async def metrics():
+    # En mode multi-worker, la somme de tous les workers, quel que soit celui qui répond
+    peers = await state_sync.peer_metrics() if state_sync is not None else []
+    return Response(registry.render(peers), headers={"Content-Type": CONTENT_TYPE})
+
+@app.get("/traces", dependencies=[Depends(internal_only)])
+async def slow_traces(min_ms: float = 0.0, limit: int = 20):
+    """Requêtes récentes d'au moins min_ms millisecondes, avec leur trace_id."""
+    return trace_query(tracer.collector, min_ms, limit)
+
+@app.get("/traces/{trace_id}", dependencies=[Depends(internal_only)])
+async def trace_spans(trace_id: str):
+    """Spans enregistrés ici pour trace_id (voir shared/waterfall.py pour assembler les services)."""
+    return {"trace_id": trace_id, "spans": tracer.collector.trace(trace_id)}
+
+@app.get("/admission/stats", dependencies=[Depends(internal_only)])
+async def admission_stats():
+    return admission.stats()
+
+@app.get("/cache/stats", dependencies=[Depends(internal_only)])
+async def cache_stats():
+    return response_cache.stats()
+
+@app.get("/workers", dependencies=[Depends(internal_only)])
+async def workers():
+    """Compteurs d'admission et de cache de chaque worker et leur somme (/admission/stats et /cache/stats: ce worker seul)."""
+    if state_sync is None:
+        return summarize([{"pid": os.getpid(), **worker_stats(admission, response_cache, registry)}])
+    return await state_sync.summary()
+
+RESULT_PAGE_HEAD = """
         <!DOCTYPE html>
         <html>
         <head>
@@ -163,25 +293,257 @@ async def fetch_url(url: str = Form(...)):
         <body>
             <h1>✅ Fetch Successful</h1>
             <div class="result">
-                <h3>URL: {decoded_url}</h3>
-                <h3>Status Code: <span class="success">{response.status_code}</span></h3>
+                <h3>URL: {url}</h3>
+                <h3>Status Code: <span class="success">{status_code}</span></h3>
                 <h3>Content:</h3>
-                <pre>{response.text[:2000]}{'...' if len(response.text) > 2000 else ''}</pre>
+                <pre>"""
+
+RESULT_PAGE_TAIL = """</pre>
             </div>
             <a href="/">← Back to home</a>
         </body>
         </html>
-        """)
+        """
+
+def upstream_fetcher(pool: ClientPool, decoded_url: str):
+    """
+    Appel amont du cache de réponses: une place de fetch (admission.slot),
+    puis l'aperçu budgété de decoded_url, lu dans le timeout qu'elle fixe.
+    """
+    host = (urlparse(decoded_url).hostname or "").lower()
+    
+    async def read(headers: dict[str, str], timeout: float):
+        async with pool.stream(decoded_url, headers=headers, timeout=timeout) as response:
+            preview = await read_preview(response, FETCH_BUDGET)
+        return response, preview
+    
+    async def fetch_upstream(headers: dict[str, str]):
+        async with admission.slot(host) as timeout:
+            # Le timeout borne tout l'échange; celui de httpx ne borne que chaque opération
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(read(headers, timeout), timeout)
+            except (asyncio.TimeoutError, httpx.TimeoutException):
+                admission.observe(host, time.perf_counter() - started, timed_out=True)
+                raise
+            admission.observe(host, time.perf_counter() - started)
+            return result
+    
+    return fetch_upstream
+
+async def admitted_preview(pool: ClientPool, client: str | None, decoded_url: str) -> tuple[FetchPreview, str]:
+    """
+    Aperçu de decoded_url via le cache de réponses; lève Rejected si la
+    requête est délestée. Seuls les appels amont passent le contrôle
+    d'admission: une entrée en cache ou un appel déjà en cours ne
+    consomment ni jeton ni place. client None: jeton client déjà pris
+    (voir AdmissionController.check_rate).
+    """
+    host = (urlparse(decoded_url).hostname or "").lower()
+    return await response_cache.fetch(decoded_url, upstream_fetcher(pool, decoded_url),
+                                      admit=lambda: admission.check_rate(client, host))
+
+def client_ip(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+def render_result_page(decoded_url: str, preview: FetchPreview) -> str:
+    with stage("render"):
+        return (
+            RESULT_PAGE_HEAD.format(url=html.escape(decoded_url), status_code=preview.status_code)
+            + html.escape(preview.text)
+            + ("..." if preview.truncated else "")
+            + RESULT_PAGE_TAIL
+        )
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse qui ferme stack une fois la réponse terminée, quelle
+    qu'en soit l'issue: si le client part avant le premier morceau, le
+    générateur ne démarre jamais et son finally ne rend ni la place de fetch
+    ni la connexion amont.
+    """
+
+    def __init__(self, content, stack: AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.stack = stack
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.stack.aclose()
+
+async def stream_result_page(decoded_url: str, response: httpx.Response, stack: AsyncExitStack,
+                             host: str, started: float, deadline: float):
+    """
+    Envoie la page de résultat au fil de l'arrivée des morceaux amont. La
+    lecture du corps s'arrête à deadline (horloge de la boucle), la fin du
+    budget de latence; sa durée alimente les timeouts adaptatifs de host.
+    """
+    try:
+        yield RESULT_PAGE_HEAD.format(url=html.escape(decoded_url), status_code=response.status_code)
+        reader = BudgetedReader(response, FETCH_BUDGET)
+        chunks = aiter(reader)
+        parts = []
+        try:
+            while True:
+                # Seule la lecture est bornée, pas l'envoi au client (le délai ne doit pas couvrir un yield)
+                async with asyncio.timeout_at(deadline):
+                    try:
+                        text = await anext(chunks)
+                    except StopAsyncIteration:
+                        break
+                parts.append(text)
+                yield html.escape(text)
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            admission.observe(host, time.perf_counter() - started, timed_out=True)
+            logger.error("Latency budget exceeded while streaming %s", decoded_url)
+            yield f"\n[transfer interrupted: {html.escape(str(e) or 'latency budget exceeded')}]"
+        except httpx.HTTPError as e:
+            # Le statut 200 est déjà parti: on signale l'erreur dans la page
+            logger.error("Transfer interrupted for %s: %s", decoded_url, e)
+            yield f"\n[transfer interrupted: {html.escape(str(e))}]"
+        else:
+            admission.observe(host, time.perf_counter() - started)
+            # L'aperçu est déjà borné par le budget: le garder ne coûte qu'une jointure
+            preview = FetchPreview(response.status_code, "".join(parts), reader.bytes_read, reader.truncated,
+                                   reader.kind)
+            response_cache.store(decoded_url, response, preview)
+        if reader.truncated:
+            yield "..."
+        yield RESULT_PAGE_TAIL
+        logger.info("Successfully streamed %s - Status: %d - %d bytes", decoded_url, response.status_code, reader.bytes_read)
+    finally:
+        await stack.aclose()
+
+@app.post("/fetch")
+async def fetch_url(request: Request, url: str = Form(...), stream: bool = Form(STREAM_RESULT_PAGE)):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        # Validation sécurisée de l'URL
+        with stage("validation"):
+            is_safe, error_msg = is_safe_url(url)
+        if not is_safe:
+            outcome = "blocked"
+            log_blocked(url, error_msg)
+            raise HTTPException(status_code=403, detail=error_msg)
+        
+        # Décoder l'URL après validation
+        decoded_url = unquote(url)
+        logger.info("Fetching approved URL: %s", decoded_url)
+        pool = request.app.state.pool
+        
+        if stream:
+            host = (urlparse(decoded_url).hostname or "").lower()
+            # Entrée fraîche, périmée ou en cours de chargement: servie comme sans streaming
+            cached = await response_cache.cached(decoded_url, upstream_fetcher(pool, decoded_url),
+                                                 admit=lambda: admission.check_rate(client_ip(request), host))
+            if cached is not None:
+                preview, cache_status = cached
+                outcome = "ok"
+                return HTMLResponse(render_result_page(decoded_url, preview), headers={"X-Cache": cache_status})
+            admission.check_rate(client_ip(request), host)
+            # La réponse amont et la place de fetch restent prises jusqu'à la fin de la réponse, qui les rend
+            stack = AsyncExitStack()
+            try:
+                timeout = await stack.enter_async_context(admission.slot(host))
+                fetch_started = time.perf_counter()
+                # Le budget couvre aussi la lecture du corps, dans stream_result_page
+                deadline = asyncio.get_running_loop().time() + timeout
+                try:
+                    # asyncio.timeout plutôt que wait_for: le contexte doit être ouvert dans cette tâche
+                    async with asyncio.timeout_at(deadline):
+                        response = await stack.enter_async_context(pool.stream(decoded_url, timeout=timeout))
+                except (asyncio.TimeoutError, httpx.TimeoutException):
+                    admission.observe(host, time.perf_counter() - fetch_started, timed_out=True)
+                    raise
+            except BaseException:
+                await stack.aclose()
+                raise
+            outcome = "ok"
+            return ClosingStreamingResponse(
+                stream_result_page(decoded_url, response, stack, host, fetch_started, deadline),
+                stack,
+                media_type="text/html; charset=utf-8",
+            )
+        
+        # Requête HTTP sécurisée via le pool partagé: seul le préfixe budgété est lu
+        preview, cache_status = await admitted_preview(pool, client_ip(request), decoded_url)
+            
+        logger.info("Successfully fetched %s - Status: %d - %d bytes - Cache: %s",
+                    decoded_url, preview.status_code, preview.bytes_read, cache_status)
+        
+        outcome = "ok"
+        return HTMLResponse(render_result_page(decoded_url, preview), headers={"X-Cache": cache_status})
         
     except HTTPException:
         # Re-raise HTTPException (validation errors) as-is
         raise
+    except Rejected as e:
+        # Délestage: réponse immédiate, le client sait quand réessayer
+        outcome = "shed"
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)}) from None
+    except asyncio.TimeoutError:
+        outcome = "timeout"
+        logger.error("Latency budget exceeded for %s", url)
+        raise HTTPException(status_code=504, detail="Upstream did not answer within the latency budget") from None
+    except BlockedDestinationError as e:
+        # Redirection ou résolution DNS vers une destination interne
+        outcome = "blocked"
+        log_blocked(url, str(e))
+        raise HTTPException(status_code=403, detail=str(e)) from e
     except httpx.RequestError as e:
-        logger.error(f"HTTP request failed for {url}: {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {str(e)}")
+        logger.error("HTTP request failed for %s: %s", url, e)
+        raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {str(e)}") from e
     except ValueError as e:
-        logger.error(f"Invalid URL format: {url} - {str(e)}")
-        raise HTTPException(status_code=400, detail=f"Invalid URL format: {str(e)}")
+        logger.error("Invalid URL format: %s - %s", url, e)
+        raise HTTPException(status_code=400, detail=f"Invalid URL format: {str(e)}") from e
     except Exception as e:
-        logger.error(f"Unexpected internal error processing {url}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+        logger.error("Unexpected internal error processing %s: %s", url, e)
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+    finally:
+        FETCH_DURATION.observe(time.perf_counter() - started, outcome)
+
+class BatchFetchRequest(BaseModel):
+    urls: list[str]
+    deadline: float | None = None
+    item_timeout: float | None = None
+
+@app.post("/fetch/batch")
+async def fetch_batch(request: Request, batch: BatchFetchRequest):
+    """
+    Récupère une liste d'URLs en parallèle et renvoie un résultat NDJSON par
+    URL, dans l'ordre de complétion.
+    """
+    if len(batch.urls) > BATCH_LIMITS.max_urls:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_LIMITS.max_urls} URLs per batch")
+    # Les valeurs du client ne peuvent que réduire les limites configurées
+    deadline = min(batch.deadline or BATCH_LIMITS.deadline, BATCH_LIMITS.deadline)
+    item_timeout = min(batch.item_timeout or BATCH_LIMITS.item_timeout, BATCH_LIMITS.item_timeout)
+    pool = request.app.state.pool
+    # Le lot coûte un seul jeton au client; chaque URL ne passe plus que les limites par hôte
+    try:
+        admission.check_client(client_ip(request))
+    except Rejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)}) from None
+    logger.info("Batch fetch of %d URLs (deadline %ss)", len(batch.urls), deadline)
+    
+    def check(url: str) -> tuple[bool, str]:
+        is_safe, error_msg = is_safe_url(url)
+        if not is_safe:
+            log_blocked(url, error_msg)
+        return is_safe, error_msg
+    
+    return StreamingResponse(
+        run_batch(
+            batch.urls,
+            check,
+            lambda url: admitted_preview(pool, None, unquote(url)),
+            BATCH_LIMITS,
+            deadline,
+            item_timeout,
+        ),
+        media_type="application/x-ndjson",
+    )
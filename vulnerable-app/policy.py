@@ -0,0 +1,267 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import sqlite3
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+# Catégories de règles, utilisées pour le message renvoyé au client
+HOST = "host"
+DOMAIN = "domain"
+
+# Marqueurs stockés dans les noeuds du trie (un label DNS ne peut pas contenir '\0')
+_EXACT = "\0exact"
+_SUBDOMAINS = "\0sub"
+
+
+def normalize_host(hostname: str) -> str:
+    return hostname.lower().rstrip(".")
+
+
+class DomainTrie:
+    """
+    Trie de labels DNS inversés (com -> company -> internal).
+
+    Syntaxe des règles:
+        example.com      l'hôte exact uniquement
+        *.example.com    tous les sous-domaines, pas example.com lui-même
+        .example.com     example.com et tous ses sous-domaines
+    """
+
+    __slots__ = ("_root", "size")
+
+    def __init__(self):
+        self._root: dict = {}
+        self.size = 0
+
+    def add(self, rule: str, category: str) -> None:
+        rule = normalize_host(rule)
+        markers = [_EXACT]
+        if rule.startswith("*."):
+            rule, markers = rule[2:], [_SUBDOMAINS]
+        elif rule.startswith("."):
+            rule, markers = rule[1:], [_EXACT, _SUBDOMAINS]
+        node = self._root
+        for label in reversed(rule.split(".")):
+            node = node.setdefault(label, {})
+        for marker in markers:
+            node.setdefault(marker, category)
+        self.size += 1
+
+    def lookup(self, hostname: str) -> str | None:
+        """Catégorie de la première règle qui couvre hostname (déjà normalisé), sinon None."""
+        labels = hostname.split(".")
+        node = self._root
+        for depth in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[depth])
+            if node is None:
+                return None
+            if depth and _SUBDOMAINS in node:
+                return node[_SUBDOMAINS]
+        return node.get(_EXACT)
+
+
+class CidrTree:
+    """Arbre binaire de préfixes pour les plages IPv4 et IPv6."""
+
+    __slots__ = ("_roots", "size")
+
+    def __init__(self):
+        # Noeud = [fils 0, fils 1, réseau bloqué ou None]
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self.size = 0
+
+    def add(self, network: ipaddress.IPv4Network | ipaddress.IPv6Network) -> None:
+        node = self._roots[network.version]
+        bits = int(network.network_address)
+        width = network.max_prefixlen
+        for shift in range(width - 1, width - 1 - network.prefixlen, -1):
+            bit = (bits >> shift) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = network
+        self.size += 1
+
+    def lookup(self, ip: ipaddress.IPv4Address | ipaddress.IPv6Address):
+        """Réseau le plus large contenant ip, sinon None."""
+        node = self._roots[ip.version]
+        if node[2] is not None:
+            return node[2]
+        bits = int(ip)
+        for shift in range(ip.max_prefixlen - 1, -1, -1):
+            node = node[(bits >> shift) & 1]
+            if node is None:
+                return None
+            if node[2] is not None:
+                return node[2]
+        return None
+
+
+class UrlPolicy:
+    """
+    Liste de blocage compilée une seule fois, puis consultée à chaque requête.
+
+    Les hôtes exacts passent par un frozenset, les règles de domaine par un
+    DomainTrie et les plages d'adresses par un CidrTree.
+    """
+
+    def __init__(self, exact: dict[str, str], trie: DomainTrie, exact_ips: frozenset, cidrs: CidrTree):
+        self._exact = exact
+        self._exact_names = frozenset(exact)
+        self._trie = trie
+        self._exact_ips = exact_ips
+        self._cidrs = cidrs
+
+    @classmethod
+    def compile(cls, hosts: Iterable[str] = (), domains: Iterable[str] = ()) -> "UrlPolicy":
+        exact: dict[str, str] = {}
+        trie = DomainTrie()
+        exact_ips = set()
+        cidrs = CidrTree()
+        for category, rules in ((HOST, hosts), (DOMAIN, domains)):
+            for rule in rules:
+                rule = rule.strip()
+                if not rule:
+                    continue
+                try:
+                    network = ipaddress.ip_network(rule, strict=False)
+                except ValueError:
+                    network = None
+                if network is not None:
+                    if network.prefixlen == network.max_prefixlen:
+                        exact_ips.add(network.network_address)
+                    else:
+                        cidrs.add(network)
+                elif rule[0] in "*.":
+                    trie.add(rule, category)
+                else:
+                    exact.setdefault(normalize_host(rule), category)
+        return cls(exact, trie, frozenset(exact_ips), cidrs)
+
+    @property
+    def size(self) -> int:
+        return len(self._exact) + self._trie.size + len(self._exact_ips) + self._cidrs.size
+
+    def check_host(self, hostname: str) -> str | None:
+        """
+        Vérifie un nom d'hôte ou une adresse IP.
+
+        Returns:
+            str | None: message d'erreur si l'hôte est bloqué, None sinon
+        """
+        host = normalize_host(hostname)
+        if host in self._exact_names:
+            return self._message(self._exact[host], hostname)
+
+        # Un TLD n'est jamais numérique: inutile de tenter le parsing IP (coûteux en cas d'échec)
+        if ":" not in host and not host[-1:].isdigit():
+            category = self._trie.lookup(host)
+            return self._message(category, hostname) if category else None
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            category = self._trie.lookup(host)
+            return self._message(category, hostname) if category else None
+
+        if ip.is_private or ip.is_loopback or ip.is_link_local:
+            return f"Access to private/loopback IP '{hostname}' is not allowed"
+        if ip in self._exact_ips:
+            return f"Access to blocked IP '{hostname}' is not allowed"
+        network = self._cidrs.lookup(ip)
+        if network is not None:
+            return f"Access to IP '{hostname}' in blocked range {network} is not allowed"
+        return None
+
+    @staticmethod
+    def _message(category: str, hostname: str) -> str:
+        if category == HOST:
+            return f"Access to internal host '{hostname}' is not allowed"
+        return f"Access to internal domain '{hostname}' is not allowed"
+
+
+def read_rules(path: str) -> list[str]:
+    """Une règle par ligne, '#' introduit un commentaire."""
+    rules = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            rule = line.split("#", 1)[0].strip()
+            if rule:
+                rules.append(rule)
+    return rules
+
+
+class PolicyStore:
+    """
+    Détient la politique courante et la recharge quand le fichier change.
+
+    La lecture et la compilation tournent dans un thread; la nouvelle
+    politique remplace l'ancienne en une seule affectation, donc une
+    requête en cours voit toujours une politique complète.
+
+    Avec state (state.SharedState, mode multi-worker), les règles
+    supplémentaires sont celles que le superviseur a lues dans le fichier
+    et publiées: tous les workers passent à la même version.
+    """
+
+    def __init__(self, hosts: Iterable[str], domains: Iterable[str],
+                 path: str | None = None, interval: float = 5.0, state=None):
+        self.hosts = list(hosts)
+        self.domains = list(domains)
+        self.path = path
+        self.interval = interval
+        self.state = state
+        self.current = UrlPolicy.compile(self.hosts, self.domains)
+        self._stamp: float | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def source(self) -> str | None:
+        return "shared state" if self.state is not None else self.path
+
+    def _source_stamp(self) -> float:
+        # Version publiée en mode multi-worker, date de modification du fichier sinon
+        if self.state is not None:
+            return self.state.policy_version()
+        return os.stat(self.path).st_mtime
+
+    def _load(self) -> UrlPolicy:
+        rules = self.state.policy_rules() if self.state is not None else read_rules(self.path)
+        return UrlPolicy.compile(self.hosts, self.domains + rules)
+
+    async def reload_if_changed(self) -> bool:
+        if not self.source:
+            return False
+        try:
+            stamp = await asyncio.to_thread(self._source_stamp)
+            if stamp == self._stamp:
+                return False
+            policy = await asyncio.to_thread(self._load)
+        except (OSError, UnicodeDecodeError, sqlite3.Error) as e:
+            logger.error("Policy reload failed for %s: %s", self.source, e)
+            return False
+        self.current, self._stamp = policy, stamp
+        logger.info("Loaded URL policy from %s (%d rules)", self.source, policy.size)
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.reload_if_changed()
+
+    async def start(self) -> None:
+        await self.reload_if_changed()
+        if self.source:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+
+import httpx
+
+from resolver import DnsCache, PinnedTransport
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (requis par httpx pour HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(int(default))).lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """
+    Réglages d'un client HTTP sortant.
+
+    max_per_host limite le nombre de requêtes simultanées vers un même hôte
+    (0 = pas de limite), indépendamment de la taille globale du pool.
+    """
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    max_per_host: int = 10
+    http2: bool = False
+    timeout: float = 10.0
+
+    @classmethod
+    def from_env(cls) -> "PoolSettings":
+        return cls(
+            max_connections=_env_int("FETCH_POOL_MAX_CONNECTIONS", cls.max_connections),
+            max_keepalive_connections=_env_int("FETCH_POOL_MAX_KEEPALIVE", cls.max_keepalive_connections),
+            keepalive_expiry=_env_float("FETCH_POOL_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            max_per_host=_env_int("FETCH_POOL_MAX_PER_HOST", cls.max_per_host),
+            http2=_env_bool("FETCH_POOL_HTTP2", cls.http2),
+            timeout=_env_float("FETCH_TIMEOUT", cls.timeout),
+        )
+
+
+def host_overrides_from_env(base: PoolSettings) -> dict[str, PoolSettings]:
+    """
+    Lit FETCH_POOL_HOSTS, un objet JSON {hôte: {réglage: valeur}}.
+    Exemple: {"api.example.com": {"http2": true, "max_per_host": 4}}
+    """
+    raw = os.getenv("FETCH_POOL_HOSTS", "")
+    if not raw:
+        return {}
+    return {host.lower(): replace(base, **opts) for host, opts in json.loads(raw).items()}
+
+
+class _HostGate:
+    """Sémaphore par hôte qui compte aussi les requêtes en attente."""
+
+    __slots__ = ("semaphore", "active", "waiting")
+
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+
+
+class ClientPool:
+    """
+    Clients httpx.AsyncClient partagés, créés au démarrage et fermés à l'arrêt.
+
+    Un client par défaut sert tous les hôtes, sauf ceux qui ont des réglages
+    dédiés (FETCH_POOL_HOSTS) et qui reçoivent leur propre client.
+
+    Avec un DnsCache, les connexions sont épinglées sur les adresses déjà
+    résolues et validées; request_hook est appelé avant chaque requête, y
+    compris chaque saut de redirection.
+    """
+
+    def __init__(self, default: PoolSettings, per_host: dict[str, PoolSettings] | None = None,
+                 dns: DnsCache | None = None, request_hook=None):
+        self.default = default
+        self.per_host = per_host or {}
+        self.dns = dns
+        self.request_hook = request_hook
+        self._clients: dict[PoolSettings, httpx.AsyncClient] = {}
+        self._gates: dict[str, _HostGate] = {}
+
+    @classmethod
+    def from_env(cls, **kwargs) -> "ClientPool":
+        default = PoolSettings.from_env()
+        return cls(default, host_overrides_from_env(default), **kwargs)
+
+    def _build_client(self, settings: PoolSettings) -> httpx.AsyncClient:
+        http2 = settings.http2
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 demandé mais le paquet 'h2' est absent, repli sur HTTP/1.1")
+            http2 = False
+        limits = httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+        )
+        return httpx.AsyncClient(
+            # Seuls encodages que fetching.BudgetedReader sait décompresser sans dépasser son budget
+            headers={"Accept-Encoding": "gzip, deflate"},
+            timeout=settings.timeout,
+            follow_redirects=True,
+            http2=http2,
+            limits=limits,
+            transport=PinnedTransport(self.dns, http2=http2, limits=limits) if self.dns else None,
+            event_hooks={"request": [self.request_hook]} if self.request_hook else None,
+        )
+
+    async def start(self) -> None:
+        for settings in {self.default, *self.per_host.values()}:
+            self._clients[settings] = self._build_client(settings)
+        logger.info("Pool HTTP démarré avec %d client(s)", len(self._clients))
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+    def settings_for(self, host: str) -> PoolSettings:
+        return self.per_host.get(host.lower(), self.default)
+
+    def client_for(self, host: str) -> httpx.AsyncClient:
+        try:
+            return self._clients[self.settings_for(host)]
+        except KeyError:
+            raise RuntimeError("ClientPool non démarré") from None
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        """Réserve une place dans la limite par hôte pendant toute la requête."""
+        host = host.lower()
+        limit = self.settings_for(host).max_per_host
+        if limit <= 0:
+            yield
+            return
+        gate = self._gates.get(host)
+        if gate is None:
+            gate = self._gates[host] = _HostGate(limit)
+        gate.waiting += 1
+        try:
+            await gate.semaphore.acquire()
+        finally:
+            gate.waiting -= 1
+        gate.active += 1
+        try:
+            yield
+        finally:
+            gate.active -= 1
+            gate.semaphore.release()
+            # Libérer la porte dès qu'elle est inutilisée pour ne pas accumuler un hôte par URL vue
+            if gate.active == 0 and gate.waiting == 0:
+                self._gates.pop(host, None)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        host = httpx.URL(url).host
+        async with self.slot(host):
+            return await self.client_for(host).get(url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, url: str, **kwargs):
+        """
+        Ouvre une réponse en streaming sans lire le corps.
+        La place par hôte reste réservée jusqu'à la fermeture de la réponse.
+        """
+        host = httpx.URL(url).host
+        async with self.slot(host):
+            async with self.client_for(host).stream("GET", url, **kwargs) as response:
+                yield response
+
+    def stats(self) -> dict:
+        """Connexions inactives, utilisées et requêtes en attente, par client et par hôte."""
+        clients = []
+        for settings, client in self._clients.items():
+            # httpcore n'expose pas de compteurs publics: on lit l'état du pool sous-jacent
+            pool = getattr(client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+            idle = sum(1 for conn in connections if conn.is_idle())
+            queued = sum(1 for status in getattr(pool, "_requests", []) if status.connection is None)
+            clients.append({
+                "hosts": sorted(h for h, s in self.per_host.items() if s == settings) or ["*"],
+                "http2": settings.http2 and HTTP2_AVAILABLE,
+                "max_connections": settings.max_connections,
+                "max_keepalive_connections": settings.max_keepalive_connections,
+                "connections": len(connections),
+                "idle": idle,
+                "in_use": len(connections) - idle,
+                "waiting": queued,
+            })
+        hosts = {
+            host: {"active": gate.active, "waiting": gate.waiting}
+            for host, gate in self._gates.items()
+        }
+        return {
+            "clients": clients,
+            "hosts": hosts,
+            "dns": self.dns.stats() if self.dns else None,
+            "idle": sum(c["idle"] for c in clients),
+            "in_use": sum(c["in_use"] for c in clients),
+            "waiting": sum(c["waiting"] for c in clients) + sum(g.waiting for g in self._gates.values()),
+        }
@@ -0,0 +1,356 @@
+import codecs
+import hashlib
+import re
+from html.parser import HTMLParser
+
+# Octets examinés avant de choisir un rendu
+SNIFF_BYTES = 512
+
+# (décalage, signature, description) des formats binaires reconnus
+MAGIC = [
+    (0, b"\x89PNG\r\n\x1a\n", "PNG image"),
+    (0, b"\xff\xd8\xff", "JPEG image"),
+    (0, b"GIF87a", "GIF image"),
+    (0, b"GIF89a", "GIF image"),
+    (0, b"\x00\x00\x01\x00", "ICO image"),
+    (0, b"%PDF-", "PDF document"),
+    (0, b"PK\x03\x04", "ZIP archive (or OOXML/JAR/APK)"),
+    (0, b"\x1f\x8b", "gzip data"),
+    (0, b"BZh", "bzip2 data"),
+    (0, b"\xfd7zXZ\x00", "xz data"),
+    (0, b"7z\xbc\xaf\x27\x1c", "7-Zip archive"),
+    (0, b"Rar!\x1a\x07", "RAR archive"),
+    (0, b"\x7fELF", "ELF executable"),
+    (0, b"MZ", "Windows executable"),
+    (0, b"\xcf\xfa\xed\xfe", "Mach-O executable"),
+    (0, b"\xca\xfe\xba\xbe", "Java class or Mach-O universal binary"),
+    (0, b"\x00asm", "WebAssembly module"),
+    (0, b"SQLite format 3\x00", "SQLite database"),
+    (4, b"ftyp", "ISO media (MP4/MOV/HEIF)"),
+    (0, b"OggS", "Ogg media"),
+    (0, b"ID3", "MP3 audio"),
+    (0, b"fLaC", "FLAC audio"),
+    (0, b"\x1aE\xdf\xa3", "Matroska/WebM video"),
+    (0, b"wOFF", "WOFF font"),
+    (0, b"wOF2", "WOFF2 font"),
+]
+# Formats dans un conteneur RIFF: "RIFF", la taille sur 4 octets, puis ce type
+RIFF_FORMATS = {b"WEBP": "WebP image", b"WAVE": "WAV audio"}
+# Une signature plus courte (MZ, ID3, BZh...) se rencontre au début de textes ordinaires:
+# elle ne l'emporte pas sur un type annoncé, seulement sur un type absent ou générique
+MIN_OVERRIDE_BYTES = 4
+
+_TEXT_TYPES = {
+    "application/json", "application/xml", "application/javascript", "application/ecmascript",
+    "application/x-javascript", "application/x-www-form-urlencoded", "application/x-sh",
+}
+_HTML_TYPES = {"text/html", "application/xhtml+xml"}
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+
+
+def magic_of(head: bytes, min_bytes: int = 0) -> str | None:
+    """Format binaire reconnu dans head, parmi ceux dont la signature fait au moins min_bytes octets."""
+    if head[:4] == b"RIFF" and head[8:12] in RIFF_FORMATS:
+        return RIFF_FORMATS[head[8:12]]
+    for offset, signature, description in MAGIC:
+        if len(signature) >= min_bytes and head[offset:offset + len(signature)] == signature:
+            return description
+    return None
+
+
+def looks_binary(head: bytes) -> bool:
+    """
+    Pas du texte: octet nul, plus de 10% de caractères de contrôle, ou UTF-8
+    invalide avec plus de 30% d'octets hauts (un texte Latin-1 en a peu).
+    """
+    if b"\x00" in head:
+        return True
+    if not head:
+        return False
+    controls = sum(1 for byte in head if byte < 32 and byte not in (9, 10, 12, 13, 27))
+    if controls / len(head) > 0.1:
+        return True
+    try:
+        # Les 3 derniers octets peuvent couper un caractère multi-octets
+        head[:-3].decode("utf-8")
+        return False
+    except UnicodeDecodeError:
+        return sum(1 for byte in head if byte >= 0x80) / len(head) > 0.3
+
+
+def _decoder(encoding: str | None):
+    try:
+        return codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+class TextRenderer:
+    """Texte brut, décodé au fil des morceaux selon le charset annoncé (UTF-8 par défaut)."""
+
+    kind = "text"
+
+    def __init__(self, encoding: str | None):
+        self.decoder = _decoder(encoding)
+
+    def feed(self, chunk: bytes) -> str:
+        return self.decoder.decode(chunk)
+
+    def close(self, truncated: bool = False) -> str:
+        return self.decoder.decode(b"", final=True)
+
+
+class JsonRenderer(TextRenderer):
+    """
+    JSON réindenté caractère par caractère, sans analyse complète: un
+    préfixe tronqué s'affiche aussi bien qu'un document entier. Le texte
+    des chaînes est recopié tel quel.
+    """
+
+    kind = "json"
+    INDENT = "  "
+    # Au-delà, l'indentation n'augmente plus (une imbrication profonde ne fait pas exploser la sortie)
+    MAX_INDENT_DEPTH = 32
+
+    def __init__(self, encoding: str | None):
+        super().__init__(encoding or "utf-8")
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.opened = False
+
+    def _newline(self) -> str:
+        return "\n" + self.INDENT * min(self.depth, self.MAX_INDENT_DEPTH)
+
+    def _format(self, text: str) -> str:
+        out = []
+        for char in text:
+            if self.in_string:
+                out.append(char)
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char in " \t\r\n":
+                continue
+            if self.opened:
+                # Le retour à la ligne après { ou [ attend le caractère suivant: {} et [] restent compacts
+                self.opened = False
+                if char not in "}]":
+                    out.append(self._newline())
+            if char in "{[":
+                self.depth += 1
+                self.opened = True
+                out.append(char)
+            elif char in "}]":
+                if self.depth:
+                    self.depth -= 1
+                if out and out[-1] in "{[":
+                    out.append(char)
+                else:
+                    out.append(self._newline() + char)
+            elif char == ",":
+                out.append("," + self._newline())
+            elif char == ":":
+                out.append(": ")
+            else:
+                if char == '"':
+                    self.in_string = True
+                out.append(char)
+        return "".join(out)
+
+    def feed(self, chunk: bytes) -> str:
+        return self._format(super().feed(chunk))
+
+    def close(self, truncated: bool = False) -> str:
+        return self._format(super().close())
+
+
+class _HtmlExtractor(HTMLParser):
+    SKIP = {"script", "style", "noscript", "template", "svg", "math", "iframe", "object", "head"}
+    BLOCKS = {
+        "p", "div", "br", "li", "ul", "ol", "dl", "dt", "dd", "tr", "table", "section", "article",
+        "header", "footer", "nav", "aside", "main", "h1", "h2", "h3", "h4", "h5", "h6", "pre",
+        "blockquote", "hr", "form", "figure", "figcaption", "details", "summary", "body",
+    }
+    MAX_META_CHARS = 300
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: list[str] = []
+        self.skip_depth = 0
+        self.title: list[str] | None = None
+        self.title_done = False
+        self.header_lines = 0
+        self.body_started = False
+        self.line_start = True
+        self.pending_space = False
+
+    def _line(self, text: str) -> None:
+        self.out.append(text + "\n")
+        self.header_lines += 1
+
+    def _newline(self) -> None:
+        if not self.line_start:
+            self.out.append("\n")
+            self.line_start = True
+            self.pending_space = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.title_done:
+            self.title = []
+        elif tag == "meta":
+            attrs = dict(attrs)
+            name = attrs.get("name") or attrs.get("property") or attrs.get("http-equiv")
+            if name and attrs.get("content"):
+                self._line(f"Meta {name[:64]}: {' '.join(attrs['content'].split())[:self.MAX_META_CHARS]}")
+            elif attrs.get("charset"):
+                self._line(f"Meta charset: {attrs['charset'][:self.MAX_META_CHARS]}")
+        elif tag in self.SKIP:
+            self.skip_depth += 1
+        elif tag in self.BLOCKS:
+            if tag == "body":
+                # </head> est facultatif: le corps commence de toute façon ici
+                self.skip_depth = 0
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        # <br/>, <meta .../>: pas de contenu, donc pas de profondeur à suivre
+        if tag in self.SKIP:
+            return
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self.title is not None:
+            title = " ".join("".join(self.title).split())
+            if title:
+                self._line(f"Title: {title[:self.MAX_META_CHARS]}")
+            self.title = None
+            self.title_done = True
+        elif tag in self.SKIP:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in self.BLOCKS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self.title is not None:
+            self.title.append(data)
+            return
+        if self.skip_depth:
+            return
+        words = data.split()
+        if not words:
+            self.pending_space = self.pending_space or bool(data)
+            return
+        if not self.body_started:
+            self.body_started = True
+            if self.header_lines:
+                self.out.append("\n")
+        elif (self.pending_space or data[0].isspace()) and not self.line_start:
+            self.out.append(" ")
+        self.out.append(" ".join(words))
+        self.line_start = False
+        self.pending_space = data[-1].isspace()
+
+    def take(self) -> str:
+        text = "".join(self.out)
+        self.out.clear()
+        return text
+
+
+class HtmlRenderer(TextRenderer):
+    """Titre, balises meta puis texte visible, extraits par un analyseur HTML incrémental."""
+
+    kind = "html"
+
+    def __init__(self, encoding: str | None):
+        super().__init__(encoding)
+        self.parser = _HtmlExtractor()
+
+    def feed(self, chunk: bytes) -> str:
+        self.parser.feed(super().feed(chunk))
+        return self.parser.take()
+
+    def close(self, truncated: bool = False) -> str:
+        self.parser.feed(super().close())
+        self.parser.close()
+        return self.parser.take()
+
+
+class BinaryRenderer:
+    """Aucun décodage: taille, empreinte SHA-256 et format reconnu par signature."""
+
+    kind = "binary"
+
+    def __init__(self, content_type: str, content_length: str | None, magic: str | None):
+        self.content_type = content_type
+        self.content_length = content_length
+        self.magic = magic
+        self.digest = hashlib.sha256()
+        self.head = b""
+        self.size = 0
+
+    def feed(self, chunk: bytes) -> str:
+        if len(self.head) < 16:
+            self.head += chunk[:16 - len(self.head)]
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        return ""
+
+    def close(self, truncated: bool = False) -> str:
+        # Après une lecture tronquée, le reste du corps n'est jamais lu: l'empreinte porte sur le préfixe
+        if self.content_length and self.content_length.isdigit():
+            size = f"{self.content_length} bytes"
+        elif truncated:
+            size = f"unknown (no Content-Length, more than {self.size} bytes)"
+        else:
+            size = f"{self.size} bytes"
+        lines = [
+            f"Binary content: {self.magic or 'unknown format'}"
+            + (f" ({self.content_type})" if self.content_type else ""),
+            f"Size: {size}",
+            f"SHA-256: {self.digest.hexdigest()}" if not truncated
+            else f"SHA-256 of the first {self.size} bytes: {self.digest.hexdigest()}",
+            f"First bytes: {self.head.hex(' ')}",
+        ]
+        return "\n".join(lines)
+
+
+def select_renderer(content_type: str | None, charset: str | None, content_length: str | None, head: bytes):
+    """
+    Rendu adapté à une réponse, d'après son Content-Type et ses premiers
+    octets. Une signature binaire d'au moins MIN_OVERRIDE_BYTES octets
+    l'emporte sur le type annoncé; sans type (ou avec un type générique),
+    toutes les signatures comptent et le contenu est reconnifié.
+    """
+    mime = (content_type or "").split(";", 1)[0].strip().lower()
+    generic = not mime or mime == "application/octet-stream"
+    magic = magic_of(head, 0 if generic else MIN_OVERRIDE_BYTES)
+    if magic is not None:
+        return BinaryRenderer(mime, content_length, magic)
+
+    if mime in _HTML_TYPES:
+        match = _META_CHARSET.search(head) if charset is None else None
+        return HtmlRenderer(charset or (match.group(1).decode("ascii") if match else None))
+    if mime == "application/json" or mime.endswith("+json"):
+        return JsonRenderer(charset)
+    if mime == "text/plain":
+        # Pas de promotion de text/plain en HTML ou JSON, seulement la détection du binaire mal étiqueté
+        return BinaryRenderer(mime, content_length, None) if looks_binary(head) else TextRenderer(charset)
+    if mime.startswith("text/") or mime in _TEXT_TYPES or mime.endswith("+xml"):
+        return TextRenderer(charset)
+    if mime and mime != "application/octet-stream":
+        return BinaryRenderer(mime, content_length, None)
+
+    # Type absent ou générique: on regarde le contenu
+    if looks_binary(head):
+        return BinaryRenderer(mime, content_length, None)
+    start = head.lstrip(b"\xef\xbb\xbf \t\r\n")[:SNIFF_BYTES].lower()
+    if start.startswith((b"<!doctype html", b"<html")) or b"<html" in start:
+        return HtmlRenderer(charset)
+    if start.startswith((b"{", b"[")):
+        return JsonRenderer(charset)
+    return TextRenderer(charset)
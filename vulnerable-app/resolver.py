@@ -0,0 +1,201 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+import httpcore
+import httpx
+
+try:
+    import aiodns
+    AIODNS_AVAILABLE = True
+    _DNS_ERRORS = (OSError, aiodns.error.DNSError)
+except ImportError:
+    AIODNS_AVAILABLE = False
+    _DNS_ERRORS = (OSError,)
+
+
+class BlockedDestinationError(Exception):
+    """La destination (URL ou adresse résolue) est refusée par la politique."""
+
+
+@dataclass
+class _Entry:
+    addresses: tuple[str, ...]
+    error: str | None
+    blocked: bool
+    expires: float
+
+
+class DnsCache:
+    """
+    Résolution asynchrone avec cache TTL, cache négatif et coalescence.
+
+    Les adresses obtenues sont validées une fois par validate(ip) -> message
+    d'erreur ou None; une entrée en cache est donc toujours déjà validée.
+    Avec aiodns, le TTL des enregistrements est respecté (borné par
+    min_ttl/max_ttl); sans aiodns, getaddrinfo tourne dans le pool de threads
+    de la boucle et default_ttl s'applique.
+    """
+
+    def __init__(self, validate: Callable[[str], str | None], *, default_ttl: float = 60.0,
+                 min_ttl: float = 5.0, max_ttl: float = 3600.0, negative_ttl: float = 30.0,
+                 max_entries: int = 10000):
+        self.validate = validate
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._aiodns = None
+        self.hits = self.misses = self.coalesced = 0
+
+    async def _query(self, host: str) -> tuple[tuple[str, ...], float]:
+        if AIODNS_AVAILABLE:
+            if self._aiodns is None:
+                self._aiodns = aiodns.DNSResolver()
+            results = await asyncio.gather(
+                self._aiodns.query(host, "A"), self._aiodns.query(host, "AAAA"),
+                return_exceptions=True,
+            )
+            records = [r for result in results if not isinstance(result, Exception) for r in result]
+            if not records:
+                raise OSError(str(results[0]))
+            ttl = min(record.ttl for record in records)
+            return tuple(dict.fromkeys(record.host for record in records)), ttl
+
+        infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        return tuple(dict.fromkeys(info[4][0] for info in infos)), self.default_ttl
+
+    async def _lookup(self, host: str) -> _Entry:
+        now = time.monotonic()
+        try:
+            addresses, ttl = await self._query(host)
+        except _DNS_ERRORS as e:
+            return _Entry((), f"DNS resolution failed for '{host}': {e}", False, now + self.negative_ttl)
+        for address in addresses:
+            error = self.validate(address)
+            if error:
+                # Une seule adresse interne suffit à refuser le nom (DNS rebinding)
+                return _Entry((), f"'{host}' resolves to a blocked address: {error}", True, now + self.negative_ttl)
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        return _Entry(addresses, None, False, now + ttl)
+
+    async def _refresh(self, host: str) -> _Entry:
+        try:
+            entry = await self._lookup(host)
+            self._store(host, entry)
+            return entry
+        finally:
+            del self._inflight[host]
+
+    def _store(self, host: str, entry: _Entry) -> None:
+        self._entries[host] = entry
+        self._entries.move_to_end(host)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def resolve(self, host: str) -> tuple[str, ...]:
+        """
+        Adresses validées pour host.
+
+        Raises:
+            BlockedDestinationError: une des adresses est refusée par la politique
+            OSError: la résolution a échoué (résultat mis en cache négatif)
+        """
+        host = host.lower().rstrip(".")
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            pass
+        else:
+            error = self.validate(str(ip))
+            if error:
+                raise BlockedDestinationError(error)
+            return (str(ip),)
+
+        entry = self._entries.get(host)
+        if entry is not None and entry.expires > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(host)
+        else:
+            # Une seule résolution par nom à la fois; la tâche survit à l'annulation d'un appelant
+            task = self._inflight.get(host)
+            if task is None:
+                self.misses += 1
+                task = self._inflight[host] = asyncio.create_task(self._refresh(host))
+            else:
+                self.coalesced += 1
+            entry = await asyncio.shield(task)
+
+        if entry.blocked:
+            raise BlockedDestinationError(entry.error)
+        if entry.error:
+            raise OSError(entry.error)
+        return entry.addresses
+
+    def stats(self) -> dict:
+        return {
+            "backend": "aiodns" if AIODNS_AVAILABLE else "getaddrinfo",
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+
+class PinnedBackend(httpcore.AsyncNetworkBackend):
+    """
+    Backend réseau httpcore qui se connecte aux adresses validées par le
+    DnsCache au lieu de laisser le système résoudre le nom une seconde fois.
+    Le nom d'origine reste utilisé pour le SNI, la vérification TLS et le
+    regroupement des connexions.
+    """
+
+    def __init__(self, dns: DnsCache):
+        self.dns = dns
+        self._backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await self.dns.resolve(host)
+            if not addresses:
+                raise OSError(f"No address for {host}")
+        except (BlockedDestinationError, OSError) as e:
+            raise httpcore.ConnectError(str(e)) from e
+        last_error = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+        raise last_error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        raise httpcore.ConnectError("Unix sockets are not allowed for outbound fetches")
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+class PinnedTransport(httpx.AsyncHTTPTransport):
+    """Transport httpx dont toutes les connexions passent par PinnedBackend."""
+
+    def __init__(self, dns: DnsCache, *, http2: bool = False, limits: httpx.Limits | None = None):
+        # Pas de super().__init__(): il ne fait que construire un pool (et son
+        # contexte SSL) que l'on remplacerait aussitôt
+        limits = limits or httpx.Limits()
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http2=http2,
+            network_backend=PinnedBackend(dns),
+        )
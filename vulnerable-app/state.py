@@ -0,0 +1,385 @@
+"""
+État partagé entre les workers de supervisor.py, dans une base SQLite en mode WAL.
+
+On y trouve la politique d'URL publiée par le superviseur, les aperçus mis
+en cache (second niveau derrière le ResponseCache de chaque worker), les
+latences récentes par hôte qui règlent les timeouts adaptatifs, et les
+compteurs et métriques de chaque worker.
+
+Aucun accès à la base ne se fait sur la boucle d'événements. Le seul sur
+le chemin d'une requête est la lecture d'une entrée de cache absente du
+worker: une requête indexée, faite dans un thread (les lecteurs ne sont
+jamais bloqués en WAL). Les écritures passent par un thread dédié qui les
+regroupe en une transaction: une requête n'attend jamais le verrou
+d'écriture.
+"""
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from fetching import FetchPreview
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS fetch_cache (
+    key TEXT PRIMARY KEY,
+    preview TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fresh_until REAL NOT NULL,
+    stale_until REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fetch_cache_stale_until ON fetch_cache (stale_until);
+CREATE TABLE IF NOT EXISTS host_latency (
+    host TEXT NOT NULL,
+    worker INTEGER NOT NULL,
+    samples TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (host, worker)
+);
+CREATE INDEX IF NOT EXISTS host_latency_updated ON host_latency (updated);
+CREATE TABLE IF NOT EXISTS workers (
+    worker INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    updated REAL NOT NULL,
+    stats TEXT NOT NULL
+);
+"""
+
+# Latences d'un hôte oubliées après ce délai sans nouvelle mesure
+LATENCY_RETENTION = 3600.0
+# Entrées expirées gardées ce temps pour une revalidation conditionnelle (ETag, Last-Modified)
+VALIDATOR_RETENTION = 86400.0
+
+
+class SharedState:
+    """
+    Accès à la base d'état partagé. Chaque thread garde sa connexion; les
+    écritures sont confiées au thread "state-writer", démarré au premier besoin.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._queue: queue.SimpleQueue | None = None
+        self._writer: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._connect().executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls) -> "SharedState | None":
+        """État désigné par SHARED_STATE_DB (posé par supervisor.py), None en mode process unique."""
+        path = os.getenv("SHARED_STATE_DB")
+        return cls(path) if path else None
+
+    def _connect(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    # Écritures
+
+    def _submit(self, sql: str, params: tuple) -> None:
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.SimpleQueue()
+                self._writer = threading.Thread(target=self._write, args=(self._queue,),
+                                                name="state-writer", daemon=True)
+                self._writer.start()
+            pending = self._queue
+        pending.put((sql, params))
+
+    def _write(self, pending: queue.SimpleQueue) -> None:
+        db = self._connect()
+        while True:
+            batch = [pending.get()]
+            while not pending.empty():
+                batch.append(pending.get())
+            stop = None in batch
+            try:
+                db.execute("BEGIN")
+                for item in batch:
+                    if item is not None:
+                        db.execute(*item)
+                db.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.error("Shared state write failed (%d statements lost): %s", len(batch), e)
+                if db.in_transaction:
+                    db.execute("ROLLBACK")
+            if stop:
+                return
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Attend que les écritures en file soient faites."""
+        with self._lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._queue.put(None)
+                self._queue = None
+        if writer is not None:
+            writer.join(timeout)
+
+    # Politique d'URL
+
+    def publish_policy(self, rules: list[str]) -> int:
+        """Remplace les règles publiées et renvoie leur nouvelle version (appel synchrone, superviseur)."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            version = self.policy_version() + 1
+            db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           [("policy_version", str(version)), ("policy_rules", json.dumps(rules))])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return version
+
+    def policy_version(self) -> int:
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'policy_version'").fetchone()
+        return int(row[0]) if row else 0
+
+    def policy_rules(self) -> list[str]:
+        row = self._connect().execute("SELECT value FROM meta WHERE key = 'policy_rules'").fetchone()
+        return json.loads(row[0]) if row else []
+
+    # Cache des aperçus (dates en temps réel, comparables d'un process à l'autre)
+
+    def get_entry(self, key: str) -> tuple | None:
+        """(aperçu, etag, last_modified, fresh_until, stale_until) encore utilisable, sinon None."""
+        row = self._connect().execute(
+            "SELECT preview, etag, last_modified, fresh_until, stale_until FROM fetch_cache "
+            "WHERE key = ? AND (stale_until > ? OR etag IS NOT NULL OR last_modified IS NOT NULL)",
+            (key, time.time()),
+        ).fetchone()
+        if row is None:
+            return None
+        return (FetchPreview(**json.loads(row[0])), *row[1:])
+
+    def put_entry(self, key: str, preview: FetchPreview, etag: str | None, last_modified: str | None,
+                  fresh_until: float, stale_until: float) -> None:
+        self._submit(
+            "INSERT OR REPLACE INTO fetch_cache (key, preview, etag, last_modified, fresh_until, stale_until) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(dataclasses.asdict(preview)), etag, last_modified, fresh_until, stale_until),
+        )
+
+    def delete_entry(self, key: str) -> None:
+        self._submit("DELETE FROM fetch_cache WHERE key = ?", (key,))
+
+    def entries(self, limit: int) -> list[tuple]:
+        """Les entrées encore fraîches ou servables, les plus durables d'abord (démarrage à chaud)."""
+        rows = self._connect().execute(
+            "SELECT key, preview, etag, last_modified, fresh_until, stale_until FROM fetch_cache "
+            "WHERE stale_until > ? ORDER BY stale_until DESC LIMIT ?",
+            (time.time(), limit),
+        ).fetchall()
+        return [(key, FetchPreview(**json.loads(preview)), *rest) for key, preview, *rest in rows]
+
+    # Latences par hôte, une ligne par hôte et par worker
+
+    def put_latencies(self, worker: int, latencies: dict[str, list[float]]) -> None:
+        now = time.time()
+        for host, samples in latencies.items():
+            self._submit(
+                "INSERT OR REPLACE INTO host_latency (host, worker, samples, updated) VALUES (?, ?, ?, ?)",
+                (host, worker, json.dumps(samples), now),
+            )
+
+    def peer_latencies(self, worker: int, since: float = 0.0) -> list[tuple[str, int, list[float]]]:
+        """(hôte, worker, mesures) des autres workers, mises à jour après since."""
+        rows = self._connect().execute(
+            "SELECT host, worker, samples FROM host_latency WHERE worker != ? AND updated > ?",
+            (worker, max(since, time.time() - LATENCY_RETENTION)),
+        ).fetchall()
+        return [(host, peer, json.loads(samples)) for host, peer, samples in rows]
+
+    # Workers
+
+    def publish_worker(self, worker: int, started: float, stats: dict) -> None:
+        self._submit(
+            "INSERT OR REPLACE INTO workers (worker, started, updated, stats) VALUES (?, ?, ?, ?)",
+            (worker, started, time.time(), json.dumps(stats)),
+        )
+
+    def workers(self) -> list[dict]:
+        rows = self._connect().execute("SELECT worker, started, updated, stats FROM workers ORDER BY started").fetchall()
+        return [{"pid": pid, "started": started, "updated": updated, **json.loads(stats)}
+                for pid, started, updated, stats in rows]
+
+    def forget_worker(self, worker: int) -> None:
+        self._submit("DELETE FROM workers WHERE worker = ?", (worker,))
+
+    def forget_workers(self) -> None:
+        """Oublie les workers d'une exécution précédente (état restauré d'un snapshot)."""
+        self._connect().execute("DELETE FROM workers")
+
+    # Maintenance (superviseur)
+
+    def purge(self, max_entries: int = 100000) -> None:
+        """
+        Supprime les entrées de cache périmées (après VALIDATOR_RETENTION si
+        elles ont un validateur), puis les moins durables au-delà de
+        max_entries, et les latences trop anciennes.
+        """
+        now = time.time()
+        db = self._connect()
+        db.execute(
+            "DELETE FROM fetch_cache WHERE stale_until <= ? AND "
+            "(stale_until <= ? OR (etag IS NULL AND last_modified IS NULL))",
+            (now, now - VALIDATOR_RETENTION),
+        )
+        db.execute(
+            "DELETE FROM fetch_cache WHERE key NOT IN "
+            "(SELECT key FROM fetch_cache ORDER BY stale_until DESC LIMIT ?)",
+            (max_entries,),
+        )
+        db.execute("DELETE FROM host_latency WHERE updated <= ?", (now - LATENCY_RETENTION,))
+
+    def snapshot(self, path: str) -> None:
+        """Copie cohérente de la base vers path, remplacé d'un coup."""
+        temporary = f"{path}.tmp"
+        target = sqlite3.connect(temporary)
+        try:
+            self._connect().backup(target)
+        finally:
+            target.close()
+        os.replace(temporary, path)
+
+    @staticmethod
+    def restore(snapshot: str, path: str) -> bool:
+        """Recrée la base path depuis snapshot s'il existe; False sinon."""
+        if not os.path.exists(snapshot):
+            return False
+        for stale in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(stale):
+                os.unlink(stale)
+        source = sqlite3.connect(snapshot)
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+        return True
+
+
+def worker_stats(admission, cache, registry) -> dict:
+    """Ce que chaque worker publie: compteurs d'admission et de cache, métriques exportées."""
+    return {
+        "admission": admission.stats(),
+        "cache": cache.stats(),
+        "metrics": registry.export(),
+    }
+
+
+def summarize(workers: list[dict]) -> dict:
+    """Réponse de /workers: chaque worker et la somme de leurs compteurs."""
+    total = {}
+    for section in ("admission", "cache"):
+        sums = {}
+        for worker in workers:
+            for name, value in worker.get(section, {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and not name.endswith("ratio"):
+                    sums[name] = sums.get(name, 0) + value
+        total[section] = sums
+    return {
+        "count": len(workers),
+        "total": total,
+        "workers": [{key: value for key, value in worker.items() if key != "metrics"} for worker in workers],
+    }
+
+
+class StateSync:
+    """
+    Lien d'un worker avec l'état partagé: démarrage à chaud depuis la base,
+    puis toutes les interval secondes, publication de ses compteurs et des
+    latences mesurées, et récupération de celles des autres workers.
+    """
+
+    def __init__(self, state: SharedState, admission, cache, registry, interval: float = 1.0):
+        self.state = state
+        self.admission = admission
+        self.cache = cache
+        self.registry = registry
+        self.interval = interval
+        self.worker = os.getpid()
+        self.started = time.time()
+        self._since = 0.0
+        self._task: asyncio.Task | None = None
+
+    def _warm(self) -> tuple[int, list]:
+        restored = 0
+        for key, preview, etag, last_modified, fresh_until, stale_until in self.state.entries(10000):
+            if not self.cache.restore(key, preview, etag, last_modified, fresh_until, stale_until, evict=False):
+                break
+            restored += 1
+        return restored, self.state.peer_latencies(self.worker)
+
+    def _exchange(self, latencies: dict[str, list[float]], stats: dict, since: float) -> list:
+        self.state.put_latencies(self.worker, latencies)
+        self.state.publish_worker(self.worker, self.started, stats)
+        return self.state.peer_latencies(self.worker, since)
+
+    async def sync(self) -> None:
+        # Lecture des compteurs dans la boucle, accès à la base dans un thread
+        latencies = self.admission.latency_updates()
+        stats = worker_stats(self.admission, self.cache, self.registry)
+        now = time.time()
+        peers = await asyncio.to_thread(self._exchange, latencies, stats, self._since)
+        # Marge d'un intervalle: une écriture concurrente n'est jamais manquée
+        self._since = now - self.interval
+        self.admission.merge_peer_latencies(peers)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sync()
+            except sqlite3.Error as e:
+                logger.error("Shared state sync failed: %s", e)
+
+    async def start(self) -> None:
+        restored, peers = await asyncio.to_thread(self._warm)
+        self.admission.merge_peer_latencies(peers)
+        logger.info("Worker %d warmed from shared state: %d cached previews, %d host latency series",
+                    self.worker, restored, len(peers))
+        await self.sync()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.state.close)
+
+    def _peer_metrics(self) -> list[dict]:
+        return [worker["metrics"] for worker in self.state.workers()
+                if worker["pid"] != self.worker and "metrics" in worker]
+
+    async def peer_metrics(self) -> list[dict]:
+        """Métriques exportées par les autres workers, à additionner aux siennes."""
+        return await asyncio.to_thread(self._peer_metrics)
+
+    async def summary(self) -> dict:
+        workers = await asyncio.to_thread(self.state.workers)
+        # Ses propres compteurs à jour plutôt que ceux de la dernière publication
+        local = {"pid": self.worker, "started": self.started, "updated": time.time(),
+                 **worker_stats(self.admission, self.cache, self.registry)}
+        return summarize([local, *(worker for worker in workers if worker["pid"] != self.worker)])
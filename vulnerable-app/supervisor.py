@@ -0,0 +1,319 @@
+"""
+Mode multi-worker: plusieurs process uvicorn servent le même port.
+
+    python supervisor.py --host 0.0.0.0 --port 8000 --workers 4
+
+Sans --workers: WEB_CONCURRENCY, sinon un worker par coeur utilisable
+(affinité CPU du process et quota CPU du cgroup, pas les coeurs de
+l'hôte: dans un conteneur, ce n'est pas la même chose). Sous Linux,
+chaque worker ouvre sa propre socket d'écoute avec SO_REUSEPORT et le noyau
+répartit les connexions entre elles: pas de process d'acceptation commun,
+ni de worker qui réveille tous les autres. Ailleurs, le superviseur ouvre
+une seule socket que les workers se partagent.
+
+Le superviseur:
+  - crée l'état partagé (state.SharedState, SHARED_STATE_DB ou un fichier
+    temporaire) et le restaure depuis STATE_SNAPSHOT s'il existe: les
+    workers démarrent avec le cache d'aperçus et les latences par hôte de
+    l'exécution précédente;
+  - est le seul à surveiller URL_POLICY_FILE et publie ses règles, que
+    tous les workers appliquent à la même version;
+  - relance un worker qui s'arrête, et écrit STATE_SNAPSHOT toutes les
+    STATE_SNAPSHOT_INTERVAL secondes et à l'arrêt.
+
+Les places de fetch (ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE) valent
+pour l'ensemble: chaque worker en applique sa part (WORKER_COUNT). Les
+débits par client et par hôte restent entiers dans chaque worker.
+
+Restent propres à chaque worker: la coalescence des requêtes identiques, le
+cache DNS, les connexions amont et les spans: /traces ne voit que le worker qui
+répond, et TRACE_FILE devient un fichier par worker (nom.w<N>.jsonl), à
+fusionner avec shared.waterfall. /metrics et /workers additionnent les
+workers.
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from multiprocessing.connection import wait
+
+import uvicorn
+
+from policy import read_rules
+from shared.logs import setup_logging
+from state import SharedState
+
+logger = logging.getLogger("supervisor")
+
+# SO_REUSEPORT ne répartit les connexions entre les sockets que sous Linux
+REUSE_PORT = sys.platform.startswith("linux") and hasattr(socket, "SO_REUSEPORT")
+
+# Un worker qui meurt avant ce délai est relancé avec un délai croissant
+MIN_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+# Au-delà de ce nombre d'échecs rapides consécutifs, le superviseur abandonne
+MAX_QUICK_FAILURES = 5
+
+
+def listen_socket(host: str, port: int, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def worker_trace_file(path: str, index: int) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{index}{ext}"
+
+
+def run_worker(app: str, factory: bool, host: str, port: int, sock: socket.socket | None, index: int) -> None:
+    """Point d'entrée d'un worker: importe l'application et sert jusqu'à SIGTERM."""
+    if os.getenv("TRACE_FILE"):
+        # Avant l'import de l'application, qui crée son tracer
+        os.environ["TRACE_FILE"] = worker_trace_file(os.environ["TRACE_FILE"], index)
+    if sock is None:
+        sock = listen_socket(host, port, reuse_port=True)
+    config = uvicorn.Config(app, factory=factory, host=host, port=port)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Worker:
+    __slots__ = ("index", "process", "started", "quick_failures", "restart_at")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: multiprocessing.Process | None = None
+        self.started = 0.0
+        self.quick_failures = 0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    def __init__(self, app: str, host: str, port: int, workers: int, state: SharedState,
+                 factory: bool = False, policy_file: str | None = None, policy_interval: float = 5.0,
+                 snapshot: str | None = None, snapshot_interval: float = 60.0,
+                 graceful_timeout: float = 30.0, cache_max_entries: int = 100000):
+        self.app = app
+        self.factory = factory
+        self.host = host
+        self.port = port
+        self.state = state
+        self.policy_file = policy_file
+        self.policy_interval = policy_interval
+        self.snapshot = snapshot
+        self.snapshot_interval = snapshot_interval
+        self.graceful_timeout = graceful_timeout
+        self.cache_max_entries = cache_max_entries
+        self.workers = [Worker(index) for index in range(workers)]
+        self.stopping = False
+        self.exit_code = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._socket: socket.socket | None = None
+        self._policy_mtime: float | None = None
+        self._policy_published = False
+
+    def _spawn(self, worker: Worker) -> None:
+        worker.process = self._context.Process(
+            target=run_worker,
+            args=(self.app, self.factory, self.host, self.port, self._socket, worker.index),
+            name=f"worker-{worker.index}",
+        )
+        worker.process.start()
+        worker.started = time.monotonic()
+        logger.info("Started worker %d (pid %d)", worker.index, worker.process.pid)
+
+    def _reaped(self, worker: Worker) -> None:
+        process = worker.process
+        worker.process = None
+        self.state.forget_worker(process.pid)
+        if self.stopping:
+            return
+        uptime = time.monotonic() - worker.started
+        worker.quick_failures = worker.quick_failures + 1 if uptime < MIN_UPTIME else 0
+        if worker.quick_failures >= MAX_QUICK_FAILURES:
+            logger.error("Worker %d keeps failing at startup (exit code %s), stopping",
+                         worker.index, process.exitcode)
+            self.stopping, self.exit_code = True, 1
+            return
+        delay = min(2 ** worker.quick_failures - 1, MAX_RESTART_DELAY) if worker.quick_failures else 0
+        worker.restart_at = time.monotonic() + delay
+        logger.warning("Worker %d (pid %d) exited with code %s after %.1fs, restarting in %ds",
+                       worker.index, process.pid, process.exitcode, uptime, delay)
+
+    def publish_policy(self) -> None:
+        """Publie les règles de URL_POLICY_FILE quand le fichier change; au démarrage, toujours."""
+        mtime, rules = None, []
+        if self.policy_file:
+            try:
+                mtime = os.stat(self.policy_file).st_mtime
+                if self._policy_published and mtime == self._policy_mtime:
+                    return
+                rules = read_rules(self.policy_file)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error("Policy reload failed for %s: %s", self.policy_file, e)
+                # Les workers gardent les règles déjà publiées
+                if self._policy_published:
+                    return
+                mtime = None
+        elif self._policy_published:
+            return
+        try:
+            version = self.state.publish_policy(rules)
+        except sqlite3.Error as e:
+            # Nouvel essai à la prochaine vérification
+            logger.error("Policy publication failed: %s", e)
+            return
+        self._policy_mtime, self._policy_published = mtime, True
+        logger.info("Published URL policy version %d (%d rules)", version, len(rules))
+
+    def save_snapshot(self) -> None:
+        if not self.snapshot:
+            return
+        try:
+            self.state.purge(self.cache_max_entries)
+            self.state.snapshot(self.snapshot)
+        except (OSError, sqlite3.Error) as e:
+            logger.error("State snapshot to %s failed: %s", self.snapshot, e)
+
+    def _stop(self, signum, frame) -> None:
+        self.stopping = True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        if not REUSE_PORT:
+            self._socket = listen_socket(self.host, self.port, reuse_port=False)
+        self.publish_policy()
+        for worker in self.workers:
+            self._spawn(worker)
+        logger.info("Serving on %s:%d with %d workers (%s)", self.host, self.port, len(self.workers),
+                    "SO_REUSEPORT" if REUSE_PORT else "shared socket")
+
+        next_policy = time.monotonic() + self.policy_interval
+        next_snapshot = time.monotonic() + self.snapshot_interval
+        while not self.stopping:
+            running = {worker.process.sentinel: worker for worker in self.workers if worker.process is not None}
+            for sentinel in wait(list(running), timeout=0.5):
+                running[sentinel].process.join()
+                self._reaped(running[sentinel])
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process is None and not self.stopping and now >= worker.restart_at:
+                    self._spawn(worker)
+            if now >= next_policy:
+                self.publish_policy()
+                next_policy = now + self.policy_interval
+            if now >= next_snapshot:
+                self.save_snapshot()
+                next_snapshot = now + self.snapshot_interval
+
+        self.shutdown()
+        return self.exit_code
+
+    def shutdown(self) -> None:
+        """SIGTERM à chaque worker (uvicorn termine les requêtes en cours), SIGKILL après graceful_timeout."""
+        running = [worker.process for worker in self.workers if worker.process is not None]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + self.graceful_timeout
+        for process in running:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning("Worker pid %d did not stop in time, killing it", process.pid)
+                process.kill()
+                process.join()
+            self.state.forget_worker(process.pid)
+        # Le snapshot doit voir les écritures encore en file
+        self.state.close()
+        self.save_snapshot()
+        logger.info("Stopped")
+
+
+def available_cpus() -> int:
+    """Coeurs utilisables: ceux de l'affinité du process, bornés par le quota CPU du cgroup (v2)."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(math.ceil(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def default_workers() -> int:
+    return int(os.getenv("WEB_CONCURRENCY") or 0) or available_cpus()
+
+
+def state_path(port: int) -> tuple[str, bool]:
+    """(chemin de la base, à supprimer à l'arrêt): SHARED_STATE_DB, ou un fichier en mémoire partagée."""
+    if os.getenv("SHARED_STATE_DB"):
+        return os.environ["SHARED_STATE_DB"], False
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"vulnerable-app-{port}-{os.getpid()}.db"), True
+
+
+def serve(app: str, host: str, port: int, workers: int, factory: bool = False) -> int:
+    """Lance le superviseur jusqu'à SIGTERM ou SIGINT; renvoie le code de sortie."""
+    setup_logging("vulnerable-app")
+    path, temporary = state_path(port)
+    snapshot = os.getenv("STATE_SNAPSHOT") or None
+    if snapshot and SharedState.restore(snapshot, path):
+        logger.info("Restored shared state from %s", snapshot)
+    state = SharedState(path)
+    state.purge()
+    state.forget_workers()
+    # Les workers (spawn) héritent de l'environnement au moment de leur création
+    os.environ["SHARED_STATE_DB"] = path
+    # Les places de fetch sont réparties entre les workers (AdmissionLimits.per_worker)
+    os.environ["WORKER_COUNT"] = str(max(workers, 1))
+
+    supervisor = Supervisor(
+        app, host, port, max(workers, 1), state,
+        factory=factory,
+        policy_file=os.getenv("URL_POLICY_FILE"),
+        policy_interval=float(os.getenv("URL_POLICY_RELOAD_INTERVAL", "5")),
+        snapshot=snapshot,
+        snapshot_interval=float(os.getenv("STATE_SNAPSHOT_INTERVAL", "60")),
+        graceful_timeout=float(os.getenv("GRACEFUL_TIMEOUT", "30")),
+        cache_max_entries=int(os.getenv("STATE_CACHE_MAX_ENTRIES", "100000")),
+    )
+    try:
+        return supervisor.run()
+    finally:
+        if temporary:
+            for leftover in (path, f"{path}-wal", f"{path}-shm"):
+                try:
+                    os.unlink(leftover)
+                except FileNotFoundError:
+                    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--app", default="main:app", help="application uvicorn (module:attribut)")
+    parser.add_argument("--factory", action="store_true", help="--app est une fonction qui crée l'application")
+    args = parser.parse_args()
+    return serve(args.app, args.host, args.port, args.workers, args.factory)
+
+
+if __name__ == "__main__":
+    sys.exit(main())